@@ -0,0 +1,28 @@
+"""
+添加 status 字段到 messages 表
+complete 为完整回复，truncated 为客户端断开时保存的部分回复
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def add_message_status_column():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        # 检查列是否已存在
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='messages' AND column_name='status'
+        """))
+        
+        if result.fetchone() is None:
+            print("添加 status 列...")
+            conn.execute(text("ALTER TABLE messages ADD COLUMN status VARCHAR DEFAULT 'complete'"))
+            conn.commit()
+            print("✓ status 列添加成功")
+        else:
+            print("status 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_message_status_column()
@@ -0,0 +1,28 @@
+"""
+添加 adapter 字段到 ai_models 表
+声明固定模型使用的流式响应适配器（openai / reasoning / glm / thinking），为空时自动判断
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def add_model_adapter_column():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        # 检查列是否已存在
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='ai_models' AND column_name='adapter'
+        """))
+        
+        if result.fetchone() is None:
+            print("添加 adapter 列...")
+            conn.execute(text("ALTER TABLE ai_models ADD COLUMN adapter VARCHAR"))
+            conn.commit()
+            print("✓ adapter 列添加成功")
+        else:
+            print("adapter 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_model_adapter_column()
@@ -0,0 +1,28 @@
+"""
+添加 context_window 字段到 ai_models 表
+用于按模型的上下文窗口限制提示词的Token数
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def add_context_window_column():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        # 检查列是否已存在
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='ai_models' AND column_name='context_window'
+        """))
+        
+        if result.fetchone() is None:
+            print("添加 context_window 列...")
+            conn.execute(text("ALTER TABLE ai_models ADD COLUMN context_window INTEGER"))
+            conn.commit()
+            print("✓ context_window 列添加成功")
+        else:
+            print("context_window 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_context_window_column()
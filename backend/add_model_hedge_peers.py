@@ -0,0 +1,28 @@
+"""
+添加 hedge_model_ids 字段到 ai_models 表
+声明对冲/备用模型（其他提供商上的同一模型），用于降低首Token延迟
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def add_hedge_model_ids_column():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        # 检查列是否已存在
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='ai_models' AND column_name='hedge_model_ids'
+        """))
+        
+        if result.fetchone() is None:
+            print("添加 hedge_model_ids 列...")
+            conn.execute(text("ALTER TABLE ai_models ADD COLUMN hedge_model_ids JSON"))
+            conn.commit()
+            print("✓ hedge_model_ids 列添加成功")
+        else:
+            print("hedge_model_ids 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_hedge_model_ids_column()
@@ -0,0 +1,37 @@
+"""
+添加列表分页使用的复合索引
+索引与排序键 (order, id) / (display_order, id) / (created_at, id) 一致，游标翻页时只扫描一页的行
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+INDEXES = [
+    ("ix_chapters_volume_order", 'chapters (volume_id, "order", id)'),
+    ("ix_prompt_templates_created", "prompt_templates (created_at, id)"),
+    ("ix_rpg_characters_project_order", "rpg_characters (project_id, display_order, id)"),
+    ("ix_organizations_project_order", "organizations (project_id, display_order, id)"),
+    ("ix_supernatural_powers_project_order", "supernatural_powers (project_id, display_order, id)"),
+    ("ix_weapons_project_order", "weapons (project_id, display_order, id)"),
+    ("ix_dungeons_project_order", "dungeons (project_id, display_order, id)"),
+    ("ix_conversations_created", "conversations (created_at, id)"),
+    ("ix_messages_conversation_created", "messages (conversation_id, created_at, id)"),
+]
+
+def add_pagination_indexes():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+    with engine.connect() as conn:
+        for name, definition in INDEXES:
+            # 检查索引是否已存在
+            result = conn.execute(text("SELECT indexname FROM pg_indexes WHERE indexname=:name"), {"name": name})
+
+            if result.fetchone() is None:
+                print(f"添加索引 {name}...")
+                conn.execute(text(f"CREATE INDEX {name} ON {definition}"))
+                conn.commit()
+                print(f"✓ {name} 添加成功")
+            else:
+                print(f"{name} 已存在，跳过")
+
+if __name__ == "__main__":
+    add_pagination_indexes()
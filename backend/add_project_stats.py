@@ -0,0 +1,46 @@
+"""
+添加统计计数字段到 projects 和 volumes 表
+chapter_count / word_count / last_edited_chapter_id 由 project_stats 增量维护，添加后按现有章节统计一次
+"""
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from database import SQLALCHEMY_DATABASE_URL
+
+COLUMNS = [
+    ("chapter_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("word_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("last_edited_chapter_id", "INTEGER"),
+]
+
+def add_stats_columns():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+    with engine.connect() as conn:
+        for table in ("projects", "volumes"):
+            for column, definition in COLUMNS:
+                # 检查列是否已存在
+                result = conn.execute(text("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_name=:table AND column_name=:column
+                """), {"table": table, "column": column})
+
+                if result.fetchone() is None:
+                    print(f"添加 {table}.{column} 列...")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                    conn.commit()
+                    print(f"✓ {table}.{column} 列添加成功")
+                else:
+                    print(f"{table}.{column} 列已存在，跳过")
+
+    # 按现有章节统计一次
+    from project_stats import repair_stats
+    db = sessionmaker(bind=engine)()
+    try:
+        count = repair_stats(db)
+        print(f"✓ 已统计 {count} 个项目")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    add_stats_columns()
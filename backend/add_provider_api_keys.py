@@ -0,0 +1,28 @@
+"""
+添加 api_keys 字段到 ai_providers 表
+保存提供商的额外API密钥，与 api_key 组成密钥池
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+def add_api_keys_column():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        # 检查列是否已存在
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='ai_providers' AND column_name='api_keys'
+        """))
+        
+        if result.fetchone() is None:
+            print("添加 api_keys 列...")
+            conn.execute(text("ALTER TABLE ai_providers ADD COLUMN api_keys JSON"))
+            conn.commit()
+            print("✓ api_keys 列添加成功")
+        else:
+            print("api_keys 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_api_keys_column()
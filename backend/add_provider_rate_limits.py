@@ -0,0 +1,31 @@
+"""
+添加 rpm_limit / tpm_limit / max_concurrency 字段到 ai_providers 表
+用于按提供商限制每分钟请求数、每分钟Token数和并发请求数
+"""
+from sqlalchemy import create_engine, text
+from database import SQLALCHEMY_DATABASE_URL
+
+COLUMNS = ["rpm_limit", "tpm_limit", "max_concurrency"]
+
+def add_rate_limit_columns():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    
+    with engine.connect() as conn:
+        for column in COLUMNS:
+            # 检查列是否已存在
+            result = conn.execute(text("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name='ai_providers' AND column_name=:column
+            """), {"column": column})
+            
+            if result.fetchone() is None:
+                print(f"添加 {column} 列...")
+                conn.execute(text(f"ALTER TABLE ai_providers ADD COLUMN {column} INTEGER"))
+                conn.commit()
+                print(f"✓ {column} 列添加成功")
+            else:
+                print(f"{column} 列已存在，跳过")
+
+if __name__ == "__main__":
+    add_rate_limit_columns()
@@ -0,0 +1,128 @@
+"""
+AI 提供商流式响应适配器
+
+不同提供商在流式 delta 中放思考过程的字段不同，适配器把 delta 统一解析为 (思考过程, 回复内容)：
+    openai     content，思考过程在 reasoning_content（OpenAI 兼容接口、DeepSeek 等）
+    reasoning  思考过程在 reasoning（OpenRouter 等）
+    glm        智谱 GLM，思考过程在 reasoning 或 reasoning_content
+    thinking   思考过程在 thinking（部分 Claude 兼容代理）
+
+AIModel.adapter 可以固定使用某个适配器；未固定时根据模型名称和首个有内容的 delta 判断一次，
+结果按模型缓存，之后的请求不再判断。
+"""
+import threading
+from typing import Dict, Optional, Tuple
+
+from app_logging import get_logger
+
+logger = get_logger("adapters")
+
+
+class AIResponseAdapter:
+    name = ""
+    # delta 中出现该字段即可判定使用此适配器
+    detect_field: Optional[str] = None
+
+    def parse(self, delta: dict) -> Tuple[Optional[str], Optional[str]]:
+        raise NotImplementedError
+
+
+class DefaultAdapter(AIResponseAdapter):
+    name = "openai"
+    detect_field = "reasoning_content"
+
+    def parse(self, delta):
+        return delta.get("reasoning_content"), delta.get("content")
+
+
+class ReasoningAdapter(AIResponseAdapter):
+    name = "reasoning"
+    detect_field = "reasoning"
+
+    def parse(self, delta):
+        return delta.get("reasoning"), delta.get("content")
+
+
+class GLMAdapter(AIResponseAdapter):
+    name = "glm"
+
+    def parse(self, delta):
+        return delta.get("reasoning") or delta.get("reasoning_content"), delta.get("content")
+
+
+class ThinkingAdapter(AIResponseAdapter):
+    name = "thinking"
+    detect_field = "thinking"
+
+    def parse(self, delta):
+        return delta.get("thinking"), delta.get("content")
+
+
+ADAPTERS: Dict[str, AIResponseAdapter] = {
+    adapter.name: adapter
+    for adapter in (DefaultAdapter(), ReasoningAdapter(), GLMAdapter(), ThinkingAdapter())
+}
+DEFAULT_ADAPTER = "openai"
+# 按字段判断的顺序：同时出现 reasoning 和 reasoning_content 时以 reasoning 为准
+DETECT_ORDER = ("reasoning", "openai", "thinking")
+
+
+def adapter_for_name(model_identifier: str) -> Optional[str]:
+    """仅凭模型名称即可确定的适配器"""
+    name = (model_identifier or "").lower()
+    if "glm" in name or "zhipu" in name:
+        return "glm"
+    return None
+
+
+def detect_adapter(model_identifier: str, delta: dict) -> Optional[str]:
+    """根据模型名称和 delta 判断适配器；delta 还不足以判断（例如只有 role）时返回 None"""
+    by_name = adapter_for_name(model_identifier)
+    if by_name:
+        return by_name
+    for name in DETECT_ORDER:
+        if ADAPTERS[name].detect_field in delta:
+            return name
+    if delta.get("content"):
+        # 直接开始输出回复，没有思考过程字段
+        return DEFAULT_ADAPTER
+    return None
+
+
+class AdapterRegistry:
+    """按模型id缓存判断出的适配器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resolved: Dict[int, str] = {}
+
+    def for_model(self, model) -> Optional[AIResponseAdapter]:
+        """model 需要 id 和 adapter 字段；已固定或已判断过时返回适配器，否则返回 None"""
+        if model.adapter in ADAPTERS:
+            return ADAPTERS[model.adapter]
+        with self._lock:
+            name = self._resolved.get(model.id)
+        return ADAPTERS[name] if name else None
+
+    def detect(self, model, delta: dict) -> Tuple[AIResponseAdapter, bool]:
+        """判断适配器，返回 (适配器, 是否已确定)；无法确定时暂用默认适配器，下一个 delta 再判断"""
+        name = detect_adapter(model.model_identifier, delta)
+        if name is None:
+            return ADAPTERS[DEFAULT_ADAPTER], False
+        with self._lock:
+            if self._resolved.get(model.id) != name:
+                logger.info("模型 %s 使用 %s 适配器", model.model_identifier, name)
+            self._resolved[model.id] = name
+        return ADAPTERS[name], True
+
+    def forget(self, model_id: int):
+        """模型配置变化后重新判断"""
+        with self._lock:
+            self._resolved.pop(model_id, None)
+
+    def stats(self) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._resolved)
+
+
+adapters = AdapterRegistry()
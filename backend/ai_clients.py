@@ -0,0 +1,158 @@
+"""
+AI 提供商的共享 HTTP 客户端
+
+每个 (提供商id, base_url) 在应用生命周期内复用一个 httpx.AsyncClient，
+保持长连接池，避免每条消息都重新进行 TCP+TLS 握手。
+提供商更新或删除后对应的客户端会被替换，旧客户端在其上的请求全部结束后关闭。
+"""
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app_logging import get_logger
+from models import AIProvider
+
+logger = get_logger("ai_clients")
+
+AI_HTTP_TIMEOUT = float(os.getenv("AI_HTTP_TIMEOUT", "60"))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "10"))
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20"))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "60"))
+AI_HTTP2 = os.getenv("AI_HTTP2", "false").lower() in ("1", "true", "yes")
+AI_HTTP_PREWARM = os.getenv("AI_HTTP_PREWARM", "true").lower() in ("1", "true", "yes")
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_BASE_URL = "https://api.openai.com"
+
+
+class _ClientHandle:
+    def __init__(self, client: httpx.AsyncClient, loop):
+        self.client = client
+        self.loop = loop
+        self.in_flight = 0
+        self.retired = False
+
+
+class AIClientRegistry:
+    """按提供商管理的 AsyncClient 注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles: Dict[Tuple[int, str], _ClientHandle] = {}
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_HTTP_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=AI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=AI_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=AI_HTTP2 and HTTP2_AVAILABLE,
+        )
+
+    def _handle_for(self, provider_id: int, base_url: Optional[str]) -> _ClientHandle:
+        key = (provider_id, base_url or DEFAULT_BASE_URL)
+        loop = asyncio.get_running_loop()
+        stale = []
+        with self._lock:
+            handle = self._handles.get(key)
+            # 连接与创建它的事件循环绑定，循环变化时需要重建
+            if handle is None or handle.loop is not loop:
+                if handle is not None:
+                    stale.append(handle)
+                # 同一提供商的旧 base_url 不再使用
+                for other_key in [k for k in self._handles if k[0] == provider_id and k != key]:
+                    stale.append(self._handles.pop(other_key))
+                handle = _ClientHandle(self._build_client(), loop)
+                self._handles[key] = handle
+        for old in stale:
+            self._retire(old)
+        return handle
+
+    @asynccontextmanager
+    async def client(self, provider_id: int, base_url: Optional[str]):
+        """取得提供商的共享客户端，在上下文内使用"""
+        handle = self._handle_for(provider_id, base_url)
+        handle.in_flight += 1
+        try:
+            yield handle.client
+        finally:
+            handle.in_flight -= 1
+            if handle.retired and handle.in_flight == 0:
+                await handle.client.aclose()
+
+    def _retire(self, handle: _ClientHandle):
+        """标记客户端退役，没有进行中的请求时立即关闭"""
+        handle.retired = True
+        if handle.in_flight == 0 and not handle.client.is_closed and not handle.loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(handle.client.aclose(), handle.loop)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def invalidate(self, provider_id: int):
+        """提供商配置变化后丢弃其客户端，下次使用时重建"""
+        with self._lock:
+            handles = [self._handles.pop(k) for k in list(self._handles) if k[0] == provider_id]
+        for handle in handles:
+            self._retire(handle)
+
+    async def prewarm(self, providers):
+        """预先建立到已启用提供商的连接，失败不影响启动"""
+        async def warm(provider_id, base_url):
+            parts = urlsplit(base_url or DEFAULT_BASE_URL)
+            origin = f"{parts.scheme}://{parts.netloc}/"
+            try:
+                async with self.client(provider_id, base_url) as client:
+                    await client.head(origin, timeout=AI_HTTP_CONNECT_TIMEOUT)
+            except Exception as e:
+                logger.warning("连接预热 %s 失败: %s", origin, type(e).__name__)
+
+        await asyncio.gather(*(warm(pid, url) for pid, url in providers))
+
+    async def aclose(self):
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for handle in handles:
+            await handle.client.aclose()
+
+
+ai_clients = AIClientRegistry()
+
+
+# --- 提供商更新或删除后重建客户端 ---
+
+_PENDING_KEY = "ai_client_provider_ids"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_provider_ids(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, AIProvider) and obj.id is not None:
+            session.info.setdefault(_PENDING_KEY, set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_provider_clients(session):
+    for provider_id in session.info.pop(_PENDING_KEY, ()):
+        ai_clients.invalidate(provider_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_provider_ids(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,181 @@
+"""
+结构化日志
+
+替代热路径上的 print：
+    - 按级别过滤（LOG_LEVEL），提示词和回复正文只在 DEBUG 级别输出
+    - 每个HTTP请求分配关联id（请求头 X-Request-ID 或自动生成），通过 contextvars 传到
+      线程池和后台生成任务中，同一请求的日志可以串起来
+    - 逐个分片的事件按 LOG_CHUNK_SAMPLE_RATE 采样
+    - 日志记录先放入有界队列，由后台线程写出（QueueHandler/QueueListener），
+      写 stdout 不阻塞事件循环；队列满时丢弃并计数
+LOG_FORMAT=json 时每行输出一个 JSON 对象，便于采集。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_CHUNK_SAMPLE_RATE = float(os.getenv("LOG_CHUNK_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "storyforge"
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id(value: Optional[str] = None) -> str:
+    """设置当前上下文的请求关联id，返回该id"""
+    request_id = (value or uuid.uuid4().hex[:12])[:64]
+    request_id_var.set(request_id)
+    return request_id
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用方"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 在调用方线程中补上关联id（QueueHandler 之后的过滤器在写出线程中运行）
+        record.request_id = request_id_var.get()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_stream_handler: Optional[logging.Handler] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """配置 storyforge 日志：有界队列 + 后台写出线程，重复调用只生效一次"""
+    global _listener, _queue_handler, _stream_handler
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    if _listener is not None:
+        return
+    if _stream_handler is None:
+        _stream_handler = logging.StreamHandler(sys.stdout)
+        _stream_handler.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+        _stream_handler.addFilter(RequestIdFilter())
+    else:
+        # shutdown_logging 之后重新启用队列
+        logger.removeHandler(_stream_handler)
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    logger.addHandler(_queue_handler)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志；之后的日志（如应用关闭过程中的）直接同步写出，不再进入队列"""
+    global _listener
+    if _listener is not None:
+        logger = logging.getLogger(ROOT_LOGGER)
+        # 先换上直接写出的处理器再停止写出线程，停止期间记录的日志也不会丢失
+        logger.addHandler(_stream_handler)
+        logger.removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def sampled(rate: float = None) -> bool:
+    """逐个分片的事件是否记录本次（按 LOG_CHUNK_SAMPLE_RATE 采样）"""
+    rate = LOG_CHUNK_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class RequestIdMiddleware:
+    """为每个HTTP请求设置关联id，并在响应头 X-Request-ID 中返回
+
+    纯ASGI中间件，不包装响应体，流式响应不受影响。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        request_id = new_request_id(incoming).encode("latin-1")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id)]
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
+
+
+def logging_stats() -> dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel()),
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+    }
+
+
+setup_logging()
@@ -0,0 +1,102 @@
+"""
+/api/chat 并发压测
+
+启动本地模拟AI提供商和后端服务（临时 SQLite 数据库），同时发起 N 个非流式对话请求，
+在等待AI回复期间持续请求 /api/projects，统计无关接口的延迟，验证对话不会阻塞其他请求。
+
+用法: python bench_chat_concurrency.py [并发数] [模拟AI延迟秒数]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+CONCURRENCY = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+AI_DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+MOCK_PORT = 8901
+APP_PORT = 8902
+
+# 必须在导入 main 之前设置
+_db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["AI_HTTP_PREWARM"] = "false"
+
+import httpx  # noqa: E402
+
+from mock_ai_provider import create_app, serve_in_thread  # noqa: E402
+from main import app  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import AIProvider, AIModel  # noqa: E402
+
+
+def seed_model():
+    db = SessionLocal()
+    try:
+        provider = AIProvider(name="Mock", base_url=f"http://127.0.0.1:{MOCK_PORT}", api_key="mock-key", enabled=True)
+        db.add(provider)
+        db.commit()
+        model = AIModel(provider_id=provider.id, name="mock", model_identifier="mock-model", temperature=0.7, max_tokens=256)
+        db.add(model)
+        db.commit()
+        return model.id
+    finally:
+        db.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(model_id):
+    base = f"http://127.0.0.1:{APP_PORT}"
+    limits = httpx.Limits(max_connections=CONCURRENCY + 10)
+    async with httpx.AsyncClient(base_url=base, timeout=120, limits=limits) as client:
+        # 基线：没有对话请求时的接口延迟
+        baseline = []
+        for _ in range(20):
+            started = time.perf_counter()
+            await client.get("/api/projects")
+            baseline.append((time.perf_counter() - started) * 1000)
+
+        async def chat(i):
+            started = time.perf_counter()
+            response = await client.post("/api/chat", json={"message": f"压测消息 {i}", "ai_model_id": model_id})
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        chats = [asyncio.create_task(chat(i)) for i in range(CONCURRENCY)]
+
+        # 对话进行期间持续请求无关接口
+        during = []
+        while not all(task.done() for task in chats):
+            probe = time.perf_counter()
+            await client.get("/api/projects")
+            during.append((time.perf_counter() - probe) * 1000)
+            await asyncio.sleep(0.05)
+        chat_times = await asyncio.gather(*chats)
+        wall = time.perf_counter() - started
+
+    print(f"并发对话: {CONCURRENCY}，模拟AI延迟: {AI_DELAY}s")
+    print(f"全部对话完成耗时: {wall:.2f}s（串行约需 {CONCURRENCY * AI_DELAY:.0f}s）")
+    print(f"单次对话耗时 p50={statistics.median(chat_times):.2f}s max={max(chat_times):.2f}s")
+    print(f"/api/projects 基线延迟   p50={statistics.median(baseline):.1f}ms p95={percentile(baseline, 0.95):.1f}ms")
+    print(f"/api/projects 对话期间延迟 p50={statistics.median(during):.1f}ms "
+          f"p95={percentile(during, 0.95):.1f}ms max={max(during):.1f}ms（{len(during)} 次）")
+
+
+def main():
+    mock = serve_in_thread(create_app(delay=AI_DELAY), MOCK_PORT)
+    server = serve_in_thread(app, APP_PORT)
+    try:
+        asyncio.run(run(seed_model()))
+    finally:
+        server.should_exit = True
+        mock.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+项目列表统计压测
+
+在临时 SQLite 数据库中创建若干项目、每个项目大量长章节，比较三种获取章节数和字数的方式：
+    joinedload  最初的做法：加载所有项目及其全部章节（含正文），在 Python 中计数、求和
+    聚合查询    按 project_id 分组的 count/sum 子查询外连接项目，不读取章节正文
+    计数字段    main.get_projects：直接读取 project_stats 维护的计数
+输出每次查询的耗时和 tracemalloc 统计的内存峰值。
+
+用法: python bench_project_listing.py [项目数] [每个项目的章节数] [每章字数]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECTS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+CHAPTERS = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+CHAPTER_CHARS = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+REPEAT = 3
+
+# 必须在导入 main 之前设置
+_db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["AI_HTTP_PREWARM"] = "false"
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+from main import get_projects  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import Project, Chapter  # noqa: E402
+from project_stats import repair_stats  # noqa: E402
+
+
+def seed():
+    db = SessionLocal()
+    try:
+        content = "章" * CHAPTER_CHARS
+        for p in range(PROJECTS):
+            project = Project(title=f"压测项目 {p}", genre="压测", display_order=p)
+            db.add(project)
+            db.flush()
+            db.bulk_insert_mappings(Chapter, [
+                {"project_id": project.id, "title": f"第{c + 1}章", "content": content,
+                 "word_count": CHAPTER_CHARS, "order": c}
+                for c in range(CHAPTERS)
+            ])
+        db.commit()
+        # 批量插入不触发会话事件，统计一次计数
+        repair_stats(db)
+    finally:
+        db.close()
+
+
+def list_joinedload(db):
+    projects = db.query(Project).options(joinedload(Project.chapters)).order_by(Project.display_order).all()
+    for project in projects:
+        project.chapter_count = len(project.chapters)
+        project.word_count = sum(c.word_count for c in project.chapters if c.word_count is not None)
+    return projects
+
+
+def list_aggregate(db):
+    stats = (
+        db.query(
+            Chapter.project_id,
+            func.count(Chapter.id).label("chapter_count"),
+            func.coalesce(func.sum(Chapter.word_count), 0).label("word_count"),
+        )
+        .group_by(Chapter.project_id)
+        .subquery()
+    )
+    rows = (
+        db.query(Project.id, stats.c.chapter_count, stats.c.word_count)
+        .outerjoin(stats, stats.c.project_id == Project.id)
+        .order_by(Project.display_order)
+        .all()
+    )
+    return rows
+
+
+def bench(label, list_projects):
+    elapsed = []
+    peak = 0
+    for _ in range(REPEAT):
+        db = SessionLocal()
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            projects = list_projects(db)
+            elapsed.append(time.perf_counter() - started)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            total = sum(p.word_count for p in projects)
+        finally:
+            db.close()
+    print(f"{label:<10} 耗时={min(elapsed) * 1000:8.1f}ms  内存峰值={peak / 1024 / 1024:8.1f}MB  总字数={total}")
+
+
+def main():
+    print(f"{PROJECTS} 个项目，每个 {CHAPTERS} 章，每章 {CHAPTER_CHARS} 字")
+    seed()
+    bench("joinedload", list_joinedload)
+    bench("聚合查询", list_aggregate)
+    bench("计数字段", get_projects)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+流式对话SSE帧合并压测
+
+启动本地模拟AI提供商（大量小分片、无间隔，模拟高速模型）和后端服务（临时 SQLite 数据库），
+分别在不同的合并窗口（AI_SSE_COALESCE_MS）下同时发起 N 个流式对话，
+比较发给前端的帧数、每秒帧数和后端服务线程的CPU时间。
+
+用法: python bench_sse_coalescing.py [并发数] [每个回复的分片数] [合并窗口毫秒,逗号分隔]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+CONCURRENCY = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+CHUNKS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+WINDOWS = [float(w) for w in (sys.argv[3] if len(sys.argv) > 3 else "0,16,50").split(",")]
+MOCK_PORT = 8903
+APP_PORT = 8904
+
+# 必须在导入 main 之前设置
+_db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["AI_HTTP_PREWARM"] = "false"
+os.environ["AI_RESPONSE_CACHE_POLICY"] = "off"
+
+import httpx  # noqa: E402
+
+import chat_service  # noqa: E402
+from mock_ai_provider import create_app, serve_in_thread  # noqa: E402
+from main import app  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import AIProvider, AIModel  # noqa: E402
+
+
+def seed_model():
+    db = SessionLocal()
+    try:
+        provider = AIProvider(name="Mock", base_url=f"http://127.0.0.1:{MOCK_PORT}", api_key="mock-key", enabled=True)
+        db.add(provider)
+        db.commit()
+        model = AIModel(provider_id=provider.id, name="mock", model_identifier="mock-model", temperature=0.7, max_tokens=CHUNKS * 4)
+        db.add(model)
+        db.commit()
+        return model.id
+    finally:
+        db.close()
+
+
+def thread_cpu(thread) -> float:
+    """线程已使用的CPU秒数"""
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+async def run(model_id, window_ms, server):
+    chat_service.AI_SSE_COALESCE_MS = window_ms
+    limits = httpx.Limits(max_connections=CONCURRENCY + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=300, limits=limits) as client:
+
+        async def chat(i):
+            frames = 0
+            chars = 0
+            body = {"message": f"压测消息 {window_ms} {i}", "ai_model_id": model_id}
+            async with client.stream("POST", "/api/chat/stream", json=body) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        frames += 1
+                        chars += len(line)
+            return frames, chars
+
+        cpu_started = thread_cpu(server.thread)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(chat(i) for i in range(CONCURRENCY)))
+        wall = time.perf_counter() - started
+        cpu = thread_cpu(server.thread) - cpu_started
+
+    frames = sum(f for f, _ in results)
+    mode = "每个分片一帧" if window_ms <= 0 else f"合并窗口 {window_ms:.0f}ms"
+    print(f"{mode:<14} 帧数={frames:>7}  帧/秒={frames / wall:>9.0f}  耗时={wall:6.2f}s  "
+          f"后端CPU={cpu:6.2f}s（每个回复 {cpu * 1000 / CONCURRENCY:.1f}ms）")
+
+
+def main():
+    mock = serve_in_thread(create_app(delay=0, chunks=CHUNKS, chunk_delay=0), MOCK_PORT)
+    server = serve_in_thread(app, APP_PORT)
+    print(f"并发流式对话: {CONCURRENCY}，每个回复 {CHUNKS} 个分片")
+    try:
+        model_id = seed_model()
+        for window_ms in WINDOWS:
+            asyncio.run(run(model_id, window_ms, server))
+    finally:
+        server.should_exit = True
+        mock.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
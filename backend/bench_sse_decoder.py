@@ -0,0 +1,118 @@
+"""
+上游SSE解析微基准
+
+比较两种解析方式处理同一批上游流所需的时间：
+    按行解析   原来的做法：字节增量解码为文本、按行切分（与 httpx 的 aiter_lines 相同），
+               每个 data: 行各自 json.loads，多行 data 会解析失败
+    增量解码   sse_decoder.SSEDecoder：直接处理字节块，完整事件才解码，每个事件 json.loads 一次
+
+默认使用内置的三种典型流（OpenAI 风格、reasoning_content 思考过程、GLM 风格的 CRLF 与多行 data），
+按随机大小切成网络包大小的字节块；也可以传入录制的原始响应文件。
+
+用法: python bench_sse_decoder.py [重复次数] [录制文件...]
+"""
+import codecs
+import json
+import random
+import sys
+import time
+
+from sse_decoder import SSEDecoder
+
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+RECORDINGS = sys.argv[2:]
+DELTAS = 2000
+
+
+def _chunk(delta, separator="\n", multiline=False):
+    data = json.dumps({"id": "bench", "object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": delta}]}, ensure_ascii=False)
+    if multiline:
+        # 把JSON拆成两行 data（规范允许，按行解析会失败）
+        middle = data.index(",") + 1
+        return f"data: {data[:middle]}{separator}data: {data[middle:]}{separator}{separator}"
+    return f"data: {data}{separator}{separator}"
+
+
+def builtin_streams():
+    openai = "".join(_chunk({"content": "模拟回复"}) for _ in range(DELTAS)) + "data: [DONE]\n\n"
+    reasoning = "".join(
+        _chunk({"reasoning_content": "思考中"} if i < DELTAS // 2 else {"content": "回答"}) for i in range(DELTAS)
+    ) + "data: [DONE]\n\n"
+    glm = ": ping\r\n\r\n" + "".join(
+        _chunk({"reasoning": "推理", "content": "正文"}, "\r\n", multiline=i % 10 == 0) for i in range(DELTAS)
+    ) + "data: [DONE]\r\n\r\n"
+    return {"openai": openai.encode(), "reasoning": reasoning.encode(), "glm": glm.encode()}
+
+
+def split_chunks(raw: bytes, seed: int = 0):
+    """按 200~4000 字节的随机大小切块，模拟网络包边界（会切开多字节字符和CRLF）"""
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(raw):
+        size = rng.randint(200, 4000)
+        chunks.append(raw[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def parse_lines(chunks):
+    """原来的按行解析"""
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    pending = ""
+    deltas = failed = 0
+    for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        lines = text.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.startswith("data: "):
+                continue
+            if line[6:].strip() == "[DONE]":
+                return deltas, failed
+            try:
+                json.loads(line[6:])
+                deltas += 1
+            except json.JSONDecodeError:
+                failed += 1
+    return deltas, failed
+
+
+def parse_events(chunks):
+    """增量解码"""
+    decoder = SSEDecoder()
+    deltas = failed = 0
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            if event.data.strip() == "[DONE]":
+                return deltas, failed
+            try:
+                json.loads(event.data)
+                deltas += 1
+            except json.JSONDecodeError:
+                failed += 1
+    return deltas, failed
+
+
+def bench(name, raw):
+    chunks = split_chunks(raw)
+    print(f"{name}: {len(raw) / 1024:.0f} KB，{len(chunks)} 个块")
+    for label, parse in (("按行解析", parse_lines), ("增量解码", parse_events)):
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            deltas, failed = parse(chunks)
+        elapsed = (time.perf_counter() - started) / REPEAT
+        print(f"  {label}  {elapsed * 1000:7.2f}ms/流  {len(raw) / elapsed / 1024 / 1024:7.1f} MB/s  "
+              f"解析出 {deltas} 个delta，失败 {failed} 个")
+
+
+def main():
+    streams = {path: open(path, "rb").read() for path in RECORDINGS} or builtin_streams()
+    for name, raw in streams.items():
+        bench(name, raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,768 @@
+"""
+AI 对话的公共逻辑
+
+数据库相关的准备工作（渲染提示词、读取模型配置、创建对话和保存消息）都是同步函数，
+由异步接口放到线程池中执行；准备完成后只保留纯数据的快照，上游调用期间不再访问数据库。
+"""
+import asyncio
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from models import AIModel, AIProvider, Conversation, Message, MESSAGE_COMPLETE, MESSAGE_STREAMING, MESSAGE_TRUNCATED
+from ai_clients import ai_clients
+from prompt_utils import prompt_renderer
+from token_budget import assemble_messages, PromptBudgetExceeded
+from response_cache import response_cache, cache_key
+from generations import generations
+from chat_streams import chat_streams
+from hedging import hedged_stream, ttft_stats
+from rate_limiter import rate_limiters, parse_retry_after, PRIORITIES, PRIORITY_INTERACTIVE, AI_RATE_MAX_RETRIES
+from token_budget import token_counter
+from key_pool import key_pools, provider_keys, mask_key
+from circuit_breaker import circuit_breakers, is_retryable, backoff_delay, AI_RETRY_ATTEMPTS
+from sse_decoder import aiter_sse
+from ai_adapters import adapters
+from app_logging import get_logger, sampled
+
+logger = get_logger("chat")
+
+# 缓存回复以流式方式重放时每个事件的字符数
+REPLAY_CHUNK_SIZE = 64
+# 排队时向前端报告位置的间隔秒数
+QUEUE_REPORT_INTERVAL = 1.0
+
+DEFAULT_BASE_URL = "https://api.openai.com"
+NON_STREAM_TIMEOUT = 30.0
+
+# 流式回复每收到这么多个事件保存一次，进程崩溃时最多丢失这一段
+AI_STREAM_CHECKPOINT_CHUNKS = int(os.getenv("AI_STREAM_CHECKPOINT_CHUNKS", "20"))
+# 发给前端的SSE帧合并窗口（毫秒）：窗口内连续的文本片段合并为一帧，0 表示每个片段一帧
+AI_SSE_COALESCE_MS = float(os.getenv("AI_SSE_COALESCE_MS", "0"))
+# 合并的文本达到该字符数时立即发送
+AI_SSE_COALESCE_CHARS = int(os.getenv("AI_SSE_COALESCE_CHARS", "256"))
+# 流式回复的增量保存在独立的线程池中进行
+_reply_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="reply-writer")
+
+
+class ProviderInfo(NamedTuple):
+    id: int
+    name: str
+    base_url: Optional[str]
+    api_key: Optional[str]
+    rpm_limit: Optional[int] = None
+    tpm_limit: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    api_keys: Tuple[Tuple[str, int], ...] = ()  # 密钥池：主密钥与额外密钥，[(密钥, 权重)]
+
+
+class AIReply(NamedTuple):
+    content: str  # 回复内容或错误描述
+    ok: bool
+    status: Optional[int] = None
+    retry_after: Optional[str] = None
+
+
+class ModelInfo(NamedTuple):
+    id: int
+    name: str
+    model_identifier: str
+    temperature: Optional[float]
+    max_tokens: Optional[int]
+    context_window: Optional[int]
+    adapter: Optional[str] = None  # 固定使用的响应适配器，为空时自动判断
+
+
+@dataclass
+class ChatContext:
+    conversation_id: int
+    provider: Optional[ProviderInfo] = None
+    model: Optional[ModelInfo] = None
+    messages: List[dict] = field(default_factory=list)
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    token_breakdown: Optional[dict] = None
+    error: Optional[str] = None  # 非空时不调用AI，直接作为回复
+    payload_key: Optional[str] = None  # 上游请求内容的哈希，相同请求共用一次生成
+    cache_key: Optional[str] = None  # 非空时使用回复缓存
+    cached: bool = False  # 回复来自缓存
+    peers: List[Tuple[ProviderInfo, ModelInfo]] = field(default_factory=list)  # 对冲/备用模型
+    priority: int = PRIORITY_INTERACTIVE  # 限流排队优先级
+
+    @property
+    def reserved_tokens(self) -> int:
+        """限流时预留的 Token 数：输入 + 最大输出"""
+        return (self.token_breakdown or {}).get("total", 0) + (self.max_tokens or 0)
+
+    def for_peer(self, provider: ProviderInfo, model: ModelInfo) -> "ChatContext":
+        """同样的消息发给备用模型"""
+        return dataclasses.replace(self, provider=provider, model=model, peers=[])
+
+    def candidates(self) -> List["ChatContext"]:
+        return [self] + [self.for_peer(p, m) for p, m in self.peers]
+
+
+# URL处理函数 - 与前端保持一致
+def process_openai_url(base_url: str) -> str:
+    """
+    处理OpenAI兼容API的URL，与前端逻辑保持一致
+    规则1: URL以#结尾，移除#后直接使用
+    规则2: URL以/结尾，移除/后补充 /chat/completions
+    规则3: URL不以/结尾，补充 /v1/chat/completions
+    """
+    base_url = base_url.strip()
+
+    # 规则1: 以#结尾，移除#后直接使用
+    if base_url.endswith('#'):
+        return base_url[:-1]
+
+    # 规则2: 以/结尾，移除/后补充 /chat/completions
+    if base_url.endswith('/'):
+        return f"{base_url[:-1]}/chat/completions"
+
+    # 规则3: 不以/结尾，补充 /v1/chat/completions
+    return f"{base_url}/v1/chat/completions"
+
+
+def provider_info(db_provider) -> ProviderInfo:
+    return ProviderInfo(
+        db_provider.id, db_provider.name, db_provider.base_url, db_provider.api_key,
+        db_provider.rpm_limit, db_provider.tpm_limit, db_provider.max_concurrency,
+        tuple(provider_keys(db_provider.api_key, db_provider.api_keys)),
+    )
+
+
+def _model_info(db_model) -> ModelInfo:
+    return ModelInfo(
+        db_model.id, db_model.name, db_model.model_identifier,
+        db_model.temperature, db_model.max_tokens, db_model.context_window, db_model.adapter,
+    )
+
+
+def load_peers(db, model_ids) -> List[Tuple[ProviderInfo, ModelInfo]]:
+    """按声明顺序读取可用的对冲/备用模型，一条查询"""
+    rows = (
+        db.query(AIModel, AIProvider)
+        .join(AIProvider, AIModel.provider_id == AIProvider.id)
+        .filter(AIModel.id.in_(model_ids), AIModel.enabled == True, AIProvider.enabled == True)
+        .all()
+    )
+    found = {
+        m.id: (provider_info(p), _model_info(m))
+        for m, p in rows if provider_keys(p.api_key, p.api_keys)
+    }
+    return [found[i] for i in model_ids if i in found]
+
+
+def prepare_chat(db, request) -> ChatContext:
+    """完成调用AI之前的全部数据库工作：渲染提示词、读取模型、组装消息、保存用户消息"""
+    prompt_compiled, prompt_values = None, None
+    if request.prompt_template_id:
+        # 编译后的模板和占位符解析结果均有缓存，命中时不访问数据库
+        prompt_compiled, prompt_values, _ = prompt_renderer.resolve_template(
+            db, request.prompt_template_id, request.project_id, request.selected_text
+        )
+
+    provider, model = None, None
+    if request.ai_model_id:
+        db_model = db.query(AIModel).filter(AIModel.id == request.ai_model_id).first()
+        if db_model:
+            db_provider = db.query(AIProvider).filter(AIProvider.id == db_model.provider_id).first()
+            if not db_provider:
+                raise HTTPException(status_code=404, detail="AI提供商不存在")
+            provider = provider_info(db_provider)
+            model = _model_info(db_model)
+
+    ctx = ChatContext(
+        conversation_id=request.conversation_id, provider=provider, model=model,
+        priority=PRIORITIES.get(request.priority, PRIORITY_INTERACTIVE),
+    )
+    if model and db_model.hedge_model_ids:
+        ctx.peers = load_peers(db, db_model.hedge_model_ids)
+    if not provider or not model:
+        ctx.error = "AI服务未配置。请在AI管理中选择一个AI模型。"
+    elif not provider.api_keys:
+        ctx.error = "AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
+    else:
+        ctx.temperature = request.temperature if request.temperature is not None else model.temperature
+        ctx.max_tokens = request.max_tokens if request.max_tokens is not None else model.max_tokens
+        # 按模型的上下文窗口组装消息，超出预算时在调用AI之前就返回错误
+        try:
+            ctx.messages, ctx.token_breakdown = assemble_messages(
+                prompt_compiled, prompt_values, request.history, request.message, model, ctx.max_tokens
+            )
+        except PromptBudgetExceeded as e:
+            ctx.error = str(e)
+        if not ctx.error:
+            ctx.payload_key = cache_key(provider.id, model.model_identifier, ctx.messages, ctx.temperature, ctx.max_tokens)
+            if response_cache.enabled_for(ctx.temperature, request.use_cache):
+                ctx.cache_key = ctx.payload_key
+
+    # 如果是新对话，则创建对话记录
+    if ctx.conversation_id is None:
+        # 自动生成标题：取消息的前30个字符
+        title = request.message[:30] + '...' if len(request.message) > 30 else request.message
+        # AI对话功能不依赖项目，不设置project_id
+        new_conv = Conversation(title=title)
+        db.add(new_conv)
+        db.commit()
+        db.refresh(new_conv)
+        ctx.conversation_id = new_conv.id
+
+    # 保存用户消息
+    user_message = Message(
+        conversation_id=ctx.conversation_id,
+        role='user',
+        content=request.message
+    )
+    db.add(user_message)
+    db.commit()
+    return ctx
+
+
+def save_assistant_message(db, conversation_id: int, content: str, status: str = MESSAGE_COMPLETE,
+                           message_id: Optional[int] = None) -> int:
+    """保存AI回复到数据库；指定 message_id 时更新已保存的部分回复，返回消息id"""
+    ai_message = db.get(Message, message_id) if message_id is not None else None
+    if ai_message is None:
+        ai_message = Message(
+            conversation_id=conversation_id,
+            role='assistant',
+            content=content,
+            status=status
+        )
+        db.add(ai_message)
+    else:
+        ai_message.content = content
+        ai_message.status = status
+    db.commit()
+    return ai_message.id
+
+
+def persist_assistant_message(bind, conversation_id: int, content: str, status: str = MESSAGE_COMPLETE,
+                              message_id: Optional[int] = None) -> int:
+    """用独立的短生命周期会话保存AI回复，流式生成期间不占用请求的数据库连接"""
+    with Session(bind=bind) as db:
+        return save_assistant_message(db, conversation_id, content, status, message_id)
+
+
+def mark_interrupted_replies(db) -> int:
+    """服务重启后，上次未写完的回复（进程退出时仍在生成）标记为截断"""
+    count = db.query(Message).filter(Message.status == MESSAGE_STREAMING).update(
+        {Message.status: MESSAGE_TRUNCATED}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+class ReplyWriter:
+    """
+    逐步保存一条流式回复：第一次检查点插入消息，之后原地更新。
+    写入在线程池中执行，每次写入先等上一次完成，保证按提交顺序落库且只插入一行。
+    """
+
+    def __init__(self, bind, conversation_id: int):
+        self.bind = bind
+        self.conversation_id = conversation_id
+        self.message_id = None
+        self._pending = None
+
+    def _write(self, previous, content: str, status: str):
+        if previous is not None:
+            concurrent.futures.wait([previous])
+        self.message_id = persist_assistant_message(self.bind, self.conversation_id, content, status, self.message_id)
+
+    @property
+    def started(self) -> bool:
+        """是否已经提交过写入（消息行可能已插入）"""
+        return self._pending is not None
+
+    def submit(self, content: str, status: str) -> concurrent.futures.Future:
+        """提交写入，不等待结果（可在已取消的任务中调用）"""
+        self._pending = _reply_executor.submit(self._write, self._pending, content, status)
+        return self._pending
+
+    async def write(self, content: str, status: str):
+        await asyncio.wrap_future(self.submit(content, status))
+
+
+def api_endpoint(provider: ProviderInfo) -> str:
+    # Default to OpenAI-compatible API if no base_url is provided
+    return process_openai_url(provider.base_url or DEFAULT_BASE_URL)
+
+
+def api_headers(api_key: str) -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+
+def build_payload(ctx: ChatContext, stream: bool = False) -> dict:
+    """构造OpenAI兼容的请求载荷"""
+    payload = {
+        "model": ctx.model.model_identifier,
+        "messages": ctx.messages,
+        "temperature": ctx.temperature,
+        "max_tokens": ctx.max_tokens,
+    }
+    if stream:
+        payload["stream"] = True  # 启用流式响应
+
+    # Check if this is a thinking model and add enable_thinking parameter
+    identifier = ctx.model.model_identifier.lower()
+    if "thinking" in identifier or "qwen" in identifier:
+        payload["extra_body"] = {"enable_thinking": True}
+    return payload
+
+
+async def lookup_cached_reply(ctx: ChatContext) -> Optional[dict]:
+    if not ctx.cache_key:
+        return None
+    # 磁盘二级缓存的读取放到线程池
+    entry = await run_in_threadpool(response_cache.get, ctx.cache_key)
+    if entry is not None:
+        ctx.cached = True
+        logger.info("回复缓存命中 %s", ctx.cache_key[:12])
+    return entry
+
+
+async def store_cached_reply(ctx: ChatContext, content: str, thinking: str = ""):
+    if ctx.cache_key and content:
+        await run_in_threadpool(response_cache.put, ctx.cache_key, content, thinking)
+
+
+async def call_ai(ctx: ChatContext) -> str:
+    """非流式调用AI，启用缓存时优先返回缓存的回复"""
+    cached = await lookup_cached_reply(ctx)
+    if cached is not None:
+        return cached["content"]
+    reply = await resilient_request(ctx)
+    if reply.ok:
+        await store_cached_reply(ctx, reply.content)
+    return reply.content
+
+
+def circuit_open_message(provider: ProviderInfo) -> str:
+    return f"AI提供商 {provider.name} 暂时不可用（连续调用失败，已熔断），请稍后重试。"
+
+
+async def resilient_request(ctx: ChatContext) -> AIReply:
+    """连接失败、超时和 5xx 按退避重试；提供商熔断期间直接失败"""
+    breaker = circuit_breakers.for_provider(ctx.provider.id)
+    for attempt in range(AI_RETRY_ATTEMPTS + 1):
+        if not breaker.allow():
+            return AIReply(circuit_open_message(ctx.provider), False, 503)
+        trial = breaker.is_trial()
+        try:
+            reply = await limited_request(ctx)
+        except BaseException:
+            if trial:
+                breaker.abandon_trial()
+            raise
+        if not is_retryable(reply.status):
+            # 有正常响应（包括 4xx）说明提供商可达
+            breaker.record_success()
+            return reply
+        breaker.record_failure(ctx.provider.base_url)
+        if attempt == AI_RETRY_ATTEMPTS:
+            return reply
+        delay = backoff_delay(attempt)
+        logger.warning("提供商 %s 调用失败，%.2f 秒后第 %d 次重试", ctx.provider.name, delay, attempt + 1)
+        await asyncio.sleep(delay)
+    return reply
+
+
+async def limited_request(ctx: ChatContext) -> AIReply:
+    """经过提供商限流后调用；429 时按 Retry-After 暂停该提供商并重新排队"""
+    limiter = rate_limiters.for_provider(ctx.provider)
+    for attempt in range(AI_RATE_MAX_RETRIES + 1):
+        ticket = limiter.enqueue(ctx.reserved_tokens, ctx.priority)
+        try:
+            await ticket.wait()
+            reply = await request_ai(ctx)
+        except BaseException:
+            limiter.cancel(ticket)
+            raise
+        ticket.release(_used_tokens(ctx, reply.content if reply.ok else ""))
+        if reply.status == 429 and attempt < AI_RATE_MAX_RETRIES:
+            _throttle(limiter, ctx.provider, reply.retry_after)
+            logger.warning("提供商 %s 返回429，重新排队（第%d次）", ctx.provider.name, attempt + 1)
+            continue
+        return reply
+    return reply
+
+
+def _throttle(limiter, provider: ProviderInfo, retry_after):
+    """429：还有其他可用密钥时立即换密钥重试，否则按 Retry-After 暂停该提供商"""
+    if not key_pools.for_provider(provider).has_available():
+        limiter.throttle(parse_retry_after(retry_after))
+
+
+def _used_tokens(ctx: ChatContext, output: str) -> int:
+    return (ctx.token_breakdown or {}).get("total", 0) + token_counter.count(output)
+
+
+def _elapsed_ms(started: float) -> int:
+    return int((time.perf_counter() - started) * 1000)
+
+
+def log_request(ctx: ChatContext, endpoint: str, payload: dict, api_key: str, stream: bool):
+    """每次调用一行摘要；提示词和完整请求体只在 DEBUG 级别输出"""
+    logger.info("调用AI", extra={"fields": {
+        "provider": ctx.provider.name, "model": ctx.model.model_identifier, "endpoint": endpoint,
+        "key": mask_key(api_key), "stream": stream, "messages": len(ctx.messages),
+        "max_tokens": ctx.max_tokens,
+    }})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("请求载荷: %s", json.dumps(payload, ensure_ascii=False))
+
+
+async def request_ai(ctx: ChatContext) -> AIReply:
+    """非流式调用AI提供商"""
+    provider, model = ctx.provider, ctx.model
+    payload = build_payload(ctx)
+    endpoint = api_endpoint(provider)
+
+    # 从密钥池中选择本次使用的密钥
+    key_pool = key_pools.for_provider(provider)
+    key = key_pool.acquire()
+    status, retry_after = None, None
+    started = time.perf_counter()
+    log_request(ctx, endpoint, payload, key.key, stream=False)
+
+    try:
+        # 使用按提供商复用的连接池，等待上游期间不占用线程
+        async with ai_clients.client(provider.id, provider.base_url) as client:
+            response = await client.post(
+                endpoint,
+                json=payload,
+                headers=api_headers(key.key),
+                timeout=NON_STREAM_TIMEOUT,
+            )
+
+        status = response.status_code
+
+        if response.status_code == 200:
+            response_data = response.json()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("响应内容: %s", json.dumps(response_data, ensure_ascii=False))
+            logger.info("AI调用完成", extra={"fields": {"status": status, "elapsed_ms": _elapsed_ms(started)}})
+            return AIReply(response_data['choices'][0]['message']['content'], True, 200)
+        logger.warning("AI调用失败", extra={"fields": {"status": status, "detail": response.text[:200]}})
+        if status == 401:
+            return AIReply(f"API密钥无效或已过期。错误代码: {status}", False, status)
+        if status == 404:
+            return AIReply(f"API端点未找到。请检查API URL是否正确。错误代码: {status}", False, status)
+        if status == 429:
+            retry_after = response.headers.get("retry-after")
+            return AIReply(f"API请求频率超限。错误代码: {status}", False, status, retry_after)
+        return AIReply(f"AI服务调用失败。状态码: {status}, 详情: {response.text}", False, status)
+
+    except Exception as e:
+        logger.exception("AI调用失败: %s: %s", type(e).__name__, e)
+        return AIReply(f"AI服务调用失败: {type(e).__name__}: {str(e)}", False)
+    finally:
+        key_pool.release(key, status, parse_retry_after(retry_after) if retry_after else None)
+
+
+# --- 流式对话 ---
+
+def sse(event: dict, event_id: Optional[int] = None) -> str:
+    if event_id is None:
+        return f"data: {json.dumps(event)}\n\n"
+    return f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream_ai(ctx: ChatContext):
+    """流式调用AI提供商，逐个产出 thinking / content / error 事件"""
+    provider, model = ctx.provider, ctx.model
+    payload = build_payload(ctx, stream=True)
+    endpoint = api_endpoint(provider)
+
+    key_pool = key_pools.for_provider(provider)
+    key = key_pool.acquire()
+    status, retry_after = None, None
+    started = time.perf_counter()
+    first_token = True
+    try:
+        log_request(ctx, endpoint, payload, key.key, stream=True)
+
+        # 使用按提供商复用的连接池
+        async with ai_clients.client(provider.id, provider.base_url) as client:
+            async with client.stream("POST", endpoint, json=payload, headers=api_headers(key.key)) as response:
+                status = response.status_code
+                retry_after = response.headers.get("retry-after")
+
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    logger.warning("流式调用失败", extra={"fields": {
+                        "status": response.status_code, "detail": error_text[:200].decode(errors="replace"),
+                    }})
+                    yield {
+                        "type": "error",
+                        "message": f"AI服务调用失败。状态码: {response.status_code}, 详情: {error_text.decode()}",
+                        "status": response.status_code,
+                        "retry_after": retry_after,
+                    }
+                    return
+
+                adapter = adapters.for_model(model)
+                resolved = adapter is not None
+                event_count = 0
+                async for event in aiter_sse(response.aiter_bytes()):
+                    event_count += 1
+                    if event.data.strip() == "[DONE]":
+                        break
+                    if event.event == "error":
+                        # 部分提供商在流中以 error 事件报告错误
+                        yield {"type": "error", "message": f"AI服务调用失败: {event.data[:500]}"}
+                        return
+
+                    try:
+                        data = json.loads(event.data)
+                    except json.JSONDecodeError as e:
+                        logger.warning("流式响应JSON解析失败: %s", e)
+                        logger.debug("无法解析的数据: %s", event.data[:200])
+                        continue
+
+                    if "choices" in data and len(data["choices"]) > 0:
+                        delta = data["choices"][0].get("delta", {})
+
+                        # 模型的适配器未固定、也还没判断过时，根据 delta 判断一次并缓存
+                        if not resolved:
+                            adapter, resolved = adapters.detect(model, delta)
+
+                        thinking_chunk, content_chunk = adapter.parse(delta)
+                        if logger.isEnabledFor(logging.DEBUG) and sampled():
+                            logger.debug("分片 #%d: %s", event_count, event.data[:200])
+                        if first_token and (thinking_chunk or content_chunk):
+                            # 记录首Token延迟，用于计算对冲延迟
+                            first_token = False
+                            ttft_stats.record(provider.id, time.perf_counter() - started)
+
+                        # 统一处理思考过程
+                        if thinking_chunk:
+                            yield {"type": "thinking", "content": thinking_chunk}
+
+                        # 统一处理最终回复
+                        if content_chunk:
+                            yield {"type": "content", "content": content_chunk}
+
+                logger.info("流式响应结束", extra={"fields": {
+                    "events": event_count, "adapter": adapter.name if adapter else None,
+                    "elapsed_ms": _elapsed_ms(started),
+                }})
+
+    except Exception as e:
+        status = None
+        yield {"type": "error", "message": f"AI服务调用失败: {type(e).__name__}: {str(e)}"}
+    finally:
+        key_pool.release(key, status, parse_retry_after(retry_after) if retry_after else None)
+
+
+async def limited_stream(ctx: ChatContext):
+    """
+    经过提供商限流后流式调用。排队期间产出 queue 事件报告位置；
+    首个Token之前收到 429 时按 Retry-After 暂停该提供商并重新排队。
+    """
+    limiter = rate_limiters.for_provider(ctx.provider)
+    for attempt in range(AI_RATE_MAX_RETRIES + 1):
+        ticket = limiter.enqueue(ctx.reserved_tokens, ctx.priority)
+        output = ""
+        try:
+            position = None
+            while not ticket.admitted.done():
+                if ticket.position != position:
+                    position = ticket.position
+                    yield {"type": "queue", "position": position}
+                await ticket.wait(QUEUE_REPORT_INTERVAL)
+
+            throttled = False
+            events = stream_ai(ctx)
+            try:
+                async for event in events:
+                    if event["type"] == "error":
+                        if event.get("status") == 429 and not output and attempt < AI_RATE_MAX_RETRIES:
+                            throttled = True
+                            break
+                    elif event["type"] in ("content", "thinking"):
+                        output += event["content"]
+                    yield event
+            finally:
+                # 先关闭上游流，使密钥池记录这次 429（密钥进入冷却）后再判断是否需要暂停提供商
+                await events.aclose()
+            if not throttled:
+                return
+            _throttle(limiter, ctx.provider, event.get("retry_after"))
+            logger.warning("提供商 %s 返回429，重新排队（第%d次）", ctx.provider.name, attempt + 1)
+        finally:
+            if ticket.admitted.done() and not ticket.admitted.cancelled():
+                ticket.release(_used_tokens(ctx, output))
+            else:
+                limiter.cancel(ticket)
+
+
+async def resilient_stream(ctx: ChatContext):
+    """
+    首个Token之前的连接失败、超时和 5xx 按退避重试；已经开始输出后不再重试。
+    提供商熔断期间直接产出错误事件，对冲时会立即切换到备用模型。
+    """
+    breaker = circuit_breakers.for_provider(ctx.provider.id)
+    for attempt in range(AI_RETRY_ATTEMPTS + 1):
+        if not breaker.allow():
+            yield {"type": "error", "message": circuit_open_message(ctx.provider), "status": 503}
+            return
+        trial = breaker.is_trial()
+        failed = None
+        got_token = False
+        events = limited_stream(ctx)
+        try:
+            async for event in events:
+                if event["type"] == "error":
+                    failed = event
+                    break
+                if not got_token and event["type"] in ("content", "thinking"):
+                    got_token = True
+                    breaker.record_success()
+                yield event
+        except BaseException:
+            # 取消或中途关闭：请求没有结果，试探请求不能一直占着半开状态的唯一名额
+            if trial and not got_token:
+                breaker.abandon_trial()
+            raise
+        finally:
+            await events.aclose()
+        if failed is None:
+            breaker.record_success()
+            return
+        if not is_retryable(failed.get("status")):
+            breaker.record_success()
+            yield failed
+            return
+        breaker.record_failure(ctx.provider.base_url)
+        if got_token or attempt == AI_RETRY_ATTEMPTS:
+            yield failed
+            return
+        delay = backoff_delay(attempt)
+        logger.warning("提供商 %s 流式调用失败，%.2f 秒后第 %d 次重试", ctx.provider.name, delay, attempt + 1)
+        await asyncio.sleep(delay)
+
+
+class ChatStreamingResponse(StreamingResponse):
+    """
+    客户端断开时 Starlette 只取消发送循环，停在 yield 处的事件生成器要等垃圾回收才会关闭。
+    这里在响应结束后立即关闭生成器，使客户端及时退订（全部退订后按续传宽限期取消上游请求）。
+    """
+
+    async def stream_response(self, send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            # 在新任务中关闭，不受已取消的作用域影响；正常结束时生成器已耗尽，关闭无副作用
+            asyncio.ensure_future(self.body_iterator.aclose())
+
+
+def replay_events(entry: dict):
+    """把缓存的回复切成小段，按正常的流式事件重放，前端无需区分"""
+    for key in ("thinking", "content"):
+        text = entry.get(key) or ""
+        for i in range(0, len(text), REPLAY_CHUNK_SIZE):
+            yield {"type": key, "content": text[i:i + REPLAY_CHUNK_SIZE]}
+
+
+async def chat_events(ctx: ChatContext, bind):
+    """
+    生成一次流式对话的事件，在后台任务中运行（见 chat_streams）。
+    数据库工作已在 prepare_chat 中完成，这里只用短会话分段保存AI回复。
+    """
+    # 先发送对话ID和Token分布，使前端能够保存消息
+    yield {'type': 'conversation_id', 'conversation_id': ctx.conversation_id, 'tokens': ctx.token_breakdown}
+
+    # 未配置模型、API密钥缺失或提示词超出上下文窗口
+    if ctx.error:
+        yield {'type': 'error', 'message': ctx.error}
+        await run_in_threadpool(persist_assistant_message, bind, ctx.conversation_id, ctx.error)
+        return
+
+    writer = ReplyWriter(bind, ctx.conversation_id)
+    ai_reply_content = ""
+    events = None
+    try:
+        cached = await lookup_cached_reply(ctx)
+        if cached is not None:
+            for event in replay_events(cached):
+                if event["type"] == "content":
+                    ai_reply_content += event["content"]
+                yield event
+        else:
+            thinking_content = ""
+            # 相同的上游请求正在生成时直接加入，先收到已产生的事件
+            generation, joined = generations.join_or_start(
+                ctx.payload_key, lambda: hedged_stream(ctx.candidates(), resilient_stream), ctx.max_tokens
+            )
+            if joined:
+                logger.info("加入进行中的相同生成 %s，已有 %d 个事件", ctx.payload_key[:12], len(generation.events))
+            events = generation.follow()
+            chunks = 0
+            async for event in events:
+                if event["type"] == "error":
+                    yield event
+                    # 保存错误消息到数据库；已经生成的部分保留，标记为截断
+                    if ai_reply_content:
+                        await writer.write(f"{ai_reply_content}\n\n{event['message']}", MESSAGE_TRUNCATED)
+                    else:
+                        await writer.write(event["message"], MESSAGE_COMPLETE)
+                    return
+                if event["type"] == "content":
+                    ai_reply_content += event["content"]
+                elif event["type"] == "thinking":
+                    thinking_content += event["content"]
+                yield event
+                chunks += 1
+                if AI_STREAM_CHECKPOINT_CHUNKS > 0 and chunks % AI_STREAM_CHECKPOINT_CHUNKS == 0 and ai_reply_content:
+                    await writer.write(ai_reply_content, MESSAGE_STREAMING)
+            await store_cached_reply(ctx, ai_reply_content, thinking_content)
+    except (asyncio.CancelledError, Exception) as e:
+        # 客户端全部断开且未续传（上游生成随之取消）或生成出错：已生成的部分标记为截断后保存。
+        # 任务可能已被取消，不再等待写入完成
+        if ai_reply_content or writer.started:
+            reason = "生成已取消" if isinstance(e, asyncio.CancelledError) else "生成出错"
+            logger.info("%s，保存截断的回复（%d 字）", reason, len(ai_reply_content))
+            writer.submit(ai_reply_content, MESSAGE_TRUNCATED)
+        raise
+    finally:
+        if events is not None:
+            # 立即退订（follow 的清理不含 await，取消状态下也能完成）
+            await events.aclose()
+
+    logger.info("流式回复完成，长度 %d", len(ai_reply_content))
+
+    # 流式响应结束，保存完整的AI回复到数据库
+    await writer.write(ai_reply_content, MESSAGE_COMPLETE)
+
+    # 发送完成信号
+    yield {'type': 'done', 'cached': ctx.cached}
+
+
+async def follow_chat_stream(stream, last_event_id: int = 0):
+    """把对话流的事件编号后作为SSE发给前端，按 AI_SSE_COALESCE_MS 合并连续的文本片段"""
+    events = stream.follow(last_event_id, AI_SSE_COALESCE_MS / 1000, AI_SSE_COALESCE_CHARS)
+    async for event_id, event in events:
+        yield sse(event, event_id)
+
+
+def generate_chat_stream(ctx: ChatContext, bind, resumable: bool = False):
+    """在后台开始生成，返回发给前端的SSE事件流；resumable 为 True 时客户端断开后可通过续传接口继续接收"""
+    stream = chat_streams.start(ctx.conversation_id, lambda: chat_events(ctx, bind), resumable)
+    return follow_chat_stream(stream)
@@ -0,0 +1,222 @@
+"""
+可续传的流式对话
+
+每次流式对话在后台任务中生成，发给前端的事件按顺序编号（SSE 的 id 字段），保存在有界的重放缓冲区中。
+渲染进程重新加载或网络中断后，带上 Last-Event-ID 请求续传接口即可从断点继续接收：
+仍在缓冲区中的事件原样重放，已移出缓冲区的部分合并为一个内容事件补发。
+发送时可以把短时间内连续的文本事件合并为一帧（见 follow 的 window 参数），减少编码和写socket的次数。
+
+默认所有客户端离开后立即取消上游请求，不再为无人接收的回复消耗 Token。
+配置了 AI_STREAM_RESUME_GRACE 时，客户端选择续传（发起对话时带 Last-Event-ID 请求头，或请求过续传接口）的
+对话流在客户端离开后继续保留这段时间，期间无人续传才取消；生成结束后缓冲区同样保留这段时间，
+供断线的客户端取回结尾。
+"""
+import asyncio
+import collections
+import os
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from app_logging import get_logger
+
+logger = get_logger("chat_streams")
+
+# 每个对话流保留的事件数
+AI_STREAM_REPLAY_EVENTS = int(os.getenv("AI_STREAM_REPLAY_EVENTS", "256"))
+# 选择续传的客户端全部断开后等待续传的秒数，0 表示立即取消
+AI_STREAM_RESUME_GRACE = float(os.getenv("AI_STREAM_RESUME_GRACE", "0"))
+
+# 可以合并的文本事件类型
+TEXT_EVENTS = ("content", "thinking")
+
+
+def _merged(pending) -> tuple:
+    event_id, kind, parts, _, _ = pending
+    return event_id, {"type": kind, "content": "".join(parts)}
+
+
+class ChatStream:
+    """一次流式对话的事件：编号、缓冲并通知订阅者"""
+
+    def __init__(self, conversation_id: int, max_events: int = AI_STREAM_REPLAY_EVENTS,
+                 grace: float = AI_STREAM_RESUME_GRACE, resumable: bool = False):
+        self.conversation_id = conversation_id
+        self.max_events = max(max_events, 1)
+        self.grace = grace
+        # 客户端是否会续传；否则断开后立即取消上游请求
+        self.resumable = resumable
+        self.events = collections.deque()  # (编号, 事件)
+        self.last_id = 0
+        self.evicted_id = 0  # 已移出缓冲区的最后一个事件编号
+        self.header = None  # 第一个事件（对话ID和Token分布），续传时总是先发送
+        # 截至每个事件为止累积的 (content, thinking) 长度，用于补发已移出缓冲区的内容
+        self.offsets = [(0, 0)]
+        self.content = ""
+        self.thinking = ""
+        self.finished = False
+        self.subscribers = 0
+        self.task = None
+        self._idle_timer = None
+        self._changed = asyncio.Event()
+
+    def publish(self, event: dict):
+        self.last_id += 1
+        if self.header is None:
+            self.header = (self.last_id, event)
+        if event.get("type") == "content":
+            self.content += event["content"]
+        elif event.get("type") == "thinking":
+            self.thinking += event["content"]
+        self.offsets.append((len(self.content), len(self.thinking)))
+        self.events.append((self.last_id, event))
+        if len(self.events) > self.max_events:
+            self.evicted_id = self.events.popleft()[0]
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _missed(self, position: int):
+        """position 之后、已移出缓冲区的内容，合并为至多两个事件"""
+        content_from, thinking_from = self.offsets[position]
+        content_to, thinking_to = self.offsets[self.evicted_id]
+        if thinking_to > thinking_from:
+            yield {"type": "thinking", "content": self.thinking[thinking_from:thinking_to]}
+        if content_to > content_from:
+            yield {"type": "content", "content": self.content[content_from:content_to]}
+
+    async def _run(self, source: AsyncIterator[dict], on_finish: Callable):
+        try:
+            async for event in source:
+                self.publish(event)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.publish({"type": "error", "message": f"AI服务调用失败: {type(e).__name__}: {str(e)}"})
+        finally:
+            self.finished = True
+            self._changed.set()
+            on_finish(self)
+
+    async def follow(self, last_event_id: int = 0, window: float = 0.0, max_chars: int = 0):
+        """
+        产出 (编号, 事件)，从 last_event_id 之后开始，直到生成结束。
+        window 大于 0 时合并 window 秒内连续的同类文本事件（content 或 thinking），
+        合并后的事件使用最后一个事件的编号；累积达到 max_chars 个字符时提前发出。
+        """
+        self.subscribers += 1
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        position = min(max(last_event_id, 0), self.last_id)
+        loop = asyncio.get_running_loop()
+        pending = None  # 正在合并的文本事件：[编号, 类型, 片段列表, 字符数, 截止时间]
+        try:
+            while True:
+                if position < self.evicted_id:
+                    if pending is not None:
+                        yield _merged(pending)
+                        pending = None
+                    if position == 0 and self.header is not None:
+                        yield self.header
+                        position = self.header[0]
+                    for event in self._missed(position):
+                        yield self.evicted_id, event
+                    position = self.evicted_id
+                if position < self.last_id:
+                    # 编号连续，缓冲区第一个事件的编号为 evicted_id + 1
+                    event_id, event = self.events[position - self.evicted_id]
+                    position = event_id
+                    kind = event.get("type")
+                    if pending is not None and kind != pending[1]:
+                        yield _merged(pending)
+                        pending = None
+                    if window <= 0 or kind not in TEXT_EVENTS:
+                        yield event_id, event
+                        continue
+                    if pending is None:
+                        pending = [event_id, kind, [], 0, loop.time() + window]
+                    pending[0] = event_id
+                    pending[2].append(event["content"])
+                    pending[3] += len(event["content"])
+                    if max_chars and pending[3] >= max_chars:
+                        yield _merged(pending)
+                        pending = None
+                    continue
+                if pending is not None:
+                    remaining = pending[4] - loop.time()
+                    if remaining > 0 and not self.finished:
+                        # 在合并窗口内等待后续事件
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    yield _merged(pending)
+                    pending = None
+                    continue
+                if self.finished:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self._on_idle()
+
+    def _on_idle(self):
+        if self.task is None:
+            return
+        if self.grace <= 0 or not self.resumable:
+            self.task.cancel()
+            return
+        logger.info("对话 %s 的客户端已断开，%.0f 秒内可续传", self.conversation_id, self.grace)
+        self._idle_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon)
+
+    def _abandon(self):
+        self._idle_timer = None
+        if self.subscribers == 0 and not self.finished:
+            self.task.cancel()
+
+
+class ChatStreamRegistry:
+    """按对话id索引可续传的对话流，只在事件循环中访问"""
+
+    def __init__(self, max_events: int = AI_STREAM_REPLAY_EVENTS, grace: float = AI_STREAM_RESUME_GRACE):
+        self.max_events = max_events
+        self.grace = grace
+        self._streams: Dict[int, ChatStream] = {}
+        self.resumed = 0
+
+    def start(self, conversation_id: int, source_factory: Callable[[], AsyncIterator[dict]],
+              resumable: bool = False) -> ChatStream:
+        stream = ChatStream(conversation_id, self.max_events, self.grace, resumable)
+        # 同一对话的新回复替换旧的续传入口，旧的生成照常进行
+        self._streams[conversation_id] = stream
+        stream.task = asyncio.create_task(stream._run(source_factory(), self._finished))
+        return stream
+
+    def get(self, conversation_id: int) -> Optional[ChatStream]:
+        stream = self._streams.get(conversation_id)
+        if stream is not None:
+            # 请求过续传的客户端再次断开时同样等待续传
+            stream.resumable = True
+            self.resumed += 1
+        return stream
+
+    def _finished(self, stream: ChatStream):
+        if stream.grace <= 0:
+            self._discard(stream)
+            return
+        asyncio.get_running_loop().call_later(stream.grace, self._discard, stream)
+
+    def _discard(self, stream: ChatStream):
+        if self._streams.get(stream.conversation_id) is stream:
+            del self._streams[stream.conversation_id]
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "active": sum(1 for s in self._streams.values() if not s.finished),
+            "subscribers": sum(s.subscribers for s in self._streams.values()),
+            "resumed": self.resumed,
+        }
+
+
+chat_streams = ChatStreamRegistry()
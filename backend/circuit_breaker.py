@@ -0,0 +1,182 @@
+"""
+上游失败重试与按提供商熔断
+
+连接失败、超时、5xx 以及首个Token之前的中断按指数退避（全抖动）重试。
+同一提供商连续失败 AI_BREAKER_FAILURES 次后熔断：熔断期间的请求立即失败（对冲时直接切换到备用模型），
+后台按冷却时间探测提供商，探测成功后放行一个试探请求，成功即恢复，失败则继续熔断并加倍冷却时间。
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from app_logging import get_logger
+
+logger = get_logger("circuit_breaker")
+
+AI_RETRY_ATTEMPTS = int(os.getenv("AI_RETRY_ATTEMPTS", "2"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "8"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+AI_BREAKER_MAX_COOLDOWN = float(os.getenv("AI_BREAKER_MAX_COOLDOWN", "300"))
+AI_BREAKER_PROBE_TIMEOUT = float(os.getenv("AI_BREAKER_PROBE_TIMEOUT", "5"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_BASE_URL = "https://api.openai.com"
+
+
+def is_retryable(status: Optional[int]) -> bool:
+    """没有响应（连接失败、超时、中断）或 5xx 视为提供商故障，可以重试"""
+    return status is None or status >= 500
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间（全抖动指数退避）"""
+    return random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, provider_id: int):
+        self.provider_id = provider_id
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = AI_BREAKER_COOLDOWN
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.base_url = None
+        self.probe_task = None
+        self.rejected = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行请求；半开状态下只放行一个试探请求"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.open_until and (
+                self.probe_task is None or self.probe_task.done()
+            ):
+                # 探测任务未能运行（例如事件循环已更换），冷却结束后直接进入半开
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def is_trial(self) -> bool:
+        """刚放行的请求是否为半开状态下的试探请求（在 allow() 之后立即调用）"""
+        with self._lock:
+            return self.state == HALF_OPEN and self.trial_in_flight
+
+    def abandon_trial(self):
+        """试探请求被取消（客户端断开、对冲落败等），没有结果：允许下一个请求重新试探"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("提供商 %s 已恢复", self.provider_id)
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown = AI_BREAKER_COOLDOWN
+            self.trial_in_flight = False
+
+    def record_failure(self, base_url: Optional[str] = None):
+        with self._lock:
+            self.failures += 1
+            self.base_url = base_url or self.base_url
+            if self.state == HALF_OPEN:
+                # 试探失败，加倍冷却时间
+                self.cooldown = min(self.cooldown * 2, AI_BREAKER_MAX_COOLDOWN)
+            elif self.state == OPEN or self.failures < AI_BREAKER_FAILURES:
+                return
+            self.state = OPEN
+            self.trial_in_flight = False
+            self.trips += 1
+            self.open_until = time.monotonic() + self.cooldown
+            logger.warning("提供商 %s 连续失败 %d 次，熔断 %.0f 秒", self.provider_id, self.failures, self.cooldown)
+        self._schedule_probe()
+
+    def _schedule_probe(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self.probe_task is None or self.probe_task.done():
+            self.probe_task = loop.create_task(self._probe())
+
+    async def _probe(self):
+        """冷却结束后探测提供商是否可达，可达则进入半开状态"""
+        from ai_clients import ai_clients
+
+        while True:
+            await asyncio.sleep(max(self.open_until - time.monotonic(), 0))
+            parts = urlsplit(self.base_url or DEFAULT_BASE_URL)
+            try:
+                async with ai_clients.client(self.provider_id, self.base_url) as client:
+                    # 任何HTTP响应都说明服务可达
+                    await client.head(f"{parts.scheme}://{parts.netloc}/", timeout=AI_BREAKER_PROBE_TIMEOUT)
+            except Exception as e:
+                with self._lock:
+                    self.cooldown = min(self.cooldown * 2, AI_BREAKER_MAX_COOLDOWN)
+                    self.open_until = time.monotonic() + self.cooldown
+                logger.warning("探测提供商 %s 失败: %s，%.0f 秒后再试", self.provider_id, type(e).__name__, self.cooldown)
+                continue
+            with self._lock:
+                if self.state == OPEN:
+                    self.state = HALF_OPEN
+                    self.trial_in_flight = False
+            return
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": round(max(self.open_until - time.monotonic(), 0.0), 3) if self.state == OPEN else 0.0,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[int, CircuitBreaker] = {}
+
+    def for_provider(self, provider_id: int) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(provider_id)
+            if breaker is None:
+                breaker = self._breakers[provider_id] = CircuitBreaker(provider_id)
+            return breaker
+
+    def state(self, provider_id: int) -> dict:
+        with self._lock:
+            breaker = self._breakers.get(provider_id)
+        if breaker is None:
+            return {"state": CLOSED, "failures": 0, "retry_in": 0.0, "trips": 0, "rejected": 0}
+        return breaker.snapshot()
+
+    def reset(self, provider_id: int):
+        """提供商配置变化后重新开始计数"""
+        with self._lock:
+            breaker = self._breakers.pop(provider_id, None)
+        task = breaker.probe_task if breaker is not None else None
+        if task is not None and not task.done():
+            # 可能在线程池中调用，通过任务所属的事件循环取消
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+
+circuit_breakers = CircuitBreakerRegistry()
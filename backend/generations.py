@@ -0,0 +1,134 @@
+"""
+进行中的流式生成
+
+同一时间发往上游的完全相同的请求（客户端重试、两个窗口发出同一请求）只打开一个上游流：
+后到的请求加入正在进行的生成，先收到已产生的全部事件，再与其他订阅者同步接收后续事件。
+所有订阅者都离开（客户端断开）后立即取消上游请求，并按 max_tokens 与已生成的 Token 数之差
+估算节省的输出 Token 数。
+"""
+import asyncio
+import os
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from token_budget import token_counter
+
+from app_logging import get_logger
+
+logger = get_logger("generations")
+
+AI_STREAM_SINGLE_FLIGHT = os.getenv("AI_STREAM_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+
+class Generation:
+    """一次上游生成：后台任务消费上游事件，按顺序保存并通知订阅者"""
+
+    def __init__(self, key: str, max_tokens: Optional[int] = None):
+        self.key = key
+        self.max_tokens = max_tokens
+        self.events = []
+        self.finished = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _publish(self, event: dict):
+        self.events.append(event)
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self, source: AsyncIterator[dict], on_finish: Callable):
+        try:
+            async for event in source:
+                self._publish(event)
+        except asyncio.CancelledError:
+            self.cancelled = True
+        except Exception as e:
+            self._publish({"type": "error", "message": f"AI服务调用失败: {type(e).__name__}: {str(e)}"})
+        finally:
+            self.finished = True
+            self._wake()
+            on_finish(self)
+
+    def generated_tokens(self) -> int:
+        return token_counter.count("".join(
+            e.get("content", "") for e in self.events if e.get("type") in ("content", "thinking")
+        ))
+
+    def tokens_saved(self) -> int:
+        """取消时尚未生成的输出Token数（按 max_tokens 估算，未设置时为 0）"""
+        if not self.cancelled or not self.max_tokens:
+            return 0
+        return max(self.max_tokens - self.generated_tokens(), 0)
+
+    async def follow(self, start: int = 0):
+        """从第 start 个事件开始依次产出事件，直到生成结束"""
+        self.subscribers += 1
+        index = start
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.finished:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished and self.task is not None:
+                # 没有订阅者了，停止上游生成
+                self.task.cancel()
+
+
+class GenerationRegistry:
+    """按上游请求内容索引进行中的生成，只在事件循环中访问"""
+
+    def __init__(self, enabled: bool = AI_STREAM_SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._active: Dict[str, Generation] = {}
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+        self.tokens_saved = 0
+
+    def join_or_start(self, key: str, source_factory: Callable[[], AsyncIterator[dict]],
+                      max_tokens: Optional[int] = None) -> Tuple[Generation, bool]:
+        """返回 (生成, 是否加入了已有的生成)"""
+        if self.enabled:
+            generation = self._active.get(key)
+            if generation is not None and not generation.finished:
+                self.joined += 1
+                return generation, True
+
+        generation = Generation(key, max_tokens)
+        if self.enabled:
+            self._active[key] = generation
+        self.started += 1
+        generation.task = asyncio.create_task(generation._run(source_factory(), self._discard))
+        return generation, False
+
+    def _discard(self, generation: Generation):
+        if generation.cancelled:
+            saved = generation.tokens_saved()
+            self.cancelled += 1
+            self.tokens_saved += saved
+            logger.info("客户端已断开，取消上游生成 %s，约节省 %d 个输出Token", generation.key[:12], saved)
+        if self._active.get(generation.key) is generation:
+            del self._active[generation.key]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "active": len(self._active),
+            "subscribers": sum(g.subscribers for g in self._active.values()),
+            "started": self.started,
+            "joined": self.joined,
+            "cancelled": self.cancelled,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+generations = GenerationRegistry()
@@ -0,0 +1,184 @@
+"""
+多提供商对冲请求
+
+AIModel.hedge_model_ids 声明备用模型（通常是其他提供商上的同一模型）。流式对话先请求主模型，
+若在对冲延迟内没有收到首个Token，再向下一个备用模型发出同样的请求；最先产出Token的流胜出，
+其余的请求立即取消。候选在首个Token之前失败时直接切换到下一个候选。
+
+对冲延迟由每个提供商的首Token延迟（TTFT）直方图自动得出：取近期分布的 AI_HEDGE_QUANTILE 分位，
+样本不足时使用 AI_HEDGE_DELAY。
+"""
+import asyncio
+import bisect
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from app_logging import get_logger
+
+logger = get_logger("hedging")
+
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_HEDGE_DELAY = float(os.getenv("AI_HEDGE_DELAY", "3"))
+AI_HEDGE_QUANTILE = float(os.getenv("AI_HEDGE_QUANTILE", "0.9"))
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.5"))
+AI_HEDGE_MAX_DELAY = float(os.getenv("AI_HEDGE_MAX_DELAY", "15"))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+# 样本总数超过该值时所有桶减半，使分布偏向近期
+TTFT_DECAY_THRESHOLD = 1000
+
+# 不算作首个Token的事件类型
+PASSTHROUGH_EVENTS = ("queue",)
+
+# 桶上界（秒），按 1.5 倍递增，覆盖 50ms 到约 2 分钟
+TTFT_BUCKETS = [round(0.05 * 1.5 ** i, 3) for i in range(20)]
+
+
+class TTFTHistogram:
+    """固定桶的首Token延迟直方图"""
+
+    def __init__(self):
+        self.counts = [0] * (len(TTFT_BUCKETS) + 1)
+        self.total = 0
+        self.samples = 0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(TTFT_BUCKETS, seconds)] += 1
+        self.total += 1
+        self.samples += 1
+        if self.total > TTFT_DECAY_THRESHOLD:
+            self.counts = [c // 2 for c in self.counts]
+            self.total = sum(self.counts)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回分位数所在桶的上界，没有样本时返回 None"""
+        if self.total == 0:
+            return None
+        target = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return TTFT_BUCKETS[i] if i < len(TTFT_BUCKETS) else AI_HEDGE_MAX_DELAY
+        return AI_HEDGE_MAX_DELAY
+
+
+class TTFTStats:
+    """按提供商记录首Token延迟"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[int, TTFTHistogram] = {}
+
+    def record(self, provider_id: int, seconds: float):
+        with self._lock:
+            self._histograms.setdefault(provider_id, TTFTHistogram()).record(seconds)
+
+    def hedge_delay(self, provider_id: int) -> float:
+        with self._lock:
+            histogram = self._histograms.get(provider_id)
+            if histogram is None or histogram.samples < AI_HEDGE_MIN_SAMPLES:
+                return AI_HEDGE_DELAY
+            delay = histogram.quantile(AI_HEDGE_QUANTILE)
+        return min(max(delay, AI_HEDGE_MIN_DELAY), AI_HEDGE_MAX_DELAY)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            items = list(self._histograms.items())
+        return {
+            provider_id: {
+                "samples": h.samples,
+                "p50": h.quantile(0.5),
+                "p90": h.quantile(0.9),
+                "p99": h.quantile(0.99),
+                "hedge_delay": self.hedge_delay(provider_id),
+            }
+            for provider_id, h in items
+        }
+
+
+ttft_stats = TTFTStats()
+
+
+async def hedged_stream(candidates: List, stream_fn: Callable, delay_fn: Callable = None):
+    """
+    依次对候选发起流式请求并竞速，产出胜出者的事件。
+    candidates 为 ChatContext 列表（第一个为主模型），stream_fn(ctx) 返回事件的异步迭代器。
+    """
+    if len(candidates) == 1 or not AI_HEDGE_ENABLED:
+        async for event in stream_fn(candidates[0]):
+            yield event
+        return
+
+    delay_fn = delay_fn or (lambda ctx: ttft_stats.hedge_delay(ctx.provider.id))
+    running = {}  # 等待首个事件的任务 -> (候选序号, 迭代器)
+    iterators = []
+    launched = 0
+    winner = None
+    last_error = None
+
+    def launch():
+        nonlocal launched
+        ctx = candidates[launched]
+        iterator = stream_fn(ctx).__aiter__()
+        iterators.append(iterator)
+        running[asyncio.ensure_future(iterator.__anext__())] = (launched, iterator)
+        if launched:
+            logger.info("向备用提供商 %s 发出对冲请求", ctx.provider.name)
+        launched += 1
+
+    launch()
+    try:
+        while winner is None:
+            timeout = delay_fn(candidates[launched - 1]) if launched < len(candidates) else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 超过对冲延迟仍未收到首个Token
+                launch()
+                continue
+            for task in done:
+                index, iterator = running.pop(task)
+                try:
+                    event = task.result()
+                except StopAsyncIteration:
+                    event = None
+                if event is not None and event.get("type") in PASSTHROUGH_EVENTS:
+                    # 排队位置等事件直接转发，继续等待该候选的首个Token
+                    yield event
+                    running[asyncio.ensure_future(iterator.__anext__())] = (index, iterator)
+                    continue
+                if event is not None and event.get("type") == "error":
+                    # 首个Token之前失败，立即尝试下一个候选
+                    last_error = event
+                    if launched < len(candidates):
+                        launch()
+                    continue
+                if winner is None:
+                    winner = (index, iterator, event)
+            if winner is None and not running:
+                if last_error is not None:
+                    yield last_error
+                return
+    finally:
+        for task in running:
+            task.cancel()
+        # 等取消生效后再关闭迭代器
+        await asyncio.gather(*running, return_exceptions=True)
+        for iterator in iterators:
+            if winner is None or iterator is not winner[1]:
+                try:
+                    await iterator.aclose()
+                except Exception:
+                    pass
+
+    index, iterator, first_event = winner
+    if index:
+        logger.info("对冲请求: 备用提供商 %s 胜出", candidates[index].provider.name)
+    if first_event is None:
+        return
+    try:
+        yield first_event
+        async for event in iterator:
+            yield event
+    finally:
+        await iterator.aclose()
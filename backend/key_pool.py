@@ -0,0 +1,169 @@
+"""
+按提供商的 API 密钥池
+
+一个提供商可以配置多个密钥（AIProvider.api_key 加上 AIProvider.api_keys），每次请求从池中选一个：
+    least_in_flight       进行中请求最少的密钥，相同时按权重轮询（默认）
+    weighted_round_robin  平滑加权轮询
+返回 401 的密钥冷却 AI_KEY_AUTH_COOLDOWN 秒，返回 429 的密钥按 Retry-After 冷却，冷却期间不参与选择；
+全部密钥都在冷却时选最早恢复的一个。每个密钥的使用计数可通过接口查看（密钥本身脱敏）。
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from app_logging import get_logger
+
+logger = get_logger("key_pool")
+
+AI_KEY_STRATEGY = os.getenv("AI_KEY_STRATEGY", "least_in_flight")
+AI_KEY_AUTH_COOLDOWN = float(os.getenv("AI_KEY_AUTH_COOLDOWN", "600"))
+AI_KEY_RATE_COOLDOWN = float(os.getenv("AI_KEY_RATE_COOLDOWN", "30"))
+
+
+def mask_key(key: str) -> str:
+    """日志中只显示密钥末4位（前缀如 sk-proj- 各密钥相同，且会泄露密钥类型）"""
+    if len(key) <= 10:
+        return "*" * len(key)
+    return f"****{key[-4:]}"
+
+
+class KeyState:
+    def __init__(self, key: str, weight: int = 1):
+        self.key = key
+        self.weight = max(int(weight or 1), 1)
+        self.current_weight = 0  # 平滑加权轮询的当前权重
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.auth_errors = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+        self.last_used = None
+
+    def available(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "key": mask_key(self.key),
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "auth_errors": self.auth_errors,
+            "rate_limited": self.rate_limited,
+            "cooling_down": round(max(self.cooldown_until - now, 0.0), 3),
+            "last_used": self.last_used,
+        }
+
+
+class ProviderKeyPool:
+    def __init__(self, keys: Sequence[tuple], strategy: str = AI_KEY_STRATEGY):
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self.states: List[KeyState] = [KeyState(k, w) for k, w in keys]
+
+    @property
+    def signature(self):
+        return tuple((s.key, s.weight) for s in self.states)
+
+    def _weighted_pick(self, candidates: List[KeyState]) -> KeyState:
+        # 平滑加权轮询（与 nginx 相同），避免同一密钥连续被选中
+        total = sum(s.weight for s in candidates)
+        for s in candidates:
+            s.current_weight += s.weight
+        best = max(candidates, key=lambda s: s.current_weight)
+        best.current_weight -= total
+        return best
+
+    def acquire(self) -> Optional[KeyState]:
+        now = time.monotonic()
+        with self._lock:
+            if not self.states:
+                return None
+            candidates = [s for s in self.states if s.available(now)]
+            if not candidates:
+                # 全部冷却中：选最早恢复的密钥
+                candidates = [min(self.states, key=lambda s: s.cooldown_until)]
+            if self.strategy == "least_in_flight":
+                fewest = min(s.in_flight for s in candidates)
+                candidates = [s for s in candidates if s.in_flight == fewest]
+            state = self._weighted_pick(candidates)
+            state.in_flight += 1
+            state.requests += 1
+            state.last_used = time.time()
+            return state
+
+    def release(self, state: KeyState, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """请求结束；status 为上游状态码，None 表示连接失败等没有响应的情况"""
+        now = time.monotonic()
+        with self._lock:
+            state.in_flight -= 1
+            if status == 200:
+                state.successes += 1
+                return
+            state.failures += 1
+            if status == 401:
+                state.auth_errors += 1
+                state.cooldown_until = now + AI_KEY_AUTH_COOLDOWN
+                logger.warning("密钥 %s 认证失败，冷却 %.0f 秒", mask_key(state.key), AI_KEY_AUTH_COOLDOWN)
+            elif status == 429:
+                state.rate_limited += 1
+                state.cooldown_until = now + (retry_after if retry_after is not None else AI_KEY_RATE_COOLDOWN)
+
+    def has_available(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(s.available(now) for s in self.states)
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [s.to_dict(now) for s in self.states]
+
+
+def provider_keys(api_key: Optional[str], api_keys) -> List[tuple]:
+    """合并主密钥和密钥列表，返回去重后的 [(密钥, 权重)]"""
+    keys = []
+    seen = set()
+    entries = ([api_key] if api_key else []) + list(api_keys or [])
+    for entry in entries:
+        if isinstance(entry, dict):
+            key, weight = entry.get("key"), entry.get("weight", 1)
+        else:
+            key, weight = entry, 1
+        key = (key or "").strip()
+        if key and key not in seen:
+            seen.add(key)
+            keys.append((key, weight))
+    return keys
+
+
+class KeyPoolRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[int, ProviderKeyPool] = {}
+
+    def for_provider(self, provider) -> ProviderKeyPool:
+        """provider 需要 id 和 api_keys（[(密钥, 权重)]）；密钥配置变化时重建，保留未变密钥的计数"""
+        keys = tuple(provider.api_keys)
+        with self._lock:
+            pool = self._pools.get(provider.id)
+            if pool is None or pool.signature != keys:
+                old = {s.key: s for s in pool.states} if pool is not None else {}
+                pool = ProviderKeyPool(keys)
+                pool.states = [old.get(k) if k in old and old[k].weight == w else s
+                               for (k, w), s in zip(keys, pool.states)]
+                self._pools[provider.id] = pool
+            return pool
+
+    def stats(self, provider_id: int) -> List[dict]:
+        with self._lock:
+            pool = self._pools.get(provider_id)
+        return pool.stats() if pool is not None else []
+
+
+key_pools = KeyPoolRegistry()
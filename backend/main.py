@@ -1,15 +1,17 @@
 
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload, load_only, noload, undefer
 import uvicorn
 import os
 import json
 import aiofiles
+import asyncio
 import httpx
-from typing import List, Optional
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field
 
 from database import SessionLocal, engine, Base
@@ -24,7 +26,7 @@ from models import (
 from schemas import (
     ProjectCreate, ProjectResponse,
     VolumeCreate, VolumeResponse,
-    ChapterCreate, ChapterResponse,
+    ChapterCreate, ChapterResponse, ChapterOutline, VolumeOutline, ProjectOutlineResponse,
     AIProviderCreate, AIProviderResponse, AIProviderUpdate,
     AIModelCreate, AIModelResponse, AIModelUpdate,
     PromptTemplateCreate, PromptTemplateResponse,
@@ -35,8 +37,32 @@ from schemas import (
     WeaponCreate, WeaponResponse,
     DungeonCreate, DungeonResponse,
     ConversationResponse, MessageResponse, ConversationUpdate,
+    ProjectStatsResponse, VolumeStats, LastEditedChapter,
     NovelGenreCreate, NovelGenreResponse
 )
+from resource_index import resource_index
+from pagination import PageParams, paginate, NEXT_CURSOR_HEADER
+from novel_import import NovelImporter
+from novel_parser import parse_novel, NovelParseError
+from project_stats import count_words, repair_stats, volume_chapters_deleted
+from prompt_utils import prompt_renderer
+from template_cache import template_variables
+from ai_clients import ai_clients, AI_HTTP_PREWARM
+from response_cache import response_cache
+from generations import generations
+from chat_streams import chat_streams
+from hedging import ttft_stats
+from rate_limiter import rate_limiters
+from key_pool import key_pools
+from circuit_breaker import circuit_breakers
+from ai_adapters import adapters, ADAPTERS
+from app_logging import get_logger, logging_stats, shutdown_logging, RequestIdMiddleware
+from chat_service import (
+    prepare_chat, call_ai, save_assistant_message, generate_chat_stream, provider_info, ChatStreamingResponse,
+    follow_chat_stream, mark_interrupted_replies
+)
+
+logger = get_logger("main")
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
@@ -46,7 +72,7 @@ try:
     from init_default_data import init_default_data
     init_default_data()
 except Exception as e:
-    print(f"警告: 初始化默认数据时出错: {e}")
+    logger.warning("初始化默认数据时出错: %s", e)
 
 # FastAPI应用
 app = FastAPI(title="StoryForge API", version="1.0.0")
@@ -58,7 +84,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", NEXT_CURSOR_HEADER],
 )
+app.add_middleware(RequestIdMiddleware)
+
+@app.on_event("startup")
+async def prewarm_ai_clients():
+    """预热到已启用AI提供商的连接"""
+    if not AI_HTTP_PREWARM:
+        return
+    db = SessionLocal()
+    try:
+        providers = [
+            (p.id, p.base_url) for p in
+            db.query(AIProvider).filter(AIProvider.enabled == True, AIProvider.api_key != None, AIProvider.api_key != "")
+        ]
+    except Exception as e:
+        logger.warning("读取AI提供商失败，跳过连接预热: %s", e)
+        return
+    finally:
+        db.close()
+    # 后台进行，不阻塞启动
+    asyncio.create_task(ai_clients.prewarm(providers))
+
+@app.on_event("startup")
+def recover_interrupted_replies():
+    """上次退出时仍在生成的回复只保存到了最近的检查点，标记为截断"""
+    db = SessionLocal()
+    try:
+        count = mark_interrupted_replies(db)
+        if count:
+            logger.info("已将 %d 条未完成的AI回复标记为截断", count)
+    except Exception as e:
+        logger.warning("检查未完成的AI回复失败: %s", e)
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def close_ai_clients():
+    await ai_clients.aclose()
+
+@app.on_event("shutdown")
+def flush_logs():
+    shutdown_logging()
 
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
@@ -71,42 +139,12 @@ def get_db():
     finally:
         db.close()
 
-# URL处理函数 - 与前端保持一致
-def process_openai_url(base_url: str) -> str:
-    """
-    处理OpenAI兼容API的URL，与前端逻辑保持一致
-    规则1: URL以#结尾，移除#后直接使用
-    规则2: URL以/结尾，移除/后补充 /chat/completions
-    规则3: URL不以/结尾，补充 /v1/chat/completions
-    """
-    base_url = base_url.strip()
-    
-    # 规则1: 以#结尾，移除#后直接使用
-    if base_url.endswith('#'):
-        return base_url[:-1]
-    
-    # 规则2: 以/结尾，移除/后补充 /chat/completions
-    if base_url.endswith('/'):
-        return f"{base_url[:-1]}/chat/completions"
-    
-    # 规则3: 不以/结尾，补充 /v1/chat/completions
-    return f"{base_url}/v1/chat/completions"
-
-
 # 项目相关API
 @app.get("/api/projects", response_model=List[ProjectResponse])
 def get_projects(db: Session = Depends(get_db)):
     """获取所有项目"""
-    # 使用 joinedload 高效地一次性获取所有项目及其关联的章节，按 display_order 排序
-    projects = db.query(Project).options(joinedload(Project.chapters)).order_by(Project.display_order).all()
-    
-    # 为每个项目计算字数和章节数统计
-    for project in projects:
-        # 从已加载的关系中计算统计数据
-        project.chapter_count = len(project.chapters)
-        project.word_count = sum(c.word_count for c in project.chapters if c.word_count is not None)
-    
-    return projects
+    # 章节数和字数读取 project_stats 维护的计数
+    return db.query(Project).order_by(Project.display_order).all()
 
 @app.put("/api/projects/reorder")
 def reorder_projects(project_ids: List[int], db: Session = Depends(get_db)):
@@ -135,46 +173,100 @@ class NovelImport(BaseModel):
     author: Optional[str] = None
     volumes: List[VolumeImport]
 
+def _run_import(db: Session, project: Project, write, total: Optional[int] = None):
+    """在一个事务中导入整部小说，失败时回滚
+
+    write(importer) 写入分卷和章节；本函数是生成器，每写入一批章节产出一次进度 {"imported", "total"}，
+    最后产出 {"project": 项目}。
+    """
+    reported = 0
+    try:
+        importer = NovelImporter(db, project)
+        for _ in write(importer):
+            if importer.imported != reported:
+                reported = importer.imported
+                yield {"imported": reported, "total": total}
+        importer.finish()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if importer.imported != reported:
+        yield {"imported": importer.imported, "total": total}
+    # 章节由批量插入写入，不触发会话事件，需要手动使资源索引失效
+    resource_index.invalidate(project.id)
+    db.refresh(project)
+    yield {"project": project}
+
+def _import_response(steps, progress: bool):
+    """progress=true 时以 NDJSON 流返回进度：每写入一批章节一行 {"imported", "total"}，
+    最后一行 {"project": 项目} 或 {"error": 错误信息}；否则导入完成后返回项目"""
+    if not progress:
+        for step in steps:
+            pass
+        return step["project"]
+
+    def lines():
+        try:
+            for step in steps:
+                if "project" in step:
+                    step = {"project": ProjectResponse.model_validate(step["project"]).model_dump(mode="json")}
+                yield json.dumps(step, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.exception("导入小说失败")
+            yield json.dumps({"error": f"导入失败: {e}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/api/projects/import", response_model=ProjectResponse)
-def import_project(novel_data: NovelImport, db: Session = Depends(get_db)):
+def import_project(novel_data: NovelImport, progress: bool = False, db: Session = Depends(get_db)):
     """导入新项目"""
-    print("Importing novel data:", novel_data.model_dump_json(indent=2))
-    # 创建项目
-    db_project = Project(
+    project = Project(
         title=novel_data.title,
         genre=novel_data.genre,
         description=novel_data.description,
         author=novel_data.author
     )
-    db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
 
-    # 导入分卷和章节
-    for volume_data in novel_data.volumes:
-        db_volume = Volume(
-            title=volume_data.title,
-            project_id=db_project.id,
-            order=volume_data.order
-        )
-        db.add(db_volume)
-        db.commit()
-        db.refresh(db_volume)
-
-        for chapter_data in volume_data.chapters:
-            db_chapter = Chapter(
-                title=chapter_data.title,
-                content=chapter_data.content,
-                volume_id=db_volume.id,
-                project_id=db_project.id,
-                order=chapter_data.order,
-                word_count=len(chapter_data.content)
-            )
-            db.add(db_chapter)
-            db.commit()
-            db.refresh(db_chapter)
+    def write(importer):
+        volume_ids = importer.add_volumes((v.title, v.order) for v in novel_data.volumes)
+        for volume_id, volume_data in zip(volume_ids, novel_data.volumes):
+            for chapter_data in volume_data.chapters:
+                importer.add_chapter(volume_id, chapter_data.title, chapter_data.content, chapter_data.order)
+                yield
+
+    total = sum(len(v.chapters) for v in novel_data.volumes)
+    return _import_response(_run_import(db, project, write, total), progress)
+
+@app.post("/api/projects/import/upload", response_model=ProjectResponse)
+def import_project_file(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+    genre: str = Form("未分类"),
+    author: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    progress: bool = False,
+    db: Session = Depends(get_db),
+):
+    """上传 TXT（常见中文编码）或 EPUB 文件导入新项目
+
+    按 第X卷 / 第X章 等标题拆分分卷和章节，边读边分批写入，内存占用不随文件大小增长。
+    """
+    filename = file.filename or ""
+    project = Project(
+        title=title or os.path.splitext(os.path.basename(filename))[0] or "导入的小说",
+        genre=genre,
+        description=description,
+        author=author
+    )
 
-    return db_project
+    def write(importer):
+        return importer.add_parsed(parse_novel(file.file, filename))
+
+    try:
+        return _import_response(_run_import(db, project, write), progress)
+    except NovelParseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/projects", response_model=ProjectResponse)
 def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
@@ -185,6 +277,33 @@ def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
     db.refresh(db_project)
     return db_project
 
+@app.get("/api/projects/{project_id}/stats", response_model=ProjectStatsResponse)
+def get_project_stats(project_id: int, db: Session = Depends(get_db)):
+    """项目及各分卷的章节数、字数和最近编辑的章节"""
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="项目不存在")
+    last_edited = None
+    if project.last_edited_chapter_id:
+        last_edited = (
+            db.query(Chapter.id, Chapter.title, Chapter.volume_id, Chapter.updated_at)
+            .filter(Chapter.id == project.last_edited_chapter_id)
+            .first()
+        )
+    volumes = db.query(Volume).filter(Volume.project_id == project_id).order_by(Volume.order, Volume.id).all()
+    return ProjectStatsResponse(
+        project_id=project.id,
+        chapter_count=project.chapter_count,
+        word_count=project.word_count,
+        last_edited_chapter=LastEditedChapter.model_validate(last_edited) if last_edited else None,
+        volumes=[VolumeStats.model_validate(v) for v in volumes],
+    )
+
+@app.post("/api/projects/stats/repair")
+def repair_project_stats(db: Session = Depends(get_db)):
+    """按章节重新统计所有项目和分卷的计数"""
+    return {"repaired": repair_stats(db)}
+
 @app.get("/api/projects/{project_id}", response_model=ProjectResponse)
 def get_project(project_id: int, db: Session = Depends(get_db)):
     """获取特定项目"""
@@ -273,20 +392,67 @@ def delete_volume(volume_id: int, db: Session = Depends(get_db)):
     if not db_volume:
         raise HTTPException(status_code=404, detail="分卷不存在")
 
+    project_id = db_volume.project_id
+
     # 首先，删除该分卷下的所有章节
     db.query(Chapter).filter(Chapter.volume_id == volume_id).delete(synchronize_session=False)
+    # 批量删除不触发会话事件，需要手动更新项目统计
+    volume_chapters_deleted(db, db_volume)
     
     # 然后，删除分卷本身
     db.delete(db_volume)
     db.commit()
+    # 批量删除不触发会话事件，需要手动使资源索引失效
+    resource_index.invalidate(project_id)
     return {"message": "分卷已删除"}
 
 # 章节相关API
-@app.get("/api/volumes/{volume_id}/chapters", response_model=List[ChapterResponse])
-def get_chapters(volume_id: int, db: Session = Depends(get_db)):
-    """获取分卷的所有章节"""
-    chapters = db.query(Chapter).filter(Chapter.volume_id == volume_id).all()
-    return chapters
+# 大纲只读取这些列，正文不会从数据库中读出
+OUTLINE_COLUMNS = (Chapter.id, Chapter.title, Chapter.order, Chapter.word_count, Chapter.volume_id, Chapter.updated_at)
+# 批量获取章节正文时一次最多的章节数
+MAX_CHAPTERS_PER_REQUEST = 100
+
+@app.get("/api/volumes/{volume_id}/chapters", response_model=List[Union[ChapterResponse, ChapterOutline]])
+def get_chapters(volume_id: int, response: Response, outline: bool = False,
+                 page: PageParams = Depends(), db: Session = Depends(get_db)):
+    """获取分卷的章节，按 (order, id) 分页；outline=true 时只返回大纲（不含正文）"""
+    query = db.query(Chapter).filter(Chapter.volume_id == volume_id)
+    if outline:
+        chapters = paginate(query.options(load_only(*OUTLINE_COLUMNS)), (Chapter.order, Chapter.id), page, response)
+        return [ChapterOutline.model_validate(c) for c in chapters]
+    return paginate(query.options(undefer(Chapter.content)), (Chapter.order, Chapter.id), page, response)
+
+@app.get("/api/chapters", response_model=List[ChapterResponse])
+def get_chapters_by_ids(ids: List[int] = Query(...), db: Session = Depends(get_db)):
+    """按id批量获取章节（含正文），按请求中的顺序返回，不存在的id忽略"""
+    if len(ids) > MAX_CHAPTERS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"一次最多获取 {MAX_CHAPTERS_PER_REQUEST} 个章节")
+    chapters = {c.id: c for c in db.query(Chapter).options(undefer(Chapter.content)).filter(Chapter.id.in_(ids))}
+    return [chapters[i] for i in dict.fromkeys(ids) if i in chapters]
+
+@app.get("/api/projects/{project_id}/outline", response_model=ProjectOutlineResponse)
+def get_project_outline(project_id: int, db: Session = Depends(get_db)):
+    """项目大纲：所有分卷及其章节标题，一次查询"""
+    rows = (
+        db.query(Volume.id, Volume.title, Volume.order, Volume.chapter_count, Volume.word_count, *OUTLINE_COLUMNS)
+        .outerjoin(Chapter, Chapter.volume_id == Volume.id)
+        .filter(Volume.project_id == project_id)
+        .order_by(Volume.order, Volume.id, Chapter.order, Chapter.id)
+        .all()
+    )
+    if not rows and not db.query(Project.id).filter(Project.id == project_id).first():
+        raise HTTPException(status_code=404, detail="项目不存在")
+
+    volumes = {}
+    for volume_id, title, order, chapter_count, word_count, *chapter in rows:
+        volume = volumes.get(volume_id)
+        if volume is None:
+            volume = volumes[volume_id] = VolumeOutline(
+                id=volume_id, title=title, order=order, chapter_count=chapter_count, word_count=word_count,
+            )
+        if chapter[0] is not None:
+            volume.chapters.append(ChapterOutline(**{c.key: v for c, v in zip(OUTLINE_COLUMNS, chapter)}))
+    return ProjectOutlineResponse(project_id=project_id, volumes=list(volumes.values()))
 
 @app.post("/api/volumes/{volume_id}/chapters", response_model=ChapterResponse)
 def create_chapter(volume_id: int, chapter: ChapterCreate, db: Session = Depends(get_db)):
@@ -296,6 +462,8 @@ def create_chapter(volume_id: int, chapter: ChapterCreate, db: Session = Depends
         raise HTTPException(status_code=404, detail="分卷不存在")
     
     chapter_data = chapter.dict(exclude={"volume_id"})
+    if chapter_data.get("content") is not None:
+        chapter_data["word_count"] = count_words(chapter_data["content"])
     db_chapter = Chapter(project_id=volume.project_id, volume_id=volume_id, **chapter_data)
     db.add(db_chapter)
     
@@ -312,7 +480,7 @@ def create_chapter(volume_id: int, chapter: ChapterCreate, db: Session = Depends
 @app.get("/api/chapters/{chapter_id}", response_model=ChapterResponse)
 def get_chapter(chapter_id: int, db: Session = Depends(get_db)):
     """获取特定章节"""
-    chapter = db.query(Chapter).filter(Chapter.id == chapter_id).first()
+    chapter = db.query(Chapter).options(undefer(Chapter.content)).filter(Chapter.id == chapter_id).first()
     if not chapter:
         raise HTTPException(status_code=404, detail="章节不存在")
     return chapter
@@ -325,6 +493,8 @@ def update_chapter(chapter_id: int, chapter: ChapterCreate, db: Session = Depend
         raise HTTPException(status_code=404, detail="章节不存在")
 
     update_data = chapter.dict(exclude_unset=True)
+    if update_data.get("content") is not None:
+        update_data["word_count"] = count_words(update_data["content"])
 
     # 如果要移动章节到新的分卷
     if "volume_id" in update_data and update_data["volume_id"] != db_chapter.volume_id:
@@ -374,7 +544,12 @@ def delete_chapter(chapter_id: int, db: Session = Depends(get_db)):
 def get_ai_providers(db: Session = Depends(get_db)):
     """获取所有AI提供商"""
     providers = db.query(AIProvider).order_by(AIProvider.display_order).all()
-    return providers
+    result = []
+    for provider in providers:
+        item = AIProviderResponse.model_validate(provider)
+        item.circuit = circuit_breakers.state(provider.id)
+        result.append(item)
+    return result
 
 @app.post("/api/ai-providers", response_model=AIProviderResponse)
 def create_ai_provider(provider: AIProviderCreate, db: Session = Depends(get_db)):
@@ -409,6 +584,7 @@ def update_ai_provider(provider_id: int, provider: AIProviderUpdate, db: Session
 
     db.commit()
     db.refresh(db_provider)
+    circuit_breakers.reset(provider_id)
     return db_provider
 
 @app.delete("/api/ai-providers/{provider_id}")
@@ -420,9 +596,27 @@ def delete_ai_provider(provider_id: int, db: Session = Depends(get_db)):
 
     db.delete(db_provider)
     db.commit()
+    circuit_breakers.reset(provider_id)
     return {"message": "AI提供商已删除"}
 
+@app.get("/api/ai-providers/{provider_id}/keys")
+def get_ai_provider_key_stats(provider_id: int, db: Session = Depends(get_db)):
+    """密钥池中每个密钥的使用计数（密钥已脱敏）"""
+    db_provider = db.query(AIProvider).filter(AIProvider.id == provider_id).first()
+    if not db_provider:
+        raise HTTPException(status_code=404, detail="AI提供商不存在")
+    return key_pools.for_provider(provider_info(db_provider)).stats()
+
 # AI 模型相关 API
+def _check_adapter(adapter: Optional[str]):
+    if adapter and adapter not in ADAPTERS:
+        raise HTTPException(status_code=400, detail=f"未知的响应适配器: {adapter}，可选: {', '.join(ADAPTERS)}")
+
+@app.get("/api/ai-adapters")
+def get_ai_adapters():
+    """可用的流式响应适配器，以及各模型自动判断出的适配器"""
+    return {"adapters": list(ADAPTERS), "resolved": adapters.stats()}
+
 @app.get("/api/ai-providers/{provider_id}/ai-models", response_model=List[AIModelResponse])
 def get_ai_models_for_provider(provider_id: int, db: Session = Depends(get_db)):
     """获取特定AI提供商的所有模型"""
@@ -432,6 +626,7 @@ def get_ai_models_for_provider(provider_id: int, db: Session = Depends(get_db)):
 @app.post("/api/ai-providers/{provider_id}/ai-models", response_model=AIModelResponse)
 def create_ai_model(provider_id: int, model: AIModelCreate, db: Session = Depends(get_db)):
     """为AI提供商创建新的模型配置"""
+    _check_adapter(model.adapter)
     db_model = AIModel(**model.model_dump(), provider_id=provider_id)
     db.add(db_model)
     db.commit()
@@ -446,11 +641,14 @@ def update_ai_model(model_id: int, model: AIModelUpdate, db: Session = Depends(g
         raise HTTPException(status_code=404, detail="AI模型不存在")
 
     update_data = model.model_dump(exclude_unset=True)
+    _check_adapter(update_data.get("adapter"))
     for key, value in update_data.items():
         setattr(db_model, key, value)
 
     db.commit()
     db.refresh(db_model)
+    # 模型标识或固定的适配器可能变化，重新判断
+    adapters.forget(model_id)
     return db_model
 
 @app.delete("/api/ai-models/{model_id}")
@@ -480,29 +678,32 @@ def get_all_ai_models(db: Session = Depends(get_db)):
 
 # 提示模板相关API
 @app.get("/api/prompt-templates", response_model=List[PromptTemplateResponse])
-def get_prompt_templates(db: Session = Depends(get_db)):
-    """获取所有提示模板"""
+def get_prompt_templates(response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    """获取所有提示模板，按 (created_at, id) 分页"""
     try:
-        templates = db.query(PromptTemplate).all()
-        return templates
+        return paginate(db.query(PromptTemplate), (PromptTemplate.created_at, PromptTemplate.id), page, response)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"查询提示词模板时出错: {str(e)}")
+        logger.exception("查询提示词模板时出错")
         raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
 
 @app.post("/api/prompt-templates", response_model=PromptTemplateResponse)
 def create_prompt_template(template: PromptTemplateCreate, db: Session = Depends(get_db)):
     """创建新的提示模板"""
     db_template = PromptTemplate(**template.model_dump())
+    # 记录模板中的占位符，供前端展示和缓存使用
+    db_template.variables = template_variables(db_template.content)
     db.add(db_template)
     db.commit()
     db.refresh(db_template)
     return db_template
 
 @app.get("/api/projects/{project_id}/prompt-templates", response_model=List[PromptTemplateResponse])
-def get_project_prompt_templates(project_id: int, db: Session = Depends(get_db)):
+def get_project_prompt_templates(project_id: int, response: Response, page: PageParams = Depends(),
+                                 db: Session = Depends(get_db)):
     """获取项目的所有提示模板（返回所有全局提示词模板）"""
-    templates = db.query(PromptTemplate).all()
-    return templates
+    return paginate(db.query(PromptTemplate), (PromptTemplate.created_at, PromptTemplate.id), page, response)
 
 @app.put("/api/prompt-templates/{template_id}", response_model=PromptTemplateResponse)
 def update_prompt_template(template_id: int, template: PromptTemplateCreate, db: Session = Depends(get_db)):
@@ -514,6 +715,7 @@ def update_prompt_template(template_id: int, template: PromptTemplateCreate, db:
     update_data = template.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_template, key, value)
+    db_template.variables = template_variables(db_template.content)
 
     db.commit()
     db.refresh(db_template)
@@ -605,9 +807,10 @@ def reorder_dungeons(request: ResourceReorderRequest, db: Session = Depends(get_
 
 # 角色 (RPGCharacter)
 @app.get("/api/projects/{project_id}/rpg_characters", response_model=List[RPGCharacterResponse])
-def get_rpg_characters(project_id: int, db: Session = Depends(get_db)):
+def get_rpg_characters(project_id: int, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
     """获取项目的所有角色"""
-    return db.query(RPGCharacter).filter(RPGCharacter.project_id == project_id).order_by(RPGCharacter.display_order).all()
+    query = db.query(RPGCharacter).filter(RPGCharacter.project_id == project_id)
+    return paginate(query, (RPGCharacter.display_order, RPGCharacter.id), page, response)
 
 @app.post("/api/projects/{project_id}/rpg_characters", response_model=RPGCharacterResponse)
 def create_rpg_character(project_id: int, character: RPGCharacterCreate, db: Session = Depends(get_db)):
@@ -650,8 +853,9 @@ def delete_rpg_character(character_id: int, db: Session = Depends(get_db)):
 
 # 组织 (Organization)
 @app.get("/api/projects/{project_id}/organizations", response_model=List[OrganizationResponse])
-def get_organizations(project_id: int, db: Session = Depends(get_db)):
-    return db.query(Organization).filter(Organization.project_id == project_id).order_by(Organization.display_order).all()
+def get_organizations(project_id: int, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    query = db.query(Organization).filter(Organization.project_id == project_id)
+    return paginate(query, (Organization.display_order, Organization.id), page, response)
 
 @app.post("/api/projects/{project_id}/organizations", response_model=OrganizationResponse)
 def create_organization(project_id: int, organization: OrganizationCreate, db: Session = Depends(get_db)):
@@ -690,8 +894,9 @@ def delete_organization(organization_id: int, db: Session = Depends(get_db)):
 
 # 超凡之力 (SupernaturalPower)
 @app.get("/api/projects/{project_id}/supernatural_powers", response_model=List[SupernaturalPowerResponse])
-def get_supernatural_powers(project_id: int, db: Session = Depends(get_db)):
-    return db.query(SupernaturalPower).filter(SupernaturalPower.project_id == project_id).order_by(SupernaturalPower.display_order).all()
+def get_supernatural_powers(project_id: int, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    query = db.query(SupernaturalPower).filter(SupernaturalPower.project_id == project_id)
+    return paginate(query, (SupernaturalPower.display_order, SupernaturalPower.id), page, response)
 
 @app.post("/api/projects/{project_id}/supernatural_powers", response_model=SupernaturalPowerResponse)
 def create_supernatural_power(project_id: int, power: SupernaturalPowerCreate, db: Session = Depends(get_db)):
@@ -730,8 +935,9 @@ def delete_supernatural_power(power_id: int, db: Session = Depends(get_db)):
 
 # 兵器 (Weapon)
 @app.get("/api/projects/{project_id}/weapons", response_model=List[WeaponResponse])
-def get_weapons(project_id: int, db: Session = Depends(get_db)):
-    return db.query(Weapon).filter(Weapon.project_id == project_id).order_by(Weapon.display_order).all()
+def get_weapons(project_id: int, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    query = db.query(Weapon).filter(Weapon.project_id == project_id)
+    return paginate(query, (Weapon.display_order, Weapon.id), page, response)
 
 @app.post("/api/projects/{project_id}/weapons", response_model=WeaponResponse)
 def create_weapon(project_id: int, weapon: WeaponCreate, db: Session = Depends(get_db)):
@@ -770,8 +976,9 @@ def delete_weapon(weapon_id: int, db: Session = Depends(get_db)):
 
 # 副本 (Dungeon)
 @app.get("/api/projects/{project_id}/dungeons", response_model=List[DungeonResponse])
-def get_dungeons(project_id: int, db: Session = Depends(get_db)):
-    return db.query(Dungeon).filter(Dungeon.project_id == project_id).order_by(Dungeon.display_order).all()
+def get_dungeons(project_id: int, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    query = db.query(Dungeon).filter(Dungeon.project_id == project_id)
+    return paginate(query, (Dungeon.display_order, Dungeon.id), page, response)
 
 @app.post("/api/projects/{project_id}/dungeons", response_model=DungeonResponse)
 def create_dungeon(project_id: int, dungeon: DungeonCreate, db: Session = Depends(get_db)):
@@ -810,18 +1017,18 @@ def delete_dungeon(dungeon_id: int, db: Session = Depends(get_db)):
 
 # Conversation History API
 @app.get("/api/conversations", response_model=List[ConversationResponse])
-def get_conversations_for_project(db: Session = Depends(get_db)):
-    """获取所有全局对话历史记录（不含消息内容）"""
-    conversations = db.query(Conversation).order_by(Conversation.created_at.desc()).all()
-    # 为了效率，我们不在此处返回完整的消息列表
-    for conv in conversations:
-        conv.messages = [] # 清空消息列表
-    return conversations
+def get_conversations_for_project(response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    """获取所有全局对话历史记录（不含消息内容），按 (created_at, id) 从新到旧分页"""
+    # 为了效率，不加载消息（原来清空 messages 时会先逐个对话加载全部消息）
+    query = db.query(Conversation).options(noload(Conversation.messages))
+    return paginate(query, (Conversation.created_at, Conversation.id), page, response, descending=True)
 
 @app.get("/api/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
-def get_messages_for_conversation(conversation_id: int, db: Session = Depends(get_db)):
-    """获取特定对话的所有消息"""
-    messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.created_at.asc()).all()
+def get_messages_for_conversation(conversation_id: int, response: Response, page: PageParams = Depends(),
+                                  db: Session = Depends(get_db)):
+    """获取特定对话的消息，按 (created_at, id) 分页"""
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    messages = paginate(query, (Message.created_at, Message.id), page, response)
     if not messages:
         # 即使对话存在但没有消息，也返回空列表，而不是404
         # 但要检查对话是否存在
@@ -859,71 +1066,17 @@ def update_conversation(conversation_id: int, conversation_update: ConversationU
 # 提示词渲染API
 @app.post("/api/prompts/render")
 def render_prompt(payload: dict, db: Session = Depends(get_db)):
-    import re
+    """渲染提示词，与聊天接口共用同一渲染引擎"""
     content = payload.get("content", "")
-    project_id = payload.get("project_id")
-    selected_text = payload.get("selected_text")
+    rendered, stats = prompt_renderer.render_content(
+        db, content, payload.get("project_id"), payload.get("selected_text")
+    )
+    return {"rendered_content": rendered, "stats": stats.to_dict()}
 
-    if '{{' not in content:
-        return {"rendered_content": content}
-    
-    # 如果没有项目ID但有选择文字，仍然需要渲染
-    if not project_id and not selected_text:
-        return {"rendered_content": content}
-
-    search_models = [
-        Worldview, RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon, Chapter, Volume, Project
-    ]
-
-    def replacer(match):
-        keyword = match.group(1).strip()
-        
-        # 特殊处理：选择文字
-        if keyword == "选择文字":
-            if selected_text:
-                return str(selected_text)
-            return match.group(0)
-        
-        # 特殊处理世界观：使用固定关键词"世界观"
-        if keyword == "世界观" and project_id:
-            worldview = db.query(Worldview).filter(Worldview.project_id == project_id).first()
-            if worldview and worldview.content:
-                return str(worldview.content)
-        
-        if not project_id:
-            return match.group(0)
-        
-        for model in search_models:
-            # 跳过Worldview，因为已经特殊处理
-            if model == Worldview:
-                continue
-                
-            query = db.query(model)
-            query_attr = 'name' if hasattr(model, 'name') else 'title'
-
-            if model == Chapter:
-                query = query.filter(Chapter.project_id == project_id, Chapter.title.startswith(keyword))
-            elif hasattr(model, 'project_id'):
-                query = query.filter(model.project_id == project_id, getattr(model, query_attr) == keyword)
-            else:
-                query = query.filter(getattr(model, query_attr) == keyword)
-
-            result = query.first()
-            
-            if result:
-                found_content = None
-                if hasattr(result, 'content') and result.content:
-                    found_content = result.content
-                elif hasattr(result, 'description') and result.description:
-                    found_content = result.description
-                else:
-                    found_content = getattr(result, query_attr, '')
-                return str(found_content)
-
-        return match.group(0) # Return original if no match found
-
-    final_content = re.sub(r'\{\{\s*(.*?)\s*\}\}', replacer, content)
-    return {"rendered_content": final_content}
+@app.get("/api/prompts/render-stats")
+def get_render_stats():
+    """获取提示词渲染的累计耗时和查找计数"""
+    return prompt_renderer.metrics()
 
 
 class ChatRequest(BaseModel):
@@ -937,586 +1090,88 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
     selected_text: Optional[str] = None # 新增：编辑器中选中的文字
+    use_cache: Optional[bool] = None # 是否使用AI回复缓存，未指定时按服务端策略
+    priority: Optional[str] = "interactive" # 限流排队优先级：interactive 或 batch
 
 @app.post("/api/chat")
-def chat_with_ai(request: ChatRequest, db: Session = Depends(get_db)):
-    """原有的非流式AI对话API，保持向后兼容"""
-    conversation_id = request.conversation_id
-    system_prompt = None
-    selected_ai_model_identifier = "default_model"
-
-    # 获取AI模型和提供商信息
-    selected_ai_model = None
-    selected_ai_provider = None
-
-    if request.prompt_template_id:
-        prompt_template = db.query(PromptTemplate).filter(PromptTemplate.id == request.prompt_template_id).first()
-        if prompt_template:
-            # 使用新的提示词处理函数
-            from prompt_utils import process_prompt_template
-            system_prompt = process_prompt_template(db, prompt_template, request.project_id, request.resources, request.selected_text)
-
-    if request.ai_model_id:
-        selected_ai_model = db.query(AIModel).filter(AIModel.id == request.ai_model_id).first()
-        if selected_ai_model:
-            selected_ai_model_identifier = selected_ai_model.model_identifier
-            selected_ai_provider = db.query(AIProvider).filter(AIProvider.id == selected_ai_model.provider_id).first()
-            if not selected_ai_provider:
-                raise HTTPException(status_code=404, detail="AI提供商不存在")
-
-    # 如果是新对话，则创建对话记录
-    if conversation_id is None:
-        # 自动生成标题：取消息的前30个字符
-        title = request.message[:30] + '...' if len(request.message) > 30 else request.message
-        # AI对话功能不依赖项目，不设置project_id
-        new_conv = Conversation(title=title)
-        db.add(new_conv)
-        db.commit()
-        db.refresh(new_conv)
-        conversation_id = new_conv.id
-
-    # 保存用户消息
-    user_message = Message(
-        conversation_id=conversation_id,
-        role='user',
-        content=request.message
-    )
-    db.add(user_message)
-    db.commit()
+async def chat_with_ai(request: ChatRequest, db: Session = Depends(get_db)):
+    """原有的非流式AI对话API，保持向后兼容。
+    数据库操作在线程池中执行，等待AI回复期间不占用线程，也不阻塞事件循环"""
+    ctx = await run_in_threadpool(prepare_chat, db, request)
 
     # ---- AI 调用逻辑 ----
-    ai_reply_content = "抱歉，AI服务暂不可用或配置不正确。"
-
-    if selected_ai_provider and selected_ai_model:
-        # Check if API key is provided
-        if not selected_ai_provider.api_key or selected_ai_provider.api_key.strip() == "":
-            ai_reply_content = f"AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
-        else:
-            # 准备消息历史，包括系统提示
-            messages_for_ai = []
-            if system_prompt:
-                messages_for_ai.append({"role": "system", "content": system_prompt})
-                # 输出最终使用的提示词
-                print("="*50)
-                print("最终使用的提示词:")
-                print(system_prompt)
-                print("="*50)
-
-            # 添加历史消息
-            for msg in request.history:
-                messages_for_ai.append({"role": msg["role"], "content": msg["content"]})
-
-            # 添加当前用户消息
-            messages_for_ai.append({"role": "user", "content": request.message})
-
-            # 动态选择AI客户端并调用 - 使用HTTP请求调用配置的AI服务
-            print(f"Debug: Attempting to call AI provider: {selected_ai_provider.name}")
-            print(f"Debug: Using model: {selected_ai_model.model_identifier}")
-            print(f"Debug: API key is set: {bool(selected_ai_provider.api_key)}")
-            print(f"Debug: Base URL: {selected_ai_provider.base_url}")
-
-            try:
-                # Default to OpenAI-compatible API if no base_url is provided
-                base_url = selected_ai_provider.base_url or "https://api.openai.com"
-                api_key = selected_ai_provider.api_key
-
-                if not api_key:
-                    ai_reply_content = "AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
-                else:
-                    # Prepare headers for the API call
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {api_key}"
-                    }
-
-                    # Prepare the payload for the AI API call
-                    payload = {
-                        "model": selected_ai_model.model_identifier,
-                        "messages": messages_for_ai,
-                        "temperature": request.temperature if request.temperature is not None else selected_ai_model.temperature,
-                        "max_tokens": request.max_tokens if request.max_tokens is not None else selected_ai_model.max_tokens,
-                    }
-
-                    # Check if this is a thinking model and add enable_thinking parameter
-                    is_thinking_model = "thinking" in selected_ai_model.model_identifier.lower() or "qwen" in selected_ai_model.model_identifier.lower()
-                    if is_thinking_model:
-                        payload["extra_body"] = {"enable_thinking": True}
-
-                    # 使用与前端一致的URL处理逻辑
-                    api_endpoint = process_openai_url(base_url)
-
-                    # 添加详细的调用日志
-                    import datetime
-                    import json
-                    print("=" * 80)
-                    print("【AI调用详细日志】")
-                    print(f"调用时间: {datetime.datetime.now()}")
-                    print(f"提供商名称: {selected_ai_provider.name}")
-                    print(f"API基础URL: {base_url}")
-                    print(f"API端点: {api_endpoint}")
-                    print(f"模型名称: {selected_ai_model.name}")
-                    print(f"模型标识符: {selected_ai_model.model_identifier}")
-                    print(f"API密钥: {api_key[:10]}..." if len(api_key) > 10 else f"API密钥: {api_key}")
-                    print(f"温度参数: {selected_ai_model.temperature}")
-                    print(f"最大Token数: {selected_ai_model.max_tokens}")
-                    print("请求载荷:")
-                    print(json.dumps(payload, indent=2, ensure_ascii=False))
-                    print("=" * 80)
-
-                    # Make the HTTP request to the AI provider
-                    import requests
-                    response = requests.post(
-                        api_endpoint,
-                        json=payload,
-                        headers=headers,
-                        timeout=30.0  # 30 second timeout
-                    )
-
-                    print(f"响应状态码: {response.status_code}")
-
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        ai_reply_content = response_data['choices'][0]['message']['content']
-                        print("响应内容:")
-                        print(json.dumps(response_data, indent=2, ensure_ascii=False))
-                    elif response.status_code == 401:
-                        ai_reply_content = f"API密钥无效或已过期。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    elif response.status_code == 404:
-                        ai_reply_content = f"API端点未找到。请检查API URL是否正确。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    elif response.status_code == 429:
-                        ai_reply_content = f"API请求频率超限。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    else:
-                        error_detail = response.text
-                        ai_reply_content = f"AI服务调用失败。状态码: {response.status_code}, 详情: {error_detail}"
-                        print(f"错误详情: {response.text}")
-
-                    print("=" * 80)
-
-            except Exception as e:
-                import traceback
-                traceback.print_exc() # Print full traceback to backend logs
-                print(f"Debug: AI call failed - {type(e).__name__}: {str(e)}")
-                ai_reply_content = f"AI服务调用失败: {type(e).__name__}: {str(e)}"
+    if ctx.error:
+        ai_reply_content = ctx.error
     else:
-        ai_reply_content = f"AI服务未配置。请在AI管理中选择一个AI模型。"
-
+        ai_reply_content = await call_ai(ctx)
     # ---------------------
 
     # 保存AI消息
-    ai_message = Message(
-        conversation_id=conversation_id,
-        role='assistant',
-        content=ai_reply_content
-    )
-    db.add(ai_message)
-    db.commit()
-
-    return {"reply": ai_reply_content, "conversation_id": conversation_id}
+    await run_in_threadpool(save_assistant_message, db, ctx.conversation_id, ai_reply_content)
+
+    return {"reply": ai_reply_content, "conversation_id": ctx.conversation_id, "tokens": ctx.token_breakdown, "cached": ctx.cached}
+
+@app.get("/api/chat/cache")
+def get_response_cache_stats():
+    """AI回复缓存的命中统计"""
+    return response_cache.stats()
+
+@app.get("/api/chat/generations")
+async def get_generation_stats():
+    """进行中的流式生成、合并及客户端断开后取消（节省的Token数）统计"""
+    return {**generations.stats(), "streams": chat_streams.stats()}
+
+@app.get("/api/chat/ttft")
+def get_ttft_stats():
+    """各提供商的首Token延迟分布及当前对冲延迟"""
+    return ttft_stats.snapshot()
+
+@app.get("/api/chat/rate-limits")
+async def get_rate_limit_stats():
+    """各提供商的限流状态与排队情况"""
+    return rate_limiters.stats()
+
+@app.get("/api/logging")
+def get_logging_stats():
+    """日志级别、队列中待写出及因队列满丢弃的日志数"""
+    return logging_stats()
+
+@app.delete("/api/chat/cache")
+def clear_response_cache():
+    response_cache.clear()
+    return {"message": "AI回复缓存已清空"}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"  # 禁用Nginx缓冲
+}
 
 @app.post("/api/chat/stream")
-def chat_with_ai_stream(request: ChatRequest, db: Session = Depends(get_db)):
-    conversation_id = request.conversation_id
-    system_prompt = None
-    selected_ai_model_identifier = "default_model"
-
-    # 获取AI模型和提供商信息
-    selected_ai_model = None
-    selected_ai_provider = None
-
-    if request.prompt_template_id:
-        prompt_template = db.query(PromptTemplate).filter(PromptTemplate.id == request.prompt_template_id).first()
-        if prompt_template:
-            # 使用新的提示词处理函数
-            from prompt_utils import process_prompt_template
-            system_prompt = process_prompt_template(db, prompt_template, request.project_id, request.resources, request.selected_text)
-
-    if request.ai_model_id:
-        selected_ai_model = db.query(AIModel).filter(AIModel.id == request.ai_model_id).first()
-        if selected_ai_model:
-            selected_ai_model_identifier = selected_ai_model.model_identifier
-            selected_ai_provider = db.query(AIProvider).filter(AIProvider.id == selected_ai_model.provider_id).first()
-            if not selected_ai_provider:
-                raise HTTPException(status_code=404, detail="AI提供商不存在")
-
-    # 如果是新对话，则创建对话记录
-    if conversation_id is None:
-        # 自动生成标题：取消息的前30个字符
-        title = request.message[:30] + '...' if len(request.message) > 30 else request.message
-        # AI对话功能不依赖项目，不设置project_id
-        new_conv = Conversation(title=title)
-        db.add(new_conv)
-        db.commit()
-        db.refresh(new_conv)
-        conversation_id = new_conv.id
-
-    # 保存用户消息
-    user_message = Message(
-        conversation_id=conversation_id,
-        role='user',
-        content=request.message
-    )
-    db.add(user_message)
-    db.commit()
-
-    async def generate_stream():
-        # 导入json模块，确保在嵌套函数中可用
-        import json
-
-        # 先发送对话ID，使前端能够保存消息
-        yield f"data: {json.dumps({'type': 'conversation_id', 'conversation_id': conversation_id})}\n\n"
-
-        # 初始化AI回复内容
-        ai_reply_content = ""
-
-        # 如果没有配置AI提供商或模型，返回错误信息
-        if not selected_ai_provider or not selected_ai_model:
-            error_msg = "AI服务未配置。请在AI管理中选择一个AI模型。"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-
-            # 保存错误消息到数据库
-            ai_message = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=error_msg
-            )
-            db.add(ai_message)
-            db.commit()
-            return
-
-        # 检查API密钥
-        if not selected_ai_provider.api_key or selected_ai_provider.api_key.strip() == "":
-            error_msg = "AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-
-            # 保存错误消息到数据库
-            ai_message = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=error_msg
-            )
-            db.add(ai_message)
-            db.commit()
-            return
-
-        # 准备消息历史，包括系统提示
-        messages_for_ai = []
-        if system_prompt:
-            messages_for_ai.append({"role": "system", "content": system_prompt})
-            # 输出最终使用的提示词
-            print("="*50)
-            print("最终使用的提示词:")
-            print(system_prompt)
-            print("="*50)
-
-        # 添加历史消息
-        for msg in request.history:
-            messages_for_ai.append({"role": msg["role"], "content": msg["content"]})
-
-        # 添加当前用户消息
-        messages_for_ai.append({"role": "user", "content": request.message})
-
-        # 准备API请求
-        base_url = selected_ai_provider.base_url or "https://api.openai.com"
-        api_key = selected_ai_provider.api_key
-        # 使用与前端一致的URL处理逻辑
-        api_endpoint = process_openai_url(base_url)
-        
-        print(f"[API请求] 完整的API端点: {api_endpoint}")
-        print(f"[API请求] 基础URL: {base_url}")
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-
-        # 准备请求载荷，启用流式响应
-        payload = {
-            "model": selected_ai_model.model_identifier,
-            "messages": messages_for_ai,
-            "temperature": request.temperature if request.temperature is not None else selected_ai_model.temperature,
-            "max_tokens": request.max_tokens if request.max_tokens is not None else selected_ai_model.max_tokens,
-            "stream": True  # 启用流式响应
-        }
-
-        # Check if this is a thinking model and add enable_thinking parameter
-        is_thinking_model = "thinking" in selected_ai_model.model_identifier.lower() or "qwen" in selected_ai_model.model_identifier.lower()
-        if is_thinking_model:
-            payload["extra_body"] = {"enable_thinking": True}
-
-        # 使用httpx进行异步请求，支持流式响应
-        import httpx
-        import os
-
+async def chat_with_ai_stream(request: ChatRequest, db: Session = Depends(get_db),
+                              last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")):
+    # 渲染提示词、创建对话、保存用户消息等数据库工作全部在开始流式响应之前完成
+    ctx = await run_in_threadpool(prepare_chat, db, request)
+    bind = db.get_bind()
+    # 立即归还数据库连接，生成可能持续数分钟，期间不占用连接池
+    db.close()
+
+    # 返回流式响应；生成在后台进行，带 Last-Event-ID 请求头的客户端断开后可以续传
+    return ChatStreamingResponse(generate_chat_stream(ctx, bind, resumable=last_event_id is not None), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/api/chat/stream/{conversation_id}/resume")
+async def resume_chat_stream(conversation_id: int, last_event_id: Optional[int] = None,
+                             last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """从 Last-Event-ID（请求头或查询参数）之后继续接收进行中或刚结束的流式回复"""
+    stream = chat_streams.get(conversation_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="该对话没有可续传的回复")
+    if last_event_id is None:
         try:
-            print(f"[HTTP请求] 准备发送请求到: {api_endpoint}")
-            print(f"[HTTP请求] 请求头: {headers}")
-            print(f"[HTTP请求] 请求体: {json.dumps(payload, ensure_ascii=False)[:500]}")
-            
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                async with client.stream(
-                    "POST",
-                    api_endpoint,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    print(f"[HTTP响应] 状态码: {response.status_code}")
-                    print(f"[HTTP响应] 响应头: {dict(response.headers)}")
-                    
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_msg = f"AI服务调用失败。状态码: {response.status_code}, 详情: {error_text.decode()}"
-                        yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-
-                        # 保存错误消息到数据库
-                        ai_message = Message(
-                            conversation_id=conversation_id,
-                            role='assistant',
-                            content=error_msg
-                        )
-                        db.add(ai_message)
-                        db.commit()
-                        return
-
-                    # --- AI响应适配器 ---
-                    class AIResponseAdapter:
-                        def parse(self, delta):
-                            raise NotImplementedError
-
-                    class DefaultAdapter(AIResponseAdapter):
-                        def parse(self, delta):
-                            thinking_chunk = delta.get("reasoning_content")
-                            content_chunk = delta.get("content")
-                            return thinking_chunk, content_chunk
-
-                    class ReasoningAdapter(AIResponseAdapter):
-                        def parse(self, delta):
-                            thinking_chunk = delta.get("reasoning")
-                            content_chunk = delta.get("content")
-                            return thinking_chunk, content_chunk
-
-                    def get_adapter(model_name, sample_delta):
-                        # 优先基于样本内容判断
-                        if "reasoning" in sample_delta:
-                            print("[适配器] 检测到 'reasoning' 字段，使用 ReasoningAdapter")
-                            return ReasoningAdapter()
-                        if "reasoning_content" in sample_delta:
-                            print("[适配器] 检测到 'reasoning_content' 字段，使用 DefaultAdapter")
-                            return DefaultAdapter()
-                        
-                        # 如果样本中没有特定字段，则基于模型名称判断（作为备用方案）
-                        if "glm" in model_name.lower() or "zhipu" in model_name.lower():
-                            print(f"[适配器] 模型名称 '{model_name}' 包含 'glm' 或 'zhipu'，使用 ReasoningAdapter")
-                            return ReasoningAdapter()
-                        
-                        print(f"[适配器] 未匹配到特定适配器，使用 DefaultAdapter")
-                        return DefaultAdapter()
-
-                    # --- 流式处理 ---
-                    adapter = None
-                    line_count = 0
-                    async for line in response.aiter_lines():
-                        if line:
-                            line_count += 1
-                            print(f"[流式响应 #{line_count}] 原始行: {line[:200]}")
-
-                            if line.startswith("data: "):
-                                data_str = line[6:]
-                                if data_str.strip() == "[DONE]":
-                                    print("[流式响应] 收到结束标记 [DONE]")
-                                    break
-                                
-                                try:
-                                    data = json.loads(data_str)
-                                    print(f"[流式响应] 解析的JSON: {json.dumps(data, ensure_ascii=False)[:300]}")
-
-                                    if "choices" in data and len(data["choices"]) > 0:
-                                        delta = data["choices"][0].get("delta", {})
-                                        print(f"[流式响应] Delta内容: {delta}")
-
-                                        # 在第一次收到delta时，动态选择适配器
-                                        if adapter is None:
-                                            adapter = get_adapter(selected_ai_model.model_identifier, delta)
-
-                                        thinking_chunk, content_chunk = adapter.parse(delta)
-
-                                        # 统一处理思考过程
-                                        if thinking_chunk:
-                                            print(f"[流式响应] 发送思考内容: {thinking_chunk[:100]}")
-                                            yield f"data: {json.dumps({'type': 'thinking', 'content': thinking_chunk})}\n\n"
-                                        
-                                        # 统一处理最终回复
-                                        if content_chunk:
-                                            print(f"[流式响应] 发送回复内容: {content_chunk}")
-                                            ai_reply_content += content_chunk
-                                            yield f"data: {json.dumps({'type': 'content', 'content': content_chunk})}\n\n"
-                                        
-                                except json.JSONDecodeError as e:
-                                    print(f"[流式响应] JSON解析失败: {e}, 原始数据: {data_str[:200]}")
-                                    pass
-                    
-                    print(f"[流式响应] 总共收到 {line_count} 行，最终回复内容长度: {len(ai_reply_content)}")
-
-                    # 流式响应结束，保存完整的AI回复到数据库
-                    ai_message = Message(
-                        conversation_id=conversation_id,
-                        role='assistant',
-                        content=ai_reply_content
-                    )
-                    db.add(ai_message)
-                    db.commit()
-
-                    # 发送完成信号
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
-
-        except Exception as e:
-            error_msg = f"AI服务调用失败: {type(e).__name__}: {str(e)}"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-
-            # 保存错误消息到数据库
-            ai_message = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=error_msg
-            )
-            db.add(ai_message)
-            db.commit()
-
-    # 返回流式响应
-    return StreamingResponse(
-        generate_stream(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"  # 禁用Nginx缓冲
-        }
-    )
-
-    # ---- AI 调用逻辑 ----
-    ai_reply_content = "抱歉，AI服务暂不可用或配置不正确。"
-
-    if selected_ai_provider and selected_ai_model:
-        # Check if API key is provided
-        if not selected_ai_provider.api_key or selected_ai_provider.api_key.strip() == "":
-            ai_reply_content = f"AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
-        else:
-            # 准备消息历史，包括系统提示
-            messages_for_ai = []
-            if system_prompt:
-                messages_for_ai.append({"role": "system", "content": system_prompt})
-            
-            # 添加历史消息
-            for msg in request.history:
-                messages_for_ai.append({"role": msg["role"], "content": msg["content"]})
-            
-            # 添加当前用户消息
-            messages_for_ai.append({"role": "user", "content": request.message})
-
-            # 动态选择AI客户端并调用 - 使用HTTP请求调用配置的AI服务
-            print(f"Debug: Attempting to call AI provider: {selected_ai_provider.name}")
-            print(f"Debug: Using model: {selected_ai_model.model_identifier}")
-            print(f"Debug: API key is set: {bool(selected_ai_provider.api_key)}")
-            print(f"Debug: Base URL: {selected_ai_provider.base_url}")
-            
-            try:
-                # Default to OpenAI-compatible API if no base_url is provided
-                base_url = selected_ai_provider.base_url or "https://api.openai.com/v1"
-                api_key = selected_ai_provider.api_key
-                
-                if not api_key:
-                    ai_reply_content = "AI提供商的API密钥未设置。请在AI管理中配置API密钥。"
-                else:
-                    # Prepare headers for the API call
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {api_key}"
-                    }
-                    
-                    # Prepare the payload for the AI API call
-                    payload = {
-                        "model": selected_ai_model.model_identifier,
-                        "messages": messages_for_ai,
-                        "temperature": selected_ai_model.temperature,
-                        "max_tokens": selected_ai_model.max_tokens,
-                    }
-                    
-                    # Determine the correct endpoint URL
-                    # For most OpenAI-compatible APIs, it's chat/completions
-                    api_endpoint = f"{base_url.rstrip('/')}/chat/completions"
-                    
-                    # 添加详细的调用日志
-                    import datetime
-                    import json
-                    print("=" * 80)
-                    print("【AI调用详细日志】")
-                    print(f"调用时间: {datetime.datetime.now()}")
-                    print(f"提供商名称: {selected_ai_provider.name}")
-                    print(f"API基础URL: {base_url}")
-                    print(f"API端点: {api_endpoint}")
-                    print(f"模型名称: {selected_ai_model.name}")
-                    print(f"模型标识符: {selected_ai_model.model_identifier}")
-                    print(f"API密钥: {api_key[:10]}..." if len(api_key) > 10 else f"API密钥: {api_key}")
-                    print(f"温度参数: {selected_ai_model.temperature}")
-                    print(f"最大Token数: {selected_ai_model.max_tokens}")
-                    print("请求载荷:")
-                    print(json.dumps(payload, indent=2, ensure_ascii=False))
-                    print("=" * 80)
-                    
-                    # Make the HTTP request to the AI provider
-                    import requests
-                    response = requests.post(
-                        api_endpoint,
-                        json=payload,
-                        headers=headers,
-                        timeout=30.0  # 30 second timeout
-                    )
-                    
-                    print(f"响应状态码: {response.status_code}")
-
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        ai_reply_content = response_data['choices'][0]['message']['content']
-                        print("响应内容:")
-                        print(json.dumps(response_data, indent=2, ensure_ascii=False))
-                    elif response.status_code == 401:
-                        ai_reply_content = f"API密钥无效或已过期。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    elif response.status_code == 404:
-                        ai_reply_content = f"API端点未找到。请检查API URL是否正确。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    elif response.status_code == 429:
-                        ai_reply_content = f"API请求频率超限。错误代码: {response.status_code}"
-                        print(f"错误详情: {response.text}")
-                    else:
-                        error_detail = response.text
-                        ai_reply_content = f"AI服务调用失败。状态码: {response.status_code}, 详情: {error_detail}"
-                        print(f"错误详情: {response.text}")
-
-                    print("=" * 80)
-                        
-            except Exception as e:
-                import traceback
-                traceback.print_exc() # Print full traceback to backend logs
-                print(f"Debug: AI call failed - {type(e).__name__}: {str(e)}")
-                ai_reply_content = f"AI服务调用失败: {type(e).__name__}: {str(e)}"
-    else:
-        ai_reply_content = f"AI服务未配置。请在AI管理中选择一个AI模型。"
-
-    # ---------------------
-
-    # 保存AI消息
-    ai_message = Message(
-        conversation_id=conversation_id,
-        role='assistant',
-        content=ai_reply_content
-    )
-    db.add(ai_message)
-    db.commit()
-
-    return {"reply": ai_reply_content, "conversation_id": conversation_id}
+            last_event_id = int(last_event_id_header) if last_event_id_header else 0
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID 无效")
+    return ChatStreamingResponse(follow_chat_stream(stream, last_event_id), media_type="text/event-stream", headers=SSE_HEADERS)
 
 # 小说类型管理API
 @app.get("/api/novel-genres", response_model=List[NovelGenreResponse])
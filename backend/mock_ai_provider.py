@@ -0,0 +1,74 @@
+"""
+本地模拟的 OpenAI 兼容 AI 提供商，供压测脚本使用
+
+支持 /v1/chat/completions 的流式与非流式两种响应，延迟可配置：
+    MOCK_AI_DELAY        首个响应前的等待秒数（模拟首Token延迟）
+    MOCK_AI_CHUNKS       流式响应的分片数量
+    MOCK_AI_CHUNK_DELAY  流式分片之间的间隔秒数
+
+单独运行: python mock_ai_provider.py [端口]
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_AI_DELAY = float(os.getenv("MOCK_AI_DELAY", "0.5"))
+MOCK_AI_CHUNKS = int(os.getenv("MOCK_AI_CHUNKS", "20"))
+MOCK_AI_CHUNK_DELAY = float(os.getenv("MOCK_AI_CHUNK_DELAY", "0.01"))
+CHUNK_TEXT = "模拟回复"
+
+
+def create_app(delay=MOCK_AI_DELAY, chunks=MOCK_AI_CHUNKS, chunk_delay=MOCK_AI_CHUNK_DELAY):
+    app = FastAPI(title="Mock AI Provider")
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        model = body.get("model", "mock-model")
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return JSONResponse({
+                "id": "mock", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": CHUNK_TEXT * chunks}, "finish_reason": "stop"}],
+            })
+
+        async def events():
+            await asyncio.sleep(delay)
+            for _ in range(chunks):
+                data = {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {"content": CHUNK_TEXT}}]}
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if chunk_delay:
+                    await asyncio.sleep(chunk_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def serve_in_thread(app, port, host="127.0.0.1"):
+    """在后台线程中启动 uvicorn，返回 server（设置 should_exit=True 即可停止，server.thread 为所在线程）"""
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    server.thread = thread
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8900
+    uvicorn.run(create_app(), host="127.0.0.1", port=port)
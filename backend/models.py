@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Float, JSON, Index
 from datetime import datetime
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from database import Base
 
@@ -13,6 +13,10 @@ class Project(Base):
     description = Column(Text)
     author = Column(String)
     display_order = Column(Integer, default=0)
+    # 统计计数，由 project_stats 在章节增删改的同一事务中增量维护
+    chapter_count = Column(Integer, nullable=False, default=0, server_default="0")
+    word_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_edited_chapter_id = Column(Integer)  # 不设外键，避免与 chapters 表循环依赖
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -39,6 +43,9 @@ class Volume(Base):
     title = Column(String, nullable=False)
     description = Column(Text)
     order = Column(Integer, default=0)
+    chapter_count = Column(Integer, nullable=False, default=0, server_default="0")
+    word_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_edited_chapter_id = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -49,12 +56,15 @@ class Volume(Base):
 
 class Chapter(Base):
     __tablename__ = "chapters"
+    # 分页排序键的复合索引（见 pagination.py）
+    __table_args__ = (Index("ix_chapters_volume_order", "volume_id", "order", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
     volume_id = Column(Integer, ForeignKey("volumes.id"))
     title = Column(String, nullable=False)
-    content = Column(Text)
+    # 正文延迟加载：列表和大纲只读取标题等字段，需要正文时显式 undefer 或单独读取
+    content = deferred(Column(Text))
     word_count = Column(Integer, default=0)
     order = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -75,6 +85,10 @@ class AIProvider(Base):
     enabled = Column(Boolean, default=True)
     is_system = Column(Boolean, default=False, nullable=False)
     display_order = Column(Integer, default=0)
+    api_keys = Column(JSON)  # 额外的API密钥，与 api_key 组成密钥池：["sk-...", {"key": "sk-...", "weight": 2}]
+    rpm_limit = Column(Integer)  # 每个密钥每分钟请求数，为空时使用 AI_RATE_RPM，0 表示不限制
+    tpm_limit = Column(Integer)  # 每个密钥每分钟Token数，为空时使用 AI_RATE_TPM
+    max_concurrency = Column(Integer)  # 每个密钥同时进行的请求数，为空时使用 AI_RATE_CONCURRENCY
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -89,6 +103,9 @@ class AIModel(Base):
     model_identifier = Column(String, nullable=False) # 模型的实际ID, 例如: "gpt-4-1106-preview"
     temperature = Column(Float, default=0.7)
     max_tokens = Column(Integer, default=2000)
+    context_window = Column(Integer)  # 模型上下文窗口（Token），为空时使用 DEFAULT_CONTEXT_WINDOW
+    hedge_model_ids = Column(JSON)  # 对冲/备用模型id列表，例如其他提供商上的同一模型
+    adapter = Column(String)  # 固定使用的流式响应适配器（见 ai_adapters），为空时自动判断
     is_default = Column(Boolean, default=False)
     enabled = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -99,6 +116,7 @@ class AIModel(Base):
 
 class PromptTemplate(Base):
     __tablename__ = "prompt_templates"
+    __table_args__ = (Index("ix_prompt_templates_created", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
@@ -126,6 +144,7 @@ class Worldview(Base):
 
 class RPGCharacter(Base):
     __tablename__ = "rpg_characters"
+    __table_args__ = (Index("ix_rpg_characters_project_order", "project_id", "display_order", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
@@ -139,6 +158,7 @@ class RPGCharacter(Base):
 
 class Organization(Base):
     __tablename__ = "organizations"
+    __table_args__ = (Index("ix_organizations_project_order", "project_id", "display_order", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
@@ -152,6 +172,7 @@ class Organization(Base):
 
 class SupernaturalPower(Base):
     __tablename__ = "supernatural_powers"
+    __table_args__ = (Index("ix_supernatural_powers_project_order", "project_id", "display_order", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
@@ -165,6 +186,7 @@ class SupernaturalPower(Base):
 
 class Weapon(Base):
     __tablename__ = "weapons"
+    __table_args__ = (Index("ix_weapons_project_order", "project_id", "display_order", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
@@ -178,6 +200,7 @@ class Weapon(Base):
 
 class Dungeon(Base):
     __tablename__ = 'dungeons'
+    __table_args__ = (Index("ix_dungeons_project_order", "project_id", "display_order", "id"),)
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
     name = Column(String, nullable=False)
@@ -191,6 +214,7 @@ class Dungeon(Base):
 
 class Conversation(Base):
     __tablename__ = 'conversations'
+    __table_args__ = (Index("ix_conversations_created", "created_at", "id"),)
     id = Column(Integer, primary_key=True)
     # 移除project_id，使AI对话功能不依赖项目
     title = Column(String, nullable=False)
@@ -199,12 +223,19 @@ class Conversation(Base):
     # 移除与Project的关系，使AI对话功能不依赖项目
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+# AI回复的状态：完整生成、生成中（分段保存的部分内容），或生成中断时保存的部分内容
+MESSAGE_COMPLETE = "complete"
+MESSAGE_STREAMING = "streaming"
+MESSAGE_TRUNCATED = "truncated"
+
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),)
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
+    status = Column(String, default=MESSAGE_COMPLETE)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     conversation = relationship("Conversation", back_populates="messages")
@@ -0,0 +1,118 @@
+"""
+小说批量导入
+
+整部小说在一个事务中导入：项目通过 ORM 插入，分卷和章节使用 insert() 批量执行
+（executemany，SQLAlchemy 会把多行合并为少量 INSERT ... VALUES 语句，并用 RETURNING 批量取回id），
+不再每个分卷、每个章节各提交一次。出错时由调用方回滚，不会留下导入了一半的项目。
+
+章节按 IMPORT_BATCH_SIZE 分批写入，内存中最多保留一批章节，边解析边导入时内存占用不随小说长度增长。
+Core 语句不触发会话事件，项目和分卷的统计计数在 finish() 中一次写入，资源索引由调用方在提交后失效。
+"""
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+
+from app_logging import get_logger
+from models import Project, Volume, Chapter
+from project_stats import count_words
+
+logger = get_logger("novel_import")
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+DEFAULT_VOLUME_TITLE = "正文"
+
+
+class NovelImporter:
+    def __init__(self, db: Session, project: Project, batch_size: Optional[int] = None):
+        self.db = db
+        self.project = project
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        # 已写入数据库的章节数，每写入一批增加，可用于报告进度
+        self.imported = 0
+        self.volumes = 0
+        self._pending: List[dict] = []
+        # 分卷id -> [章节数, 字数, 最后一章的id]
+        self._volume_stats: Dict[int, list] = defaultdict(lambda: [0, 0, None])
+        self._last_chapter_id: Optional[int] = None
+        db.add(project)
+        db.flush()
+
+    def add_volumes(self, volumes: Iterable[Tuple[str, int]]) -> List[int]:
+        """批量插入分卷 (标题, 排序)，按传入顺序返回id"""
+        rows = [{"project_id": self.project.id, "title": title, "order": order} for title, order in volumes]
+        if not rows:
+            return []
+        statement = insert(Volume).returning(Volume.id, sort_by_parameter_order=True)
+        self.volumes += len(rows)
+        return list(self.db.scalars(statement, rows))
+
+    def add_volume(self, title: str, order: int) -> int:
+        return self.add_volumes([(title, order)])[0]
+
+    def add_chapter(self, volume_id: int, title: str, content: str, order: int):
+        self._pending.append({
+            "project_id": self.project.id,
+            "volume_id": volume_id,
+            "title": title,
+            "content": content,
+            "order": order,
+            "word_count": count_words(content),
+        })
+        if len(self._pending) >= self.batch_size:
+            self._flush_chapters()
+
+    def add_parsed(self, events: Iterable[Tuple[str, str, Optional[str]]]) -> Iterator[None]:
+        """写入 novel_parser 解析出的分卷和章节事件；生成器，每个章节之后产出一次，便于调用方报告进度"""
+        volume_id = None
+        volume_order = chapter_order = 0
+        for kind, title, content in events:
+            if kind == "volume":
+                volume_id = self.add_volume(title, volume_order)
+                volume_order += 1
+                chapter_order = 0
+                continue
+            if volume_id is None:
+                # 第一个分卷标题之前的章节放入默认分卷
+                volume_id = self.add_volume(DEFAULT_VOLUME_TITLE, volume_order)
+                volume_order += 1
+            self.add_chapter(volume_id, title, content, chapter_order)
+            chapter_order += 1
+            yield
+
+    def _flush_chapters(self):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        statement = insert(Chapter).returning(Chapter.id, sort_by_parameter_order=True)
+        ids = list(self.db.scalars(statement, rows))
+        for row, chapter_id in zip(rows, ids):
+            stats = self._volume_stats[row["volume_id"]]
+            stats[0] += 1
+            stats[1] += row["word_count"]
+            stats[2] = chapter_id
+        self._last_chapter_id = ids[-1]
+        self.imported += len(rows)
+
+    def finish(self) -> Project:
+        """写入剩余章节和统计计数；提交由调用方完成"""
+        self._flush_chapters()
+        if self._volume_stats:
+            self.db.connection().execute(
+                update(Volume.__table__).where(Volume.__table__.c.id == bindparam("volume_id")).values(
+                    chapter_count=bindparam("chapters"), word_count=bindparam("words"),
+                    last_edited_chapter_id=bindparam("last_chapter"),
+                ),
+                [
+                    {"volume_id": volume_id, "chapters": chapters, "words": words, "last_chapter": last}
+                    for volume_id, (chapters, words, last) in self._volume_stats.items()
+                ],
+            )
+        self.project.chapter_count = self.imported
+        self.project.word_count = sum(stats[1] for stats in self._volume_stats.values())
+        self.project.last_edited_chapter_id = self._last_chapter_id
+        self.db.flush()
+        logger.info("导入项目 %s：%d 个分卷，%d 章", self.project.id, self.volumes, self.imported)
+        return self.project
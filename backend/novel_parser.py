@@ -0,0 +1,301 @@
+"""
+TXT / EPUB 小说解析
+
+把上传的文件解析为 ("volume", 标题, None) / ("chapter", 标题, 正文HTML) 事件，逐块读取、边读边产出，
+内存中只保留当前章节的正文：
+    - TXT：根据开头的字节判断编码（BOM、UTF-8、GB18030（兼容 GBK/GB2312）、Big5），增量解码后按行
+      识别 第X卷 / 第X章 等标题
+    - EPUB：按 OPF 书脊顺序逐个读取 XHTML 文档，h1~h3 作为标题，段落作为正文行
+正文每行转为一个 <p> 段落，与编辑器保存的格式一致。
+"""
+import codecs
+import html
+import io
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from html.parser import HTMLParser
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+# 每次读取的字节数
+IMPORT_READ_CHUNK = int(os.getenv("IMPORT_READ_CHUNK", "65536"))
+# 单章最多的字符数，超过后拆为“（续）”章节，没有章节标题的文本也不会整本留在内存中
+IMPORT_MAX_CHAPTER_CHARS = int(os.getenv("IMPORT_MAX_CHAPTER_CHARS", "200000"))
+
+# 判断编码使用的开头字节数
+SAMPLE_SIZE = 64 * 1024
+# 标题行的最大长度，更长的行或含句号的行视为正文
+MAX_HEADING_LENGTH = 30
+
+_NUMBER = r"[0-9０-９零〇○一二三四五六七八九十百千万两壹贰叁肆伍陆柒捌玖拾佰仟]+"
+VOLUME_PATTERN = re.compile(rf"^第{_NUMBER}[卷部集篇]")
+CHAPTER_PATTERN = re.compile(rf"^(?:第{_NUMBER}[章回节话]|(?:序章|序言|楔子|引子|前言|番外|尾声|后记|终章)(?:$|\W))")
+
+Event = Tuple[str, str, Optional[str]]
+
+
+class NovelParseError(ValueError):
+    """文件结构无法解析（例如损坏的 EPUB）"""
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def _common_ratio(text: str, encoding: str) -> float:
+    """文本中常用汉字（GB2312 一级字或 Big5 常用字）、ASCII 和全角标点所占的比例"""
+    common = total = 0
+    for char in text:
+        if char.isspace():
+            continue
+        total += 1
+        code = ord(char)
+        if code < 0x80 or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF:
+            common += 1
+            continue
+        try:
+            if encoding == "big5":
+                common += 0xA4 <= char.encode("big5")[0] <= 0xC6
+            else:
+                common += 0xB0 <= char.encode("gb2312")[0] <= 0xD7
+        except UnicodeEncodeError:
+            pass
+    return common / total if total else 0.0
+
+
+def detect_encoding(sample: bytes) -> str:
+    """根据文件开头的字节判断编码"""
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    scores = {}
+    for encoding in ("utf-8", "gb18030", "big5"):
+        try:
+            # final=False：样本末尾被截断的多字节字符不算错误
+            text = codecs.getincrementaldecoder(encoding)("strict").decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        if encoding == "utf-8":
+            return encoding
+        scores[encoding] = _common_ratio(text, encoding)
+    if not scores:
+        return "gb18030"
+    # 同样能解码时取常用字比例高的；相同时优先简体
+    return max(scores, key=lambda e: (scores[e], e == "gb18030"))
+
+
+def iter_text(file: BinaryIO, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """逐块读取并解码文本文件"""
+    chunk_size = chunk_size or IMPORT_READ_CHUNK
+    first = file.read(max(chunk_size, SAMPLE_SIZE))
+    decoder = codecs.getincrementaldecoder(detect_encoding(first))("replace")
+    chunk = first
+    while chunk:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+        chunk = file.read(chunk_size)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_lines(chunks: Iterator[str]) -> Iterator[str]:
+    """把文本块切分为行，跨块的行拼接完整"""
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).splitlines()
+        # 块末尾没有换行时最后一行还不完整
+        pending = lines.pop() if lines and not chunk.endswith(("\n", "\r")) else ""
+        yield from lines
+    if pending:
+        yield pending
+
+
+def heading_kind(line: str) -> Optional[str]:
+    if len(line) > MAX_HEADING_LENGTH or "。" in line:
+        return None
+    if VOLUME_PATTERN.match(line):
+        return "volume"
+    if CHAPTER_PATTERN.match(line):
+        return "chapter"
+    return None
+
+
+class ChapterSplitter:
+    """按行识别分卷和章节标题，产出事件"""
+
+    PREFACE_TITLE = "前言"
+
+    def __init__(self, max_chars: Optional[int] = None):
+        self.max_chars = max_chars or IMPORT_MAX_CHAPTER_CHARS
+        self._title: Optional[str] = None
+        self._parts = 0
+        self._paragraphs: List[str] = []
+        self._chars = 0
+
+    def feed(self, line: str, heading: Optional[str] = None) -> Iterator[Event]:
+        """heading 指定该行的标题类型（如 EPUB 中的 h1~h3），否则按行内容判断"""
+        line = line.strip().lstrip("\ufeff")
+        if not line:
+            return
+        kind = heading_kind(line) or heading
+        if kind == "volume":
+            yield from self._chapter()
+            self._title = None
+            self._parts = 0
+            yield ("volume", line, None)
+        elif kind == "chapter":
+            yield from self._chapter()
+            self._title = line
+            self._parts = 0
+        else:
+            self._paragraphs.append(f"<p>{html.escape(line, quote=False)}</p>")
+            self._chars += len(line)
+            if self._chars >= self.max_chars:
+                title = self._title or self.PREFACE_TITLE
+                yield from self._chapter()
+                self._title = title
+                self._parts += 1
+
+    def close(self) -> Iterator[Event]:
+        yield from self._chapter()
+
+    def _chapter(self) -> Iterator[Event]:
+        if self._title is None and not self._paragraphs:
+            return
+        title = self._title or self.PREFACE_TITLE
+        if self._parts:
+            title = f"{title}（续{self._parts}）"
+        yield ("chapter", title, "\n".join(self._paragraphs))
+        self._title = None
+        self._paragraphs = []
+        self._chars = 0
+
+
+def parse_txt(file: BinaryIO, max_chars: Optional[int] = None) -> Iterator[Event]:
+    splitter = ChapterSplitter(max_chars)
+    for line in iter_lines(iter_text(file)):
+        yield from splitter.feed(line)
+    yield from splitter.close()
+
+
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "blockquote", "section", "h1", "h2", "h3", "h4", "h5", "h6"}
+_HEADING_TAGS = {"h1", "h2", "h3"}
+_SKIP_TAGS = {"script", "style", "head", "title"}
+
+
+class _XHTMLLines(HTMLParser):
+    """把 XHTML 文档转为 (行, 是否标题) 列表"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines: List[Tuple[str, bool]] = []
+        self._text: List[str] = []
+        self._heading = 0
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self._end_line()
+            if tag in _HEADING_TAGS:
+                self._heading += 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self._end_line()
+            if tag in _HEADING_TAGS:
+                self._heading = max(0, self._heading - 1)
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._text.append(data)
+
+    def _end_line(self):
+        line = "".join(self._text).strip()
+        self._text = []
+        if line:
+            self.lines.append((" ".join(line.split()) if self._heading else line, bool(self._heading)))
+
+    def close(self):
+        super().close()
+        self._end_line()
+
+
+def _spine(book: zipfile.ZipFile) -> List[str]:
+    """按书脊顺序返回正文文档在压缩包中的路径"""
+    container = ElementTree.fromstring(book.read("META-INF/container.xml"))
+    rootfile = next(e for e in container.iter() if e.tag.endswith("rootfile"))
+    opf_path = rootfile.attrib["full-path"]
+    opf = ElementTree.fromstring(book.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {
+        item.attrib["id"]: posixpath.normpath(posixpath.join(base, item.attrib["href"]))
+        for item in opf.iter() if item.tag.endswith("item") and "href" in item.attrib
+    }
+    return [
+        manifest[ref.attrib["idref"]]
+        for ref in opf.iter() if ref.tag.endswith("itemref") and ref.attrib.get("idref") in manifest
+    ]
+
+
+def _random_access(file: BinaryIO) -> Tuple[BinaryIO, bool]:
+    """zipfile 需要可随机访问的文件对象；否则（例如 Python 3.11 之前没有 seekable() 的
+    SpooledTemporaryFile）分块复制到临时文件。返回 (文件, 是否为复制出的临时文件)"""
+    if isinstance(file, io.IOBase) and file.seekable():
+        return file, False
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(file, copy, IMPORT_READ_CHUNK)
+    copy.seek(0)
+    return copy, True
+
+
+def parse_epub(file: BinaryIO, max_chars: Optional[int] = None) -> Iterator[Event]:
+    splitter = ChapterSplitter(max_chars)
+    file, copied = _random_access(file)
+    try:
+        yield from _parse_epub(file, splitter)
+    finally:
+        if copied:
+            file.close()
+
+
+def _parse_epub(file: BinaryIO, splitter: ChapterSplitter) -> Iterator[Event]:
+    try:
+        book = zipfile.ZipFile(file)
+        spine = _spine(book)
+    except (zipfile.BadZipFile, KeyError, StopIteration, ElementTree.ParseError) as e:
+        raise NovelParseError(f"无法解析EPUB文件: {e}") from e
+    with book:
+        for path in spine:
+            try:
+                document = book.read(path)
+            except KeyError:
+                # 书脊引用了不存在的文件，跳过
+                continue
+            parser = _XHTMLLines()
+            # 一次只解码一个文档
+            parser.feed(document.decode("utf-8", "replace"))
+            parser.close()
+            for line, is_heading in parser.lines:
+                yield from splitter.feed(line, "chapter" if is_heading else None)
+    yield from splitter.close()
+
+
+def parse_novel(file: BinaryIO, filename: str = "", max_chars: Optional[int] = None) -> Iterator[Event]:
+    """根据扩展名或文件头选择解析方式"""
+    head = file.read(4)
+    file.seek(0)
+    if filename.lower().endswith(".epub") or head == b"PK\x03\x04":
+        return parse_epub(file, max_chars)
+    return parse_txt(file, max_chars)
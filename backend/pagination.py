@@ -0,0 +1,112 @@
+"""
+列表接口的游标（keyset）分页
+
+按排序键（例如 (created_at, id) 或 (display_order, id)）翻页：下一页的条件是
+排序键 > 上一页最后一行的排序键，配合复合索引，任意深度的翻页都只扫描一页的行，
+不像 OFFSET 那样越往后越慢。
+
+排序列可以为空（例如旧数据的 order、display_order），为空的值按默认值（0、1970-01-01 或空字符串）
+参与排序和比较，NULL 行不会在翻页时被跳过。
+
+不传 limit 和 cursor 时保持原来的行为，返回全部结果。传了 limit 时最多返回 limit 行，
+还有下一页时在响应头 X-Next-Cursor 中返回游标，下次请求带上 cursor=<游标> 继续；
+响应体仍然是列表，旧客户端不受影响。
+"""
+import base64
+import binascii
+import datetime
+import json
+import os
+from typing import Callable, List, Optional, Sequence
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import func, literal, tuple_
+
+# 每页最多的行数
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# 排序列为空时使用的值
+NULL_DATETIME = datetime.datetime(1970, 1, 1)
+
+
+class PageParams:
+    """作为接口依赖使用：limit、cursor 两个查询参数"""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=API_MAX_PAGE_SIZE, description="每页行数，不传则返回全部"),
+        cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 中的游标"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [_decode_value(v) for v in json.loads(raw)]
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return values
+
+
+def _null_value(key):
+    python_type = key.type.python_type
+    if python_type is datetime.datetime:
+        return NULL_DATETIME
+    if python_type is str:
+        return ""
+    return 0
+
+
+def _sort_expression(key):
+    """可为空的列用 coalesce 补上默认值，ORDER BY 和游标比较使用同一表达式"""
+    if getattr(key.expression, "nullable", False):
+        return func.coalesce(key, literal(_null_value(key), key.type))
+    return key
+
+
+def paginate(query, keys: Sequence, page: PageParams, response: Response,
+             descending: bool = False, key_of: Optional[Callable] = None) -> List:
+    """按 keys 排序并翻页
+
+    keys 是排序列（最后一列必须唯一，通常是 id）；key_of 从一行中取出排序键，默认按列名读取属性。
+    """
+    expressions = [_sort_expression(k) for k in keys]
+    order = [e.desc() for e in expressions] if descending else expressions
+    query = query.order_by(*order)
+    if page.limit is None and page.cursor is None:
+        return query.all()
+
+    if page.cursor:
+        values = decode_cursor(page.cursor, len(keys))
+        row_key = tuple_(*expressions)
+        query = query.filter(row_key < tuple_(*values) if descending else row_key > tuple_(*values))
+    limit = page.limit or API_MAX_PAGE_SIZE
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = key_of(last) if key_of else [getattr(last, k.key) for k in keys]
+        values = [_null_value(k) if v is None else v for k, v in zip(keys, values)]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(values)
+    return rows
@@ -0,0 +1,218 @@
+"""
+项目与分卷统计
+
+Project / Volume 上的 chapter_count、word_count、last_edited_chapter_id 是物化的计数，
+列表和统计接口直接读取，不再每次按章节聚合。计数通过会话事件增量维护：
+每次 flush 后根据章节的新增、修改（字数变化、移动到其他分卷或项目）、删除计算增量，
+在同一事务中执行 col = col + 增量 的原子更新，回滚时一起回滚。
+
+不经过 ORM 会话的批量操作（query.delete、bulk_insert_mappings 等）不会触发事件，
+需要调用方自行调整计数，或运行 repair_stats 按批重新统计。
+
+用法: python project_stats.py [每批项目数]   重新统计全部项目和分卷
+"""
+import html
+import re
+import sys
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, event, func, select, update
+from sqlalchemy.orm import Session, attributes
+
+from models import Project, Volume, Chapter
+
+REPAIR_BATCH_SIZE = 100
+
+_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+def count_words(content: Optional[str]) -> int:
+    """章节字数：去掉HTML标签和实体后的字符数（与前端编辑器的统计方式一致）"""
+    if not content:
+        return 0
+    return len(html.unescape(_TAG_PATTERN.sub("", content)).strip())
+
+
+class _Delta:
+    __slots__ = ("chapters", "words", "last_edited", "removed")
+
+    def __init__(self):
+        self.chapters = 0
+        self.words = 0
+        self.last_edited: Optional[int] = None
+        self.removed = set()  # 本次删除或移出的章节id
+
+
+def _old_value(obj, key):
+    """flush 前的属性值（未修改时即当前值）"""
+    history = attributes.get_history(obj, key)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, key)
+
+
+def _collect(session) -> Tuple[Dict[int, _Delta], Dict[int, _Delta]]:
+    projects: Dict[int, _Delta] = defaultdict(_Delta)
+    volumes: Dict[int, _Delta] = defaultdict(_Delta)
+
+    def apply(project_id, volume_id, chapters, words, chapter_id, removed=False):
+        for owner_id, deltas in ((project_id, projects), (volume_id, volumes)):
+            if owner_id is None:
+                continue
+            delta = deltas[owner_id]
+            delta.chapters += chapters
+            delta.words += words
+            if removed:
+                delta.removed.add(chapter_id)
+            else:
+                delta.last_edited = chapter_id
+
+    for obj in session.new:
+        if isinstance(obj, Chapter):
+            apply(obj.project_id, obj.volume_id, 1, obj.word_count or 0, obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Chapter):
+            apply(_old_value(obj, "project_id"), _old_value(obj, "volume_id"),
+                  -1, -(_old_value(obj, "word_count") or 0), obj.id, removed=True)
+    for obj in session.dirty:
+        if not isinstance(obj, Chapter) or not session.is_modified(obj, include_collections=False):
+            continue
+        old_project, old_volume = _old_value(obj, "project_id"), _old_value(obj, "volume_id")
+        old_words = _old_value(obj, "word_count") or 0
+        if (old_project, old_volume) != (obj.project_id, obj.volume_id):
+            # 移动章节：从原项目/分卷减去，加到新项目/分卷
+            apply(old_project, old_volume, -1, -old_words, obj.id, removed=True)
+            apply(obj.project_id, obj.volume_id, 1, obj.word_count or 0, obj.id)
+        else:
+            apply(obj.project_id, obj.volume_id, 0, (obj.word_count or 0) - old_words, obj.id)
+    return projects, volumes
+
+
+def _latest_chapter(column, owner_id):
+    """所属项目/分卷中最近编辑的章节"""
+    return (
+        select(Chapter.id)
+        .where(column == owner_id)
+        .order_by(Chapter.updated_at.desc(), Chapter.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def _apply(session, model, column, deltas: Dict[int, _Delta]):
+    for owner_id, delta in deltas.items():
+        values = {}
+        if delta.chapters:
+            values["chapter_count"] = model.chapter_count + delta.chapters
+        if delta.words:
+            values["word_count"] = model.word_count + delta.words
+        if delta.last_edited is not None:
+            values["last_edited_chapter_id"] = delta.last_edited
+        if values:
+            session.execute(update(model).where(model.id == owner_id).values(**values),
+                            execution_options={"synchronize_session": False})
+        removed = delta.removed - {delta.last_edited}
+        if removed:
+            # 最近编辑的章节被删除或移走时，改为剩余章节中最近编辑的一章
+            session.execute(
+                update(model)
+                .where(model.id == owner_id, model.last_edited_chapter_id.in_(removed))
+                .values(last_edited_chapter_id=_latest_chapter(column, owner_id)),
+                execution_options={"synchronize_session": False},
+            )
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+# 章节过期后直接赋值时也先加载旧值，flush 后才能知道从哪个项目/分卷移出、字数变化多少
+for _attribute in (Chapter.project_id, Chapter.volume_id, Chapter.word_count):
+    event.listen(_attribute, "set", _keep_old_value, active_history=True)
+
+
+@event.listens_for(Session, "after_flush")
+def _update_stats(session, flush_context):
+    projects, volumes = _collect(session)
+    if not projects and not volumes:
+        return
+    _apply(session, Project, Chapter.project_id, projects)
+    _apply(session, Volume, Chapter.volume_id, volumes)
+    # 会话中已加载的项目/分卷的计数已过期，下次访问时重新读取
+    for obj in session.identity_map.values():
+        if (isinstance(obj, Project) and obj.id in projects) or (isinstance(obj, Volume) and obj.id in volumes):
+            session.expire(obj, ["chapter_count", "word_count", "last_edited_chapter_id"])
+
+
+def volume_chapters_deleted(db: Session, volume: Volume):
+    """分卷的章节被批量删除（不经过会话事件）后，从所属项目的计数中减去该分卷的计数"""
+    if volume.project_id is None:
+        return
+    deleted = ~select(Chapter.id).where(Chapter.id == Project.last_edited_chapter_id).exists()
+    db.execute(
+        update(Project).where(Project.id == volume.project_id).values(
+            chapter_count=Project.chapter_count - volume.chapter_count,
+            word_count=Project.word_count - volume.word_count,
+            last_edited_chapter_id=case(
+                (deleted, _latest_chapter(Chapter.project_id, volume.project_id)),
+                else_=Project.last_edited_chapter_id,
+            ),
+        ),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def _recount(db: Session, model, column, owner_ids):
+    counts = {
+        owner_id: (chapters, words)
+        for owner_id, chapters, words in db.query(
+            column, func.count(Chapter.id), func.coalesce(func.sum(Chapter.word_count), 0)
+        ).filter(column.in_(owner_ids)).group_by(column)
+    }
+    for owner_id in owner_ids:
+        chapters, words = counts.get(owner_id, (0, 0))
+        db.execute(
+            update(model).where(model.id == owner_id).values(
+                chapter_count=chapters, word_count=words,
+                last_edited_chapter_id=_latest_chapter(column, owner_id),
+            ),
+            execution_options={"synchronize_session": False},
+        )
+
+
+def repair_stats(db: Session, batch_size: int = REPAIR_BATCH_SIZE) -> int:
+    """按项目id分批重新统计项目及其分卷的计数，每批一个事务；返回处理的项目数"""
+    repaired = 0
+    last_id = 0
+    while True:
+        project_ids = [
+            row[0] for row in
+            db.query(Project.id).filter(Project.id > last_id).order_by(Project.id).limit(batch_size)
+        ]
+        if not project_ids:
+            break
+        volume_ids = [row[0] for row in db.query(Volume.id).filter(Volume.project_id.in_(project_ids))]
+        _recount(db, Project, Chapter.project_id, project_ids)
+        if volume_ids:
+            _recount(db, Volume, Chapter.volume_id, volume_ids)
+        db.commit()
+        repaired += len(project_ids)
+        last_id = project_ids[-1]
+    # 不属于任何项目的分卷
+    orphan_ids = [row[0] for row in db.query(Volume.id).filter(Volume.project_id.is_(None))]
+    if orphan_ids:
+        _recount(db, Volume, Chapter.volume_id, orphan_ids)
+        db.commit()
+    return repaired
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        count = repair_stats(session, int(sys.argv[1]) if len(sys.argv) > 1 else REPAIR_BATCH_SIZE)
+        print(f"✓ 已重新统计 {count} 个项目")
+    finally:
+        session.close()
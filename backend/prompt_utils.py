@@ -1,72 +1,302 @@
-import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, literal, null, or_, select, union_all
+from sqlalchemy.orm import Session
 from models import Project, Volume, Chapter, Worldview, RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon
+from resource_index import resource_index, entry_text, PROMPT_INDEX_ENABLED
+from template_cache import template_cache, compile_template, CompiledTemplate, PLACEHOLDER_PATTERN
+
+SELECTED_TEXT_KEYWORD = "选择文字"
+
+# 与原有逐个模型查找的顺序保持一致，数值越小优先级越高
+_NAMED_PRIORITY = [RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon]
+_CHAPTER_PRIORITY = len(_NAMED_PRIORITY)
+_VOLUME_PRIORITY = _CHAPTER_PRIORITY + 1
+_PROJECT_PRIORITY = _CHAPTER_PRIORITY + 2
+
+
+def extract_keywords(content):
+    """提取模板中所有不重复的占位符关键词，保持出现顺序"""
+    return list(dict.fromkeys(match.strip() for match in PLACEHOLDER_PATTERN.findall(content)))
+
+
+def _query_keywords_batched(db, project_id, keywords):
+    """用一条 UNION ALL 查询解析全部关键词，再用一条查询补齐命中章节的正文"""
+    parts = []
+    for priority, model in enumerate(_NAMED_PRIORITY):
+        parts.append(
+            select(literal(priority).label("priority"), model.id.label("id"), model.name.label("label"), model.content.label("text"))
+            .where(model.project_id == project_id, model.name.in_(keywords))
+        )
+    parts.append(
+        select(literal(_CHAPTER_PRIORITY).label("priority"), Chapter.id, Chapter.title, null())
+        .where(Chapter.project_id == project_id, or_(*[Chapter.title.startswith(k, autoescape=True) for k in keywords]))
+    )
+    parts.append(
+        select(literal(_VOLUME_PRIORITY).label("priority"), Volume.id, Volume.title, Volume.description)
+        .where(Volume.project_id == project_id, Volume.title.in_(keywords))
+    )
+    parts.append(
+        select(literal(_PROJECT_PRIORITY).label("priority"), Project.id, Project.title, Project.description)
+        .where(Project.title.in_(keywords))
+    )
+    if "世界观" in keywords:
+        parts.append(
+            select(literal(-1).label("priority"), Worldview.id, literal("世界观"), Worldview.content)
+            .where(Worldview.project_id == project_id)
+        )
+
+    keyword_set = set(keywords)
+    best = {}
+    for priority, row_id, label, text in db.execute(union_all(*parts)):
+        if priority == -1:
+            # 世界观为空时继续按普通关键词查找
+            if text:
+                best["世界观"] = ((priority, "", row_id), str(text), None)
+            continue
+        if priority == _CHAPTER_PRIORITY:
+            matched = [k for k in keywords if label.startswith(k)]
+        else:
+            matched = [label] if label in keyword_set else []
+        rank = (priority, label if priority == _CHAPTER_PRIORITY else "", row_id)
+        for keyword in matched:
+            current = best.get(keyword)
+            if current is None or rank < current[0]:
+                best[keyword] = (rank, text, label)
+
+    chapter_ids = [rank[2] for rank, _, _ in best.values() if rank[0] == _CHAPTER_PRIORITY]
+    chapter_contents = {}
+    if chapter_ids:
+        chapter_contents = dict(db.query(Chapter.id, Chapter.content).filter(Chapter.id.in_(chapter_ids)))
+
+    resolved = {}
+    for keyword, (rank, text, label) in best.items():
+        if rank[0] == _CHAPTER_PRIORITY:
+            text = chapter_contents.get(rank[2])
+        resolved[keyword] = str(text) if text else str(label)
+    return resolved
+
+
+def _query_keywords_indexed(db, project_id, keywords):
+    """通过常驻索引解析关键词，命中章节的正文用一条查询批量读取"""
+    index = resource_index.get(db, project_id)
+    entries = {}
+    for keyword in keywords:
+        if keyword == "世界观" and index.worldview:
+            entries[keyword] = index.worldview
+            continue
+        entry = index.lookup(keyword) or resource_index.lookup_project(db, keyword)
+        if entry is not None:
+            entries[keyword] = entry
+
+    chapter_ids = [e.id for e in entries.values() if not isinstance(e, str) and e.kind == "Chapter"]
+    chapter_contents = {}
+    if chapter_ids:
+        chapter_contents = dict(db.query(Chapter.id, Chapter.content).filter(Chapter.id.in_(chapter_ids)))
+
+    resolved = {}
+    for keyword, entry in entries.items():
+        if isinstance(entry, str):
+            resolved[keyword] = entry
+        elif entry.kind == "Chapter":
+            resolved[keyword] = entry_text(entry._replace(text=chapter_contents.get(entry.id)))
+        else:
+            resolved[keyword] = entry_text(entry)
+    return resolved
+
+
+def resolve_keywords(db, project_id, keywords):
+    """批量解析关键词，返回 关键词 -> 替换内容，未找到的关键词不在结果中"""
+    keywords = [k for k in keywords if k and k != SELECTED_TEXT_KEYWORD]
+    if not keywords or not project_id:
+        return {}
+    if PROMPT_INDEX_ENABLED:
+        return _query_keywords_indexed(db, project_id, keywords)
+    return _query_keywords_batched(db, project_id, keywords)
+
+
+# --- 统一的提示词渲染引擎 ---
+
+@dataclass
+class RenderContext:
+    db: object
+    project_id: Optional[int] = None
+    selected_text: Optional[str] = None
+
+
+@dataclass
+class RenderStats:
+    """单次渲染的耗时与查找计数"""
+    placeholders: int = 0
+    resolved: int = 0
+    lookups: int = 0
+    queries: int = 0
+    cache_hit: bool = False
+    fast_path: bool = False
+    elapsed_ms: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class PlaceholderResolver:
+    """占位符解析器基类，每次渲染只以批量方式调用一次"""
+
+    def resolve(self, ctx: RenderContext, keywords: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+
+class SelectedTextResolver(PlaceholderResolver):
+    """{{选择文字}} -> 编辑器中选中的文字"""
+
+    def resolve(self, ctx, keywords):
+        if ctx.selected_text and SELECTED_TEXT_KEYWORD in keywords:
+            return {SELECTED_TEXT_KEYWORD: str(ctx.selected_text)}
+        return {}
+
+
+class ProjectResourceResolver(PlaceholderResolver):
+    """世界观、角色、组织等项目资源，以及章节、分卷和项目标题"""
+
+    def resolve(self, ctx, keywords):
+        return resolve_keywords(ctx.db, ctx.project_id, keywords)
+
+
+class PromptRenderer:
+    """
+    提示词渲染引擎：编译(缓存) -> 无占位符快速返回 -> 渲染缓存 -> 各解析器批量取数 -> 单遍替换。
+    渲染接口和聊天接口共用同一条路径，并累计耗时和查找计数。
+    """
+
+    def __init__(self, resolvers: List[PlaceholderResolver]):
+        self.resolvers = list(resolvers)
+        self._lock = threading.Lock()
+        self._totals = {
+            "renders": 0, "fast_path": 0, "cache_hits": 0,
+            "lookups": 0, "queries": 0, "unresolved": 0, "total_ms": 0.0,
+        }
+
+    def register(self, resolver: PlaceholderResolver, index: Optional[int] = None):
+        """注册额外的解析器，排在前面的优先"""
+        if index is None:
+            self.resolvers.append(resolver)
+        else:
+            self.resolvers.insert(index, resolver)
+
+    def resolve(self, ctx: RenderContext, compiled: CompiledTemplate, cache_key=None) -> Tuple[Dict[str, str], RenderStats]:
+        """解析模板中的全部占位符，返回 关键词 -> 替换内容"""
+        started = time.perf_counter()
+        stats = RenderStats(placeholders=len(compiled.variables))
+        try:
+            if not compiled.has_placeholders:
+                stats.fast_path = True
+                return {}, stats
+
+            if cache_key is not None:
+                values = template_cache.get_values(cache_key)
+                if values is not None:
+                    stats.cache_hit = True
+                    stats.resolved = len(values)
+                    return values, stats
+
+            values = self._fetch(ctx, compiled.variables, stats)
+            if cache_key is not None:
+                template_cache.put_values(cache_key, values)
+            return values, stats
+        finally:
+            stats.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+            self._record(stats)
+
+    def render(self, ctx: RenderContext, compiled: CompiledTemplate, cache_key=None) -> Tuple[str, RenderStats]:
+        values, stats = self.resolve(ctx, compiled, cache_key)
+        return compiled.render(values), stats
+
+    def _fetch(self, ctx, keywords, stats):
+        """批量取数阶段：每个解析器只处理前面的解析器未解决的关键词"""
+        values = {}
+        ctx.db.info[_STATS_KEY] = stats
+        try:
+            for resolver in self.resolvers:
+                pending = [k for k in keywords if k not in values]
+                if not pending:
+                    break
+                stats.lookups += len(pending)
+                values.update(resolver.resolve(ctx, pending))
+        finally:
+            ctx.db.info.pop(_STATS_KEY, None)
+        stats.resolved = len(values)
+        return values
+
+    def _record(self, stats: RenderStats):
+        with self._lock:
+            totals = self._totals
+            totals["renders"] += 1
+            totals["fast_path"] += stats.fast_path
+            totals["cache_hits"] += stats.cache_hit
+            totals["lookups"] += stats.lookups
+            totals["queries"] += stats.queries
+            totals["unresolved"] += stats.placeholders - stats.resolved
+            totals["total_ms"] += stats.elapsed_ms
+
+    def metrics(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["total_ms"] = round(totals["total_ms"], 3)
+        totals["avg_ms"] = round(totals["total_ms"] / totals["renders"], 3) if totals["renders"] else 0.0
+        return totals
+
+    def resolve_template(self, db, template_id, project_id, selected_text=None):
+        """按模板id解析，返回 (编译结果, 替换内容, 统计)；模板不存在时全部为 None。
+        模板和解析结果都命中缓存时不访问数据库"""
+        cached = template_cache.get(db, template_id)
+        if cached is None:
+            return None, None, None
+        key = template_cache.render_key(cached, project_id, selected_text)
+        values, stats = self.resolve(RenderContext(db, project_id, selected_text), cached.compiled, key)
+        return cached.compiled, values, stats
+
+    def render_template(self, db, template_id, project_id, selected_text=None) -> Tuple[Optional[str], Optional[RenderStats]]:
+        compiled, values, stats = self.resolve_template(db, template_id, project_id, selected_text)
+        if compiled is None:
+            return None, None
+        return compiled.render(values), stats
+
+    def render_content(self, db, content, project_id, selected_text=None) -> Tuple[str, RenderStats]:
+        """渲染任意文本（例如编辑器中临时输入的提示词）"""
+        return self.render(RenderContext(db, project_id, selected_text), _compile_content(content))
+
+
+@lru_cache(maxsize=64)
+def _compile_content(content):
+    return compile_template(content)
+
+
+_STATS_KEY = "prompt_render_stats"
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _count_render_queries(orm_execute_state):
+    stats = orm_execute_state.session.info.get(_STATS_KEY)
+    if stats is not None:
+        stats.queries += 1
+
+
+prompt_renderer = PromptRenderer([SelectedTextResolver(), ProjectResourceResolver()])
+
 
 def process_prompt_template(db, prompt_template, project_id, request_resources=None, selected_text=None):
-    content = prompt_template.content
-
-    if '{{' not in content:
-        return content
-
-    search_models = [
-        RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon, Chapter, Volume, Project
-    ]
-
-    def replacer(match):
-        keyword = match.group(1).strip()
-        print(f"--- Searching for keyword: '{keyword}' ---")
-        
-        # 特殊处理：选择文字
-        if keyword == "选择文字":
-            if selected_text:
-                print(f"[SUCCESS] Found selected text")
-                return str(selected_text)
-            else:
-                print(f"--- No selected text provided ---")
-                return match.group(0)
-        
-        # 特殊处理：世界观
-        if keyword == "世界观" and project_id:
-            worldview = db.query(Worldview).filter(Worldview.project_id == project_id).first()
-            if worldview and worldview.content:
-                print(f"[SUCCESS] Found worldview")
-                return str(worldview.content)
-        
-        if not project_id:
-            return match.group(0)
-
-        for model in search_models:
-            model_name = model.__name__
-            query = db.query(model)
-            query_attr = 'name' if hasattr(model, 'name') else 'title'
-
-            if model == Chapter:
-                query = query.filter(Chapter.project_id == project_id, Chapter.title.startswith(keyword))
-            elif hasattr(model, 'project_id'):
-                query = query.filter(model.project_id == project_id, getattr(model, query_attr) == keyword)
-            else:
-                # This case would be for models not tied to a project, like Project itself by title
-                query = query.filter(getattr(model, query_attr) == keyword)
-
-            result = query.first()
-            
-            if result:
-                print(f"[SUCCESS] Found match in {model_name} for keyword '{keyword}'")
-                found_content = None
-                if hasattr(result, 'content') and result.content:
-                    found_content = result.content
-                elif hasattr(result, 'description') and result.description:
-                    found_content = result.description
-                else:
-                    found_content = getattr(result, query_attr, '')
-                
-                # Return the found content for replacement
-                return str(found_content)
-
-        # If no match was found in any model, return the original placeholder
-        print(f"--- Keyword '{{{{ {keyword} }}}}' was not found in any resource. ---")
-        return match.group(0)
-
-    # Use re.sub with the replacer function to perform all replacements
-    final_content = re.sub(r'\{\{\s*(.*?)\s*\}\}', replacer, content)
-    
-    return final_content
\ No newline at end of file
+    """渲染已加载的模板行"""
+    cached = template_cache.compiled(prompt_template)
+    key = template_cache.render_key(cached, project_id, selected_text)
+    rendered, _ = prompt_renderer.render(RenderContext(db, project_id, selected_text), cached.compiled, key)
+    return rendered
+
+
+def render_prompt_template(db, template_id, project_id, selected_text=None):
+    """按模板id渲染，模板不存在时返回 None"""
+    rendered, _ = prompt_renderer.render_template(db, template_id, project_id, selected_text)
+    return rendered
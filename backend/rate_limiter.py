@@ -0,0 +1,235 @@
+"""
+按 AI 提供商的限流与排队
+
+每个提供商有三个限制：每分钟请求数（RPM）、每分钟 Token 数（TPM）和同时进行的请求数，
+均按每个密钥配置，提供商配置了多个密钥时总限额相应增加。
+RPM/TPM 使用令牌桶，超出限制的请求进入队列：交互式请求优先于批量任务，同一优先级先到先得。
+上游返回 429 时按 Retry-After 暂停该提供商的放行，请求重新排队后自动重试，而不是直接把错误存进对话。
+
+提供商未单独配置时使用环境变量中的默认值，0 表示不限制。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Dict, Optional
+
+AI_RATE_RPM = int(os.getenv("AI_RATE_RPM", "0"))
+AI_RATE_TPM = int(os.getenv("AI_RATE_TPM", "0"))
+AI_RATE_CONCURRENCY = int(os.getenv("AI_RATE_CONCURRENCY", "0"))
+# 收到 429 后最多重新排队的次数
+AI_RATE_MAX_RETRIES = int(os.getenv("AI_RATE_MAX_RETRIES", "2"))
+# 没有 Retry-After 时的默认暂停秒数
+AI_RATE_DEFAULT_RETRY_AFTER = float(os.getenv("AI_RATE_DEFAULT_RETRY_AFTER", "5"))
+AI_RATE_MAX_RETRY_AFTER = float(os.getenv("AI_RATE_MAX_RETRY_AFTER", "60"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """解析 Retry-After 头（秒数），无法解析时使用默认值"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        seconds = AI_RATE_DEFAULT_RETRY_AFTER
+    return min(max(seconds, 0.0), AI_RATE_MAX_RETRY_AFTER)
+
+
+class TokenBucket:
+    """每分钟补充 rate 个令牌，容量为 rate"""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.level = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """距离桶中有 amount 个令牌还需要的秒数"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.rate)  # 超过容量的请求最多等到桶满
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.rate
+
+    def take(self, amount: float):
+        if self.rate:
+            self.level -= min(amount, self.rate)
+
+    def give_back(self, amount: float):
+        if self.rate and amount > 0:
+            self.level = min(self.rate, self.level + amount)
+
+
+class Ticket:
+    """一个排队中或已放行的请求"""
+
+    def __init__(self, limiter: "ProviderLimiter", priority: int, tokens: int, seq: int):
+        self.limiter = limiter
+        self.priority = priority
+        self.tokens = tokens
+        self.seq = seq
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def position(self) -> int:
+        """在队列中的位置，1 表示下一个放行；已放行时为 0"""
+        if self.admitted.done():
+            return 0
+        return 1 + sum(1 for t in self.limiter._queue if t < self)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待放行，超时返回 False（用于定期报告排队位置）"""
+        if not self.admitted.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self.admitted), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def release(self, used_tokens: Optional[int] = None):
+        """请求结束；used_tokens 小于预留的 Token 数时退还差额"""
+        if self.released:
+            return
+        self.released = True
+        self.limiter._release(self, used_tokens)
+
+
+class ProviderLimiter:
+    def __init__(self, rpm: int = 0, tpm: int = 0, concurrency: int = 0):
+        self.requests = TokenBucket(0)
+        self.token_bucket = TokenBucket(0)
+        self.concurrency = 0
+        self.configure(rpm, tpm, concurrency)
+        self.active = 0
+        self.blocked_until = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.admitted_total = 0
+        self.queued_total = 0
+        self.throttled_total = 0
+
+    def configure(self, rpm: int, tpm: int, concurrency: int):
+        if rpm != self.requests.rate:
+            self.requests = TokenBucket(rpm)
+        if tpm != self.token_bucket.rate:
+            self.token_bucket = TokenBucket(tpm)
+        self.concurrency = concurrency
+
+    def enqueue(self, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE) -> Ticket:
+        ticket = Ticket(self, priority, tokens, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        self._dispatch()
+        if not ticket.admitted.done():
+            self.queued_total += 1
+        return ticket
+
+    def cancel(self, ticket: Ticket):
+        """放弃排队（客户端断开等）"""
+        if not ticket.admitted.done():
+            ticket.admitted.cancel()
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._dispatch()
+        else:
+            ticket.release(0)
+
+    def throttle(self, retry_after: float):
+        """上游返回 429：在 retry_after 秒内暂停放行"""
+        self.throttled_total += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        # 令牌桶清空，恢复后按速率逐步放行
+        self.requests.level = min(self.requests.level, 0)
+        self._schedule(retry_after)
+
+    def _release(self, ticket: Ticket, used_tokens: Optional[int]):
+        self.active -= 1
+        if used_tokens is not None:
+            self.token_bucket.give_back(ticket.tokens - used_tokens)
+        self._dispatch()
+
+    def _wait_time(self, ticket: Ticket, now: float) -> Optional[float]:
+        """队首请求还需等待的秒数；受并发数限制时返回 None（等待其他请求结束）"""
+        if self.concurrency and self.active >= self.concurrency:
+            return None
+        return max(
+            self.blocked_until - now,
+            self.requests.wait_time(1, now),
+            self.token_bucket.wait_time(ticket.tokens, now),
+            0.0,
+        )
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._queue:
+            head = self._queue[0]
+            wait = self._wait_time(head, now)
+            if wait is None:
+                return
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.token_bucket.take(head.tokens)
+            self.active += 1
+            self.admitted_total += 1
+            head.admitted.set_result(True)
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self) -> dict:
+        return {
+            "rpm": self.requests.rate,
+            "tpm": self.token_bucket.rate,
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self._queue),
+            "blocked_for": round(max(self.blocked_until - time.monotonic(), 0.0), 3),
+            "admitted_total": self.admitted_total,
+            "queued_total": self.queued_total,
+            "throttled_total": self.throttled_total,
+        }
+
+
+class RateLimiterRegistry:
+    """按提供商id管理限流器，只在事件循环中访问"""
+
+    def __init__(self):
+        self._limiters: Dict[int, ProviderLimiter] = {}
+
+    def for_provider(self, provider) -> ProviderLimiter:
+        """限制按每个密钥配置，提供商的总限额随密钥池中的密钥数增加"""
+        keys = max(len(provider.api_keys), 1)
+        rpm = provider.rpm_limit if provider.rpm_limit is not None else AI_RATE_RPM
+        tpm = provider.tpm_limit if provider.tpm_limit is not None else AI_RATE_TPM
+        concurrency = provider.max_concurrency if provider.max_concurrency is not None else AI_RATE_CONCURRENCY
+        rpm, tpm, concurrency = rpm * keys, tpm * keys, concurrency * keys
+        limiter = self._limiters.get(provider.id)
+        if limiter is None:
+            limiter = self._limiters[provider.id] = ProviderLimiter(rpm, tpm, concurrency)
+        else:
+            limiter.configure(rpm, tpm, concurrency)
+        return limiter
+
+    def stats(self) -> dict:
+        return {provider_id: limiter.stats() for provider_id, limiter in self._limiters.items()}
+
+
+rate_limiters = RateLimiterRegistry()
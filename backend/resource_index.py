@@ -0,0 +1,282 @@
+"""
+项目资源关键词索引
+
+为提示词占位符解析提供常驻内存的 名称 -> 资源 索引，每个项目首次使用时构建一次，
+之后通过 SQLAlchemy 会话事件在资源创建、更新、删除提交后增量维护。
+占位符查找因此只需若干次字典命中，章节标题的前缀匹配使用有序列表 + 二分查找。
+"""
+import os
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import (
+    Project, Volume, Chapter, Worldview,
+    RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon
+)
+
+# 按名称精确匹配的资源类型，顺序即占位符解析的优先级
+NAMED_MODELS = [RPGCharacter, Organization, SupernaturalPower, Weapon, Dungeon]
+
+# 最多常驻内存的项目索引数量，超过后按最近最少使用淘汰
+MAX_INDEXED_PROJECTS = int(os.getenv("PROMPT_INDEX_MAX_PROJECTS", "64"))
+
+# 关闭后占位符解析退回到按表批量查询（见 prompt_utils.resolve_keywords）
+PROMPT_INDEX_ENABLED = os.getenv("PROMPT_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class IndexEntry(NamedTuple):
+    kind: str            # 模型名称，例如 "RPGCharacter"
+    id: int
+    label: str           # 名称或标题
+    text: Optional[str]  # 用于替换的内容；章节正文不常驻内存，为 None
+
+
+def entry_text(entry: IndexEntry) -> str:
+    """与原有逻辑一致：优先使用内容/描述，否则退回名称"""
+    return str(entry.text) if entry.text else str(entry.label)
+
+
+class ProjectResourceIndex:
+    """单个项目的资源索引"""
+
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.worldview: Optional[str] = None
+        # kind -> 名称 -> {id: entry}，同名资源按 id 最小者优先
+        self._named: Dict[str, Dict[str, Dict[int, IndexEntry]]] = {m.__name__: {} for m in NAMED_MODELS}
+        self._volumes: Dict[str, Dict[int, IndexEntry]] = {}
+        # (kind, id) -> 名称，用于更新和删除时定位旧条目
+        self._labels: Dict[Tuple[str, int], str] = {}
+        # 章节标题有序列表，元素为 (title, id)
+        self._chapter_titles: List[Tuple[str, int]] = []
+
+    @classmethod
+    def build(cls, db: Session, project_id: int) -> "ProjectResourceIndex":
+        """每张资源表一次查询构建索引"""
+        index = cls(project_id)
+        for model in NAMED_MODELS:
+            rows = db.query(model.id, model.name, model.content).filter(model.project_id == project_id)
+            for row_id, name, content in rows:
+                index.put(IndexEntry(model.__name__, row_id, name, content))
+        for row_id, title, description in db.query(Volume.id, Volume.title, Volume.description).filter(Volume.project_id == project_id):
+            index.put(IndexEntry("Volume", row_id, title, description))
+        for row_id, title in db.query(Chapter.id, Chapter.title).filter(Chapter.project_id == project_id):
+            index.put(IndexEntry("Chapter", row_id, title, None))
+        worldview = db.query(Worldview.content).filter(Worldview.project_id == project_id).first()
+        index.worldview = worldview[0] if worldview else None
+        return index
+
+    def put(self, entry: IndexEntry):
+        self.remove(entry.kind, entry.id)
+        if entry.label is None:
+            return
+        self._labels[(entry.kind, entry.id)] = entry.label
+        if entry.kind == "Chapter":
+            insort(self._chapter_titles, (entry.label, entry.id))
+        elif entry.kind == "Volume":
+            self._volumes.setdefault(entry.label, {})[entry.id] = entry
+        else:
+            self._named[entry.kind].setdefault(entry.label, {})[entry.id] = entry
+
+    def remove(self, kind: str, entry_id: int) -> bool:
+        """移除条目，返回是否确实存在"""
+        label = self._labels.pop((kind, entry_id), None)
+        if label is None:
+            return False
+        if kind == "Chapter":
+            pos = bisect_left(self._chapter_titles, (label, entry_id))
+            if pos < len(self._chapter_titles) and self._chapter_titles[pos] == (label, entry_id):
+                del self._chapter_titles[pos]
+            return True
+        buckets = self._volumes if kind == "Volume" else self._named[kind]
+        bucket = buckets.get(label)
+        if bucket is not None:
+            bucket.pop(entry_id, None)
+            if not bucket:
+                del buckets[label]
+        return True
+
+    def find_chapter(self, prefix: str) -> Optional[IndexEntry]:
+        """按标题前缀查找章节，返回字典序最小的匹配"""
+        pos = bisect_left(self._chapter_titles, (prefix,))
+        if pos < len(self._chapter_titles):
+            title, chapter_id = self._chapter_titles[pos]
+            if title.startswith(prefix):
+                return IndexEntry("Chapter", chapter_id, title, None)
+        return None
+
+    def lookup(self, keyword: str) -> Optional[IndexEntry]:
+        """按原有优先级查找：具名资源 -> 章节(前缀) -> 分卷"""
+        for model in NAMED_MODELS:
+            bucket = self._named[model.__name__].get(keyword)
+            if bucket:
+                return bucket[min(bucket)]
+        chapter = self.find_chapter(keyword)
+        if chapter:
+            return chapter
+        bucket = self._volumes.get(keyword)
+        if bucket:
+            return bucket[min(bucket)]
+        return None
+
+
+class ResourceIndexRegistry:
+    """全部项目索引的容器，线程安全"""
+
+    def __init__(self, max_projects: int = MAX_INDEXED_PROJECTS):
+        self.max_projects = max_projects
+        self._lock = threading.RLock()
+        self._indexes: "OrderedDict[int, ProjectResourceIndex]" = OrderedDict()
+        # 项目标题不属于任何项目，单独维护一份全局索引
+        self._project_titles: Optional[Dict[str, Dict[int, IndexEntry]]] = None
+        self._project_labels: Dict[int, str] = {}
+        # 每个项目的资源版本号，任何变更都会使其递增
+        self._versions: Dict[int, int] = {}
+        # 项目标题是跨项目共享的，其变更单独计数
+        self.global_version = 0
+
+    def version(self, project_id: int) -> int:
+        return self._versions.get(project_id, 0)
+
+    def get(self, db: Session, project_id: int) -> ProjectResourceIndex:
+        with self._lock:
+            index = self._indexes.get(project_id)
+            if index is not None:
+                self._indexes.move_to_end(project_id)
+                return index
+            version = self.version(project_id)
+
+        index = ProjectResourceIndex.build(db, project_id)
+
+        with self._lock:
+            # 构建期间发生了变更，本次结果可能已过期，只用于当前请求
+            if self.version(project_id) != version:
+                return index
+            self._indexes[project_id] = index
+            self._indexes.move_to_end(project_id)
+            while len(self._indexes) > self.max_projects:
+                self._indexes.popitem(last=False)
+            return index
+
+    def lookup_project(self, db: Session, title: str) -> Optional[IndexEntry]:
+        with self._lock:
+            titles = self._project_titles
+        if titles is None:
+            titles = {}
+            labels = {}
+            for row_id, row_title, description in db.query(Project.id, Project.title, Project.description):
+                titles.setdefault(row_title, {})[row_id] = IndexEntry("Project", row_id, row_title, description)
+                labels[row_id] = row_title
+            with self._lock:
+                if self._project_titles is None:
+                    self._project_titles = titles
+                    self._project_labels = labels
+                titles = self._project_titles
+        bucket = titles.get(title)
+        return bucket[min(bucket)] if bucket else None
+
+    def invalidate(self, project_id: Optional[int] = None):
+        """丢弃索引，下次使用时重新构建；不传 project_id 时清空全部"""
+        with self._lock:
+            if project_id is None:
+                self._indexes.clear()
+                self._project_titles = None
+                self._project_labels = {}
+                self.global_version += 1
+                for key in list(self._versions):
+                    self._versions[key] += 1
+            else:
+                self._indexes.pop(project_id, None)
+                self._versions[project_id] = self.version(project_id) + 1
+
+    def apply(self, ops):
+        """应用已提交的变更，ops 中每项为 (操作, project_id, entry)"""
+        with self._lock:
+            for op, project_id, entry in ops:
+                if entry.kind == "Project":
+                    self._apply_project(op, entry)
+                    self.global_version += 1
+                    if op == "delete":
+                        self._indexes.pop(entry.id, None)
+                        self._versions[entry.id] = self.version(entry.id) + 1
+                    continue
+                # 资源可能在项目间移动，先从所有已加载的索引中移除
+                if entry.kind != "Worldview":
+                    for other_id, index in self._indexes.items():
+                        if index.remove(entry.kind, entry.id) and other_id != project_id:
+                            self._versions[other_id] = self.version(other_id) + 1
+                if project_id is None:
+                    continue
+                self._versions[project_id] = self.version(project_id) + 1
+                index = self._indexes.get(project_id)
+                if index is None or op == "delete":
+                    if index is not None and entry.kind == "Worldview":
+                        index.worldview = None
+                    continue
+                if entry.kind == "Worldview":
+                    index.worldview = entry.text
+                else:
+                    index.put(entry)
+
+    def _apply_project(self, op, entry: IndexEntry):
+        if self._project_titles is None:
+            return
+        old_label = self._project_labels.pop(entry.id, None)
+        if old_label is not None:
+            bucket = self._project_titles.get(old_label, {})
+            bucket.pop(entry.id, None)
+            if not bucket:
+                self._project_titles.pop(old_label, None)
+        if op != "delete":
+            self._project_titles.setdefault(entry.label, {})[entry.id] = entry
+            self._project_labels[entry.id] = entry.label
+
+
+resource_index = ResourceIndexRegistry()
+
+
+# --- 通过会话事件维护索引 ---
+
+_INDEXED_TYPES = tuple(NAMED_MODELS) + (Volume, Chapter, Worldview, Project)
+_PENDING_KEY = "resource_index_ops"
+
+
+def _entry_for(obj) -> IndexEntry:
+    kind = type(obj).__name__
+    if isinstance(obj, Worldview):
+        return IndexEntry(kind, obj.id, "", obj.content)
+    if isinstance(obj, Chapter):
+        return IndexEntry(kind, obj.id, obj.title, None)
+    if isinstance(obj, (Volume, Project)):
+        return IndexEntry(kind, obj.id, obj.title, obj.description)
+    return IndexEntry(kind, obj.id, obj.name, obj.content)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_index_ops(session, flush_context):
+    ops = session.info.setdefault(_PENDING_KEY, [])
+    for op, objects in (("upsert", session.new), ("upsert", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, _INDEXED_TYPES):
+                continue
+            if op == "upsert" and obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            project_id = obj.id if isinstance(obj, Project) else obj.project_id
+            ops.append((op, project_id, _entry_for(obj)))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_index_ops(session):
+    ops = session.info.pop(_PENDING_KEY, None)
+    if ops:
+        resource_index.apply(ops)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_index_ops(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,172 @@
+"""
+AI 回复缓存
+
+同一段章节反复执行相同的润色、续写提示词时，直接返回之前的回复而不再调用AI提供商。
+缓存键为 (提供商, 模型标识符, 完整消息列表, temperature, max_tokens) 的哈希，
+内存中按 LRU + TTL 淘汰，可选写入磁盘作为第二级缓存。
+
+是否使用缓存由 AI_RESPONSE_CACHE_POLICY 决定（默认关闭）：
+    off            不缓存
+    request        仅当请求中 use_cache 为 true 时
+    deterministic  temperature 为 0，或请求中 use_cache 为 true 时
+    always         所有请求（请求中 use_cache 为 false 时除外）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from app_logging import get_logger
+
+logger = get_logger("response_cache")
+
+AI_RESPONSE_CACHE_POLICY = os.getenv("AI_RESPONSE_CACHE_POLICY", "off").lower()
+AI_RESPONSE_CACHE_SIZE = int(os.getenv("AI_RESPONSE_CACHE_SIZE", "256"))
+AI_RESPONSE_CACHE_TTL = float(os.getenv("AI_RESPONSE_CACHE_TTL", "86400"))
+AI_RESPONSE_CACHE_DIR = os.getenv("AI_RESPONSE_CACHE_DIR", "")
+
+POLICIES = ("off", "request", "deterministic", "always")
+
+
+def cache_key(provider_id, model_identifier: str, messages: List[dict], temperature, max_tokens) -> str:
+    payload = json.dumps(
+        {
+            "provider": provider_id,
+            "model": model_identifier,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """内存 LRU + TTL，可选磁盘二级缓存。条目为 {"content", "thinking", "created"}"""
+
+    def __init__(self, policy: str = AI_RESPONSE_CACHE_POLICY, max_size: int = AI_RESPONSE_CACHE_SIZE,
+                 ttl: float = AI_RESPONSE_CACHE_TTL, disk_dir: str = AI_RESPONSE_CACHE_DIR):
+        if policy not in POLICIES:
+            logger.warning("未知的AI回复缓存策略 '%s'，已关闭缓存", policy)
+            policy = "off"
+        self.policy = policy
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def enabled_for(self, temperature, use_cache: Optional[bool]) -> bool:
+        """根据缓存策略和请求参数判断本次对话是否使用缓存"""
+        if self.policy == "off" or use_cache is False:
+            return False
+        if self.policy == "always" or use_cache:
+            return True
+        return self.policy == "deterministic" and temperature is not None and float(temperature) == 0.0
+
+    def _expired(self, entry) -> bool:
+        return self.ttl > 0 and time.time() - entry["created"] > self.ttl
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry):
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, content: str, thinking: str = ""):
+        entry = {"content": content, "thinking": thinking, "created": time.time()}
+        with self._lock:
+            self.stores += 1
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读到半个文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("写入AI回复缓存失败: %s", e)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for root, _, files in os.walk(self.disk_dir):
+                for name in files:
+                    if name.endswith(".json"):
+                        try:
+                            os.remove(os.path.join(root, name))
+                        except OSError:
+                            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "disk": bool(self.disk_dir),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+            }
+
+
+response_cache = ResponseCache()
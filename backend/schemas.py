@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
 
 # 基础模式
@@ -23,6 +23,7 @@ class ProjectResponse(ProjectBase):
     updated_at: Optional[datetime] = None
     word_count: Optional[int] = 0
     chapter_count: Optional[int] = 0
+    last_edited_chapter_id: Optional[int] = None
 
 
 
@@ -38,9 +39,33 @@ class VolumeCreate(VolumeBase):
 class VolumeResponse(VolumeBase):
     id: int
     project_id: Optional[int] = None
+    word_count: Optional[int] = 0
+    chapter_count: Optional[int] = 0
+    last_edited_chapter_id: Optional[int] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+# 统计相关模式
+class VolumeStats(BaseSchema):
+    id: int
+    title: str
+    chapter_count: int = 0
+    word_count: int = 0
+    last_edited_chapter_id: Optional[int] = None
+
+class LastEditedChapter(BaseSchema):
+    id: int
+    title: str
+    volume_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+class ProjectStatsResponse(BaseSchema):
+    project_id: int
+    chapter_count: int = 0
+    word_count: int = 0
+    last_edited_chapter: Optional[LastEditedChapter] = None
+    volumes: List[VolumeStats] = []
+
 # 章节相关模式
 class ChapterBase(BaseSchema):
     title: str
@@ -59,12 +84,36 @@ class ChapterResponse(ChapterBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+class ChapterOutline(BaseSchema):
+    """章节大纲：不含正文"""
+    id: int
+    title: str
+    order: Optional[int] = 0
+    word_count: Optional[int] = 0
+    volume_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+class VolumeOutline(BaseSchema):
+    id: int
+    title: str
+    order: Optional[int] = 0
+    chapter_count: int = 0
+    word_count: int = 0
+    chapters: List[ChapterOutline] = []
+
+class ProjectOutlineResponse(BaseSchema):
+    project_id: int
+    volumes: List[VolumeOutline] = []
+
 # AI模型相关模式
 class AIModelBase(BaseSchema):
     name: str
     model_identifier: str
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2000
+    context_window: Optional[int] = None
+    hedge_model_ids: Optional[List[int]] = None
+    adapter: Optional[str] = None  # 流式响应适配器：openai / reasoning / glm / thinking，为空时自动判断
     is_default: Optional[bool] = False
     enabled: Optional[bool] = True
 
@@ -83,12 +132,20 @@ class AIModelResponse(AIModelBase):
         from_attributes = True
 
 # AI提供商相关模式
+class APIKeyEntry(BaseModel):
+    key: str
+    weight: Optional[int] = 1
+
 class AIProviderBase(BaseSchema):
     name: str
     api_key: Optional[str] = None
     base_url: Optional[str] = None
     enabled: Optional[bool] = True
     is_system: Optional[bool] = False
+    api_keys: Optional[List[Union[str, APIKeyEntry]]] = None
+    rpm_limit: Optional[int] = None
+    tpm_limit: Optional[int] = None
+    max_concurrency: Optional[int] = None
 
 class AIProviderCreate(AIProviderBase):
     pass
@@ -100,6 +157,7 @@ class AIProviderResponse(AIProviderBase):
     id: int
     is_system: bool
     models: List[AIModelResponse] = []
+    circuit: Optional[Dict[str, Any]] = None  # 熔断器状态
 
 class AIProviderInModelResponse(AIProviderBase):
     id: int
@@ -223,6 +281,7 @@ class MessageCreate(MessageBase):
 
 class MessageResponse(MessageBase):
     id: int
+    status: Optional[str] = "complete"  # streaming 为生成中分段保存的内容，truncated 为生成中断时保存的部分回复
     created_at: datetime
 
     class Config:
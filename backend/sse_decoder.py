@@ -0,0 +1,123 @@
+"""
+增量 SSE（text/event-stream）解码器
+
+直接处理上游返回的原始字节块，按 HTML 规范的事件流语法解析：
+    - 行结束符可以是 CRLF、LF 或单独的 CR，跨块拆开的 CRLF 和多字节字符都能正确处理
+    - 多行 data 以换行连接为一个事件，空行分发事件
+    - 支持 event、id、retry 字段，以冒号开头的注释行忽略
+    - 流开头的 UTF-8 BOM 忽略
+每个块中完整的行一次性解码、切分，未结束的行保留在缓冲区中等待下一个块。
+"""
+from typing import AsyncIterator, List, NamedTuple, Optional
+
+CR = 0x0D
+BOM = "\ufeff"
+
+
+class SSEEvent(NamedTuple):
+    event: str  # 事件类型，未指定时为 message
+    data: str
+    id: Optional[str]  # 最近一次设置的事件id
+    retry: Optional[int]  # 服务端建议的重连间隔（毫秒）
+
+
+class SSEDecoder:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[str] = []
+        self._event = ""
+        self._started = False
+        self.last_id: Optional[str] = None
+        self.retry: Optional[int] = None
+        self.comments = 0
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一个字节块，返回其中已完整的事件"""
+        buffer = self._buffer
+        buffer += chunk
+        if b"\r" in buffer:
+            # 统一为 LF；末尾的 CR 要等下一个块才知道后面是不是 LF，先留在缓冲区
+            end = len(buffer) - 1 if buffer[-1] == CR else len(buffer)
+            complete = bytes(buffer[:end]).replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            last = complete.rfind(b"\n")
+            if last == -1:
+                return []
+            self._buffer = bytearray(complete[last + 1:]) + buffer[end:]
+            text = complete[:last].decode("utf-8", "replace")
+        else:
+            last = buffer.rfind(b"\n")
+            if last == -1:
+                return []
+            # 换行符是 ASCII，完整行内不会切开多字节字符，整段只解码一次
+            text = buffer[:last].decode("utf-8", "replace")
+            del buffer[:last + 1]
+        events = []
+        for line in text.split("\n"):
+            event = self._line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """流结束：处理最后一行，并分发没有以空行结束的事件（很多提供商最后不发空行）"""
+        events = []
+        if self._buffer:
+            line = self._buffer.rstrip(b"\r").decode("utf-8", "replace")
+            self._buffer.clear()
+            event = self._line(line)
+            if event is not None:
+                events.append(event)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if not self._started:
+            self._started = True
+            if line.startswith(BOM):
+                line = line[1:]
+        # 最常见的情况：data: 后跟一个空格
+        if line.startswith("data: "):
+            self._data.append(line[6:])
+            return None
+        if line[0] == ":":
+            self.comments += 1
+            return None
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_id = value
+        elif field == "retry":
+            # 只接受 ASCII 数字，isdigit() 对“²”等 Unicode 数字也返回 True
+            if value.isascii() and value.isdigit():
+                self.retry = int(value)
+        # 其他字段按规范忽略
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        data = "\n".join(self._data)
+        self._data = []
+        event_type, self._event = self._event, ""
+        # 数据缓冲为空（没有 data 行，或只有一个空的 data 行）时按规范不分派事件
+        if not data:
+            return None
+        return SSEEvent(event_type or "message", data, self.last_id, self.retry)
+
+
+async def aiter_sse(chunks: AsyncIterator[bytes]) -> AsyncIterator[SSEEvent]:
+    """把字节块的异步迭代器（如 httpx 的 response.aiter_bytes()）解码为事件"""
+    decoder = SSEDecoder()
+    async for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
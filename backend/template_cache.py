@@ -0,0 +1,184 @@
+"""
+提示词模板编译缓存
+
+模板内容只解析一次，编译为由字面量和占位符组成的片段列表，按 (模板id, updated_at) 放入 LRU 缓存；
+占位符的解析结果再按 (模板, 项目, 资源版本, 选择文字) 缓存，重复渲染可以完全跳过数据库。
+模板和资源的变更通过会话事件在提交后失效对应的缓存。
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import PromptTemplate
+from resource_index import resource_index
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("PROMPT_TEMPLATE_CACHE_SIZE", "128"))
+RENDER_CACHE_SIZE = int(os.getenv("PROMPT_RENDER_CACHE_SIZE", "256"))
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(.*?)\s*\}\}')
+
+
+class Placeholder(NamedTuple):
+    keyword: str
+    raw: str  # 原始占位符文本，未解析时原样保留
+
+
+class CompiledTemplate(NamedTuple):
+    segments: Tuple[Union[str, Placeholder], ...]
+    variables: List[str]  # 去重后的关键词，保持出现顺序
+
+    @property
+    def has_placeholders(self) -> bool:
+        return bool(self.variables)
+
+    def render(self, values: dict) -> str:
+        return "".join(
+            seg if isinstance(seg, str) else values.get(seg.keyword, seg.raw)
+            for seg in self.segments
+        )
+
+
+def compile_template(content: str) -> CompiledTemplate:
+    """把模板内容切分为字面量和占位符片段"""
+    content = content or ""
+    if "{{" not in content:
+        return CompiledTemplate((content,), [])
+    segments = []
+    variables = {}
+    pos = 0
+    for match in PLACEHOLDER_PATTERN.finditer(content):
+        if match.start() > pos:
+            segments.append(content[pos:match.start()])
+        keyword = match.group(1).strip()
+        segments.append(Placeholder(keyword, match.group(0)))
+        variables.setdefault(keyword, None)
+        pos = match.end()
+    if pos < len(content):
+        segments.append(content[pos:])
+    return CompiledTemplate(tuple(segments), list(variables))
+
+
+def template_variables(content: str) -> dict:
+    """写入 PromptTemplate.variables 列的内容"""
+    return {"placeholders": compile_template(content).variables}
+
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedTemplate(NamedTuple):
+    id: int
+    updated_at: object
+    compiled: CompiledTemplate
+
+
+class TemplateCache:
+    """编译模板与占位符解析结果的两级缓存"""
+
+    def __init__(self, template_size: int = TEMPLATE_CACHE_SIZE, render_size: int = RENDER_CACHE_SIZE):
+        self._templates = _LRU(template_size)   # 模板id -> CachedTemplate
+        self._values = _LRU(render_size)      # 渲染键 -> {关键词: 替换内容}
+        # 每次失效递增，避免把失效前读到的旧模板放回缓存
+        self._generation = 0
+
+    def compiled(self, template: PromptTemplate, generation: Optional[int] = None) -> CachedTemplate:
+        """根据已加载的模板行取得编译结果"""
+        cached = self._templates.get(template.id)
+        if cached is None or cached.updated_at != template.updated_at:
+            cached = CachedTemplate(template.id, template.updated_at, compile_template(template.content))
+            if generation is None or generation == self._generation:
+                self._templates.put(template.id, cached)
+        return cached
+
+    def get(self, db: Session, template_id: int) -> Optional[CachedTemplate]:
+        """按模板id取得编译结果，命中缓存时不访问数据库"""
+        cached = self._templates.get(template_id)
+        if cached is not None:
+            return cached
+        generation = self._generation
+        template = db.query(PromptTemplate).filter(PromptTemplate.id == template_id).first()
+        if template is None:
+            return None
+        return self.compiled(template, generation)
+
+    def render_key(self, cached: CachedTemplate, project_id, selected_text) -> tuple:
+        text_hash = hashlib.sha1(selected_text.encode("utf-8")).hexdigest() if selected_text else None
+        return (
+            cached.id, cached.updated_at, project_id,
+            resource_index.version(project_id) if project_id else 0,
+            resource_index.global_version, text_hash,
+        )
+
+    def get_values(self, key) -> Optional[dict]:
+        return self._values.get(key)
+
+    def put_values(self, key, values: dict):
+        self._values.put(key, values)
+
+    def invalidate(self, template_id: Optional[int] = None):
+        self._generation += 1
+        if template_id is None:
+            self._templates.clear()
+            self._values.clear()
+            return
+        self._templates.discard_where(lambda k: k == template_id)
+        self._values.discard_where(lambda k: k[0] == template_id)
+
+
+template_cache = TemplateCache()
+
+
+# --- 模板变更后失效缓存 ---
+
+_PENDING_KEY = "template_cache_ids"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_template_ids(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, PromptTemplate) and obj.id is not None:
+            session.info.setdefault(_PENDING_KEY, set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_templates(session):
+    for template_id in session.info.pop(_PENDING_KEY, ()):
+        template_cache.invalidate(template_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_template_ids(session):
+    session.info.pop(_PENDING_KEY, None)
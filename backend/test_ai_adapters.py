@@ -0,0 +1,33 @@
+from ai_adapters import AdapterRegistry, detect_adapter
+from chat_service import ModelInfo
+
+
+def test_detect_adapter():
+    assert detect_adapter("glm-4.5", {"role": "assistant"}) == "glm"
+    assert detect_adapter("deepseek-reasoner", {"reasoning_content": "想"}) == "openai"
+    assert detect_adapter("x", {"reasoning": "想", "reasoning_content": "想"}) == "reasoning"
+    assert detect_adapter("x", {"thinking": "想"}) == "thinking"
+    assert detect_adapter("gpt-4o", {"content": "答"}) == "openai"
+    # 只有 role 的首个 delta 不足以判断
+    assert detect_adapter("gpt-4o", {"role": "assistant", "content": ""}) is None
+
+
+def test_adapter_resolved_once_per_model():
+    registry = AdapterRegistry()
+    model = ModelInfo(5, "m", "or-model", 0.7, 100, None)
+    assert registry.for_model(model) is None
+
+    adapter, resolved = registry.detect(model, {"role": "assistant"})
+    assert not resolved and registry.for_model(model) is None
+
+    adapter, resolved = registry.detect(model, {"reasoning": "想一想"})
+    assert resolved and adapter.parse({"reasoning": "想", "content": "答"}) == ("想", "答")
+    # 之后的请求直接使用缓存的适配器
+    assert registry.for_model(model) is adapter
+
+    # 固定的适配器优先
+    pinned = model._replace(adapter="thinking")
+    assert registry.for_model(pinned).name == "thinking"
+
+    registry.forget(5)
+    assert registry.for_model(model) is None
@@ -0,0 +1,29 @@
+import asyncio
+
+from ai_clients import AIClientRegistry
+
+
+def test_client_reused_until_invalidated():
+    registry = AIClientRegistry()
+
+    async def scenario():
+        async with registry.client(1, "https://api.example.com/") as first:
+            pass
+        async with registry.client(1, "https://api.example.com/") as second:
+            assert second is first
+            # 请求进行中时失效，客户端在请求结束后才关闭
+            registry.invalidate(1)
+            assert not second.is_closed
+        assert second.is_closed
+
+        async with registry.client(1, "https://api.example.com/") as third:
+            assert third is not first
+        # base_url 变化后旧客户端退役
+        async with registry.client(1, "https://other.example.com/") as fourth:
+            assert fourth is not third
+        await asyncio.sleep(0.01)
+        assert third.is_closed
+        await registry.aclose()
+        assert fourth.is_closed
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import io
+import json
+import logging
+import queue
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app_logging
+from app_logging import (
+    DroppingQueueHandler, JSONFormatter, RequestIdMiddleware, get_logger, new_request_id, request_id_var,
+    setup_logging, shutdown_logging,
+)
+
+
+def test_queue_handler_records_request_id_and_drops_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger("test_app_logging.queue")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        token = request_id_var.set("req-1")
+        logger.warning("第一条", extra={"fields": {"status": 429}})
+        logger.warning("第二条")
+        request_id_var.reset(token)
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.dropped == 1
+    record = handler.queue.get_nowait()
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["request_id"] == "req-1"
+    assert entry["message"] == "第一条"
+    assert entry["status"] == 429
+
+
+def test_debug_disabled_by_default():
+    # 提示词和请求体只在 DEBUG 级别输出，默认 INFO 下不会构造
+    assert not get_logger("chat").isEnabledFor(logging.DEBUG)
+
+
+def test_logs_after_shutdown_are_written_directly():
+    root = logging.getLogger(app_logging.ROOT_LOGGER)
+    buffer = io.StringIO()
+    previous = app_logging._stream_handler.setStream(buffer)
+    try:
+        get_logger("test").warning("关闭前")
+        shutdown_logging()
+        assert not any(isinstance(h, DroppingQueueHandler) for h in root.handlers)
+        get_logger("test").warning("关闭后")
+        assert "关闭前" in buffer.getvalue() and "关闭后" in buffer.getvalue()
+    finally:
+        setup_logging()
+        app_logging._stream_handler.setStream(previous)
+    assert [type(h) for h in root.handlers] == [DroppingQueueHandler]
+
+
+def test_middleware_propagates_request_id():
+    app = FastAPI()
+    app.add_middleware(RequestIdMiddleware)
+
+    @app.get("/id")
+    def current_id():
+        # 同步接口在线程池中运行，关联id随上下文传入
+        return {"request_id": request_id_var.get()}
+
+    client = TestClient(app)
+    response = client.get("/id", headers={"X-Request-ID": "abc123"})
+    assert response.json() == {"request_id": "abc123"}
+    assert response.headers["X-Request-ID"] == "abc123"
+
+    generated = client.get("/id")
+    assert generated.headers["X-Request-ID"] == generated.json()["request_id"] != "abc123"
+    assert new_request_id("x" * 100) == "x" * 64
@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+
+from ai_clients import ai_clients
+from rate_limiter import AI_RATE_MAX_RETRIES
+from chat_service import ChatContext, ModelInfo, ProviderInfo, call_ai, limited_stream, process_openai_url
+from key_pool import key_pools
+from rate_limiter import rate_limiters
+
+
+def _context(provider_id=99):
+    return ChatContext(
+        conversation_id=1,
+        provider=ProviderInfo(provider_id, "Mock", "https://mock.example.com", "sk-test", api_keys=(("sk-test", 1),)),
+        model=ModelInfo(1, "mock", "mock-model", 0.7, 256, None),
+        messages=[{"role": "user", "content": "你好"}],
+        temperature=0.7,
+        max_tokens=256,
+    )
+
+
+def _mock_transport(monkeypatch, handler, provider_id=99):
+    monkeypatch.setattr(
+        ai_clients, "_build_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    ai_clients.invalidate(provider_id)
+
+
+def test_process_openai_url():
+    assert process_openai_url("https://api.example.com") == "https://api.example.com/v1/chat/completions"
+    assert process_openai_url("https://api.example.com/v2/") == "https://api.example.com/v2/chat/completions"
+    assert process_openai_url("https://api.example.com/custom#") == "https://api.example.com/custom"
+
+
+def test_call_ai_is_async(monkeypatch):
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "回复"}}]})
+
+    _mock_transport(monkeypatch, handler)
+
+    async def scenario():
+        # 多个调用并发等待上游，总耗时接近单次
+        started = asyncio.get_running_loop().time()
+        replies = await asyncio.gather(*(call_ai(_context()) for _ in range(5)))
+        elapsed = asyncio.get_running_loop().time() - started
+        await ai_clients.aclose()
+        return replies, elapsed
+
+    replies, elapsed = asyncio.run(scenario())
+    assert replies == ["回复"] * 5
+    assert elapsed < 0.2
+    assert str(requests[0].url) == "https://mock.example.com/v1/chat/completions"
+    assert requests[0].headers["Authorization"] == "Bearer sk-test"
+
+
+def test_call_ai_error_status(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(429, text="slow down", headers={"Retry-After": "0"})
+
+    _mock_transport(monkeypatch, handler)
+
+    async def scenario():
+        reply = await call_ai(_context())
+        await ai_clients.aclose()
+        return reply
+
+    assert asyncio.run(scenario()) == "API请求频率超限。错误代码: 429"
+    # 429 按 Retry-After 重新排队后重试
+    assert len(calls) == 1 + AI_RATE_MAX_RETRIES
+
+
+def test_stream_429_waits_for_retry_after(monkeypatch):
+    sent = []
+
+    def handler(request):
+        sent.append(asyncio.get_running_loop().time())
+        return httpx.Response(429, text="slow down", headers={"Retry-After": "0.2"})
+
+    _mock_transport(monkeypatch, handler, provider_id=98)
+    ctx = _context(provider_id=98)
+
+    async def scenario():
+        events = [e async for e in limited_stream(ctx)]
+        await ai_clients.aclose()
+        return events
+
+    events = asyncio.run(scenario())
+    assert events[-1]["status"] == 429
+    assert len(sent) == 1 + AI_RATE_MAX_RETRIES
+    # 唯一的密钥冷却中，每次重试前按 Retry-After 暂停提供商
+    assert all(b - a >= 0.15 for a, b in zip(sent, sent[1:]))
+    assert rate_limiters.for_provider(ctx.provider).stats()["throttled_total"] == AI_RATE_MAX_RETRIES
+    assert [k["in_flight"] for k in key_pools.stats(98)] == [0]
@@ -0,0 +1,294 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ai_clients import ai_clients
+from database import Base
+from main import app, get_db
+from models import AIModel, AIProvider, Message
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # 使用带连接池的文件数据库，以便检查流式生成期间占用的连接数
+    engine = create_engine(f"sqlite:///{tmp_path / 'stream.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def client(engine):
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = TestingSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    yield TestClient(app)
+    if previous is None:
+        app.dependency_overrides.pop(get_db, None)
+    else:
+        app.dependency_overrides[get_db] = previous
+
+
+@pytest.fixture
+def model_id(engine):
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        provider = AIProvider(name="Mock", base_url="https://mock.example.com", api_key="sk-test")
+        db.add(provider)
+        db.commit()
+        model = AIModel(provider_id=provider.id, name="mock", model_identifier="mock-model", temperature=0.7, max_tokens=256)
+        db.add(model)
+        db.commit()
+        return model.id
+
+
+def mock_upstream(monkeypatch, handler):
+    monkeypatch.setattr(
+        ai_clients, "_build_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    with ai_clients._lock:
+        ai_clients._handles.clear()
+
+
+def sse_events(text):
+    return [json.loads(line[6:]) for line in text.splitlines() if line.startswith("data: ")]
+
+
+def test_stream_holds_no_connection(monkeypatch, engine, client, model_id):
+    checked_out = []
+
+    async def chunks():
+        for piece in ["你", "好"]:
+            # 生成期间请求的会话不应占用连接
+            checked_out.append(engine.pool.checkedout())
+            data = {"choices": [{"delta": {"content": piece}}]}
+            yield f"data: {json.dumps(data)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    mock_upstream(monkeypatch, lambda request: httpx.Response(200, content=chunks()))
+
+    response = client.post("/api/chat/stream", json={"message": "你好", "ai_model_id": model_id})
+    events = sse_events(response.text)
+    assert [e["type"] for e in events] == ["conversation_id", "content", "content", "done"]
+    assert events[-1]["cached"] is False
+    assert checked_out == [0, 0]
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        messages = db.query(Message).filter(Message.conversation_id == events[0]["conversation_id"]).order_by(Message.id).all()
+        assert [(m.role, m.content) for m in messages] == [("user", "你好"), ("assistant", "你好")]
+    assert engine.pool.checkedout() == 0
+
+
+def test_stream_error_is_saved(monkeypatch, engine, client, model_id):
+    mock_upstream(monkeypatch, lambda request: httpx.Response(500, text="boom"))
+
+    response = client.post("/api/chat/stream", json={"message": "你好", "ai_model_id": model_id})
+    events = sse_events(response.text)
+    assert events[-1]["type"] == "error"
+    assert events[-1]["message"] == "AI服务调用失败。状态码: 500, 详情: boom"
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        reply = db.query(Message).filter(Message.role == "assistant").one()
+        assert reply.content.startswith("AI服务调用失败")
+
+
+def test_cached_reply_is_replayed(monkeypatch, client, model_id):
+    from response_cache import response_cache
+    monkeypatch.setattr(response_cache, "policy", "request")
+    response_cache.clear()
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        data = {"choices": [{"delta": {"content": "缓存的回复"}}]}
+        return httpx.Response(200, content=f"data: {json.dumps(data)}\n\ndata: [DONE]\n\n".encode())
+
+    mock_upstream(monkeypatch, handler)
+    body = {"message": "润色", "ai_model_id": model_id, "use_cache": True}
+    first = sse_events(client.post("/api/chat/stream", json=body).text)
+    second = sse_events(client.post("/api/chat/stream", json=body).text)
+    assert len(calls) == 1
+    assert [e for e in second if e["type"] == "content"] == [e for e in first if e["type"] == "content"]
+    assert second[-1] == {"type": "done", "cached": True}
+
+    # 非流式接口共用同一缓存
+    reply = client.post("/api/chat", json=body).json()
+    assert reply["reply"] == "缓存的回复" and reply["cached"] is True
+    assert len(calls) == 1
+
+    # 未要求缓存时照常调用AI
+    client.post("/api/chat/stream", json={"message": "润色", "ai_model_id": model_id})
+    assert len(calls) == 2
+    response_cache.clear()
+
+
+def test_disconnect_cancels_upstream_and_saves_truncated(monkeypatch, engine, model_id):
+    import asyncio
+    from chat_service import prepare_chat, generate_chat_stream
+    from chat_streams import chat_streams
+    from generations import generations
+    from main import ChatRequest
+    from models import MESSAGE_TRUNCATED
+
+    closed = []
+
+    async def chunks():
+        try:
+            data = {"choices": [{"delta": {"content": "写到一半"}}]}
+            yield f"data: {json.dumps(data)}\n\n".encode()
+            await asyncio.sleep(30)
+        finally:
+            closed.append(True)
+
+    mock_upstream(monkeypatch, lambda request: httpx.Response(200, content=chunks()))
+    # 默认配置：不等待续传
+    assert chat_streams.grace == 0
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        ctx = prepare_chat(db, ChatRequest(message="续写", ai_model_id=model_id))
+    cancelled_before = generations.stats()["cancelled"]
+
+    async def scenario():
+        stream = generate_chat_stream(ctx, engine)
+        await stream.__anext__()  # conversation_id
+        assert sse_events(await stream.__anext__())[0]["content"] == "写到一半"
+        # 客户端断开，上游请求立即关闭，不等待续传
+        await stream.aclose()
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            if closed:
+                break
+
+    asyncio.run(scenario())
+    assert closed
+    assert generations.stats()["cancelled"] == cancelled_before + 1
+    assert generations.stats()["tokens_saved"] > 0
+
+    with Session() as db:
+        reply = db.query(Message).filter(Message.role == "assistant").one()
+        assert (reply.content, reply.status) == ("写到一半", MESSAGE_TRUNCATED)
+
+
+def test_resume_after_disconnect_and_checkpoints(monkeypatch, engine, model_id):
+    import asyncio
+    import chat_service
+    from chat_service import prepare_chat, generate_chat_stream
+    from chat_streams import chat_streams
+    from main import ChatRequest
+    from models import MESSAGE_COMPLETE, MESSAGE_STREAMING
+
+    gate = asyncio.Event()
+    statuses = []
+
+    async def chunks():
+        for piece in "一二三四":
+            data = {"choices": [{"delta": {"content": piece}}]}
+            yield f"data: {json.dumps(data)}\n\n".encode()
+            if piece == "二":
+                await gate.wait()
+        yield b"data: [DONE]\n\n"
+
+    mock_upstream(monkeypatch, lambda request: httpx.Response(200, content=chunks()))
+    monkeypatch.setattr(chat_streams, "grace", 5)
+    monkeypatch.setattr(chat_service, "AI_STREAM_CHECKPOINT_CHUNKS", 2)
+    # 按事件编号断言，不合并帧
+    monkeypatch.setattr(chat_service, "AI_SSE_COALESCE_MS", 0)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        ctx = prepare_chat(db, ChatRequest(message="续写", ai_model_id=model_id))
+
+    def saved():
+        with Session() as db:
+            reply = db.query(Message).filter(Message.role == "assistant").one_or_none()
+            return reply and (reply.content, reply.status)
+
+    async def scenario():
+        stream = generate_chat_stream(ctx, engine, resumable=True)
+        frames = [await stream.__anext__() for _ in range(3)]
+        assert [f.split("\n")[0] for f in frames] == ["id: 1", "id: 2", "id: 3"]
+        # 每两个事件保存一次
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if saved():
+                break
+        statuses.append(saved())
+        # 断线后上游继续生成
+        await stream.aclose()
+        gate.set()
+        resumed = chat_streams.get(ctx.conversation_id)
+        return [f async for f in chat_service.follow_chat_stream(resumed, last_event_id=3)]
+
+    frames = asyncio.run(scenario())
+    assert frames[0].startswith("id: 4\n")
+    events = sse_events("".join(frames))
+    assert [e.get("content") for e in events] == ["三", "四", None]
+    assert events[-1]["type"] == "done"
+    assert statuses == [("一二", MESSAGE_STREAMING)]
+    assert saved() == ("一二三四", MESSAGE_COMPLETE)
+
+
+def test_partial_reply_kept_on_mid_stream_failure(monkeypatch, engine, model_id):
+    import asyncio
+    import chat_service
+    from chat_service import prepare_chat, generate_chat_stream
+    from main import ChatRequest
+    from models import MESSAGE_TRUNCATED
+
+    async def chunks():
+        for piece in ["第一段", "第二段"]:
+            data = {"choices": [{"delta": {"content": piece}}]}
+            yield f"data: {json.dumps(data)}\n\n".encode()
+        raise httpx.ReadError("连接中断")
+
+    mock_upstream(monkeypatch, lambda request: httpx.Response(200, content=chunks()))
+    monkeypatch.setattr(chat_service, "AI_STREAM_CHECKPOINT_CHUNKS", 1)
+    Session = sessionmaker(bind=engine)
+
+    def run_chat(message):
+        with Session() as db:
+            ctx = prepare_chat(db, ChatRequest(message=message, ai_model_id=model_id))
+
+        async def scenario():
+            events = sse_events("".join([frame async for frame in generate_chat_stream(ctx, engine)]))
+            await asyncio.sleep(0.05)
+            return events
+
+        events = asyncio.run(scenario())
+        with Session() as db:
+            reply = db.query(Message).filter(
+                Message.conversation_id == ctx.conversation_id, Message.role == "assistant"
+            ).one()
+            return events, reply.content, reply.status
+
+    # 上游中途出错：检查点保存的内容保留，附上错误信息
+    events, content, status = run_chat("续写")
+    assert events[-1]["type"] == "error"
+    assert content.startswith("第一段第二段\n\n") and status == MESSAGE_TRUNCATED
+
+    # 生成过程本身出错：已保存的部分标记为截断，不会停留在 streaming
+    async def broken_cache(*args):
+        raise RuntimeError("缓存写入失败")
+
+    monkeypatch.setattr(chat_service, "store_cached_reply", broken_cache)
+    # 中文按 JSON 转义（\uXXXX）发送，与 json.dumps 的默认输出一致
+    mock_upstream(monkeypatch, lambda request: httpx.Response(
+        200, content=b'data: {"choices": [{"delta": {"content": "\\u5b8c\\u6574"}}]}\n\ndata: [DONE]\n\n'
+    ))
+    events, content, status = run_chat("再写")
+    assert events[-1]["type"] == "error"
+    assert (content, status) == ("完整", MESSAGE_TRUNCATED)
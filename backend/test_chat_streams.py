@@ -0,0 +1,122 @@
+import asyncio
+
+from chat_streams import ChatStream, ChatStreamRegistry
+
+
+def collect(stream, last_event_id=0):
+    async def run():
+        return [item async for item in stream.follow(last_event_id)]
+    return run()
+
+
+def test_resume_replays_buffer_and_merges_evicted_content():
+    async def scenario():
+        stream = ChatStream(7, max_events=3, grace=0)
+        stream.publish({"type": "conversation_id", "conversation_id": 7})
+        for piece in ["一", "二", "三", "四", "五"]:
+            stream.publish({"type": "content", "content": piece})
+        stream.finished = True
+
+        # 缓冲区内的断点：原样重放
+        assert [i for i, _ in await collect(stream, 4)] == [5, 6]
+
+        # 断点早于缓冲区：补发合并后的内容，不重复
+        items = await collect(stream, 2)
+        assert items[0] == (3, {"type": "content", "content": "二"})
+        assert "".join(e["content"] for _, e in items) == "二三四五"
+
+        # 从头续传（页面重新加载）：先收到对话ID
+        items = await collect(stream)
+        assert items[0][1]["type"] == "conversation_id"
+        assert "".join(e.get("content", "") for _, e in items) == "一二三四五"
+
+    asyncio.run(scenario())
+
+
+def test_generation_waits_for_resume_before_cancelling():
+    registry = ChatStreamRegistry(grace=0.05)
+    cancelled = []
+
+    async def scenario():
+        async def source():
+            try:
+                yield {"type": "content", "content": "一"}
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        stream = registry.start(1, source, resumable=True)
+        follower = stream.follow()
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.sleep(0.01)
+        # 宽限期内重新连接，生成继续
+        assert not cancelled and registry.get(1) is stream
+        resumed = stream.follow(1)
+        task = asyncio.ensure_future(resumed.__anext__())
+        await asyncio.sleep(0.1)
+        assert not cancelled
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await resumed.aclose()
+        await asyncio.sleep(0.1)
+        assert cancelled and stream.finished
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_without_resume_cancels_immediately():
+    # 配置了宽限期，但客户端没有选择续传
+    registry = ChatStreamRegistry(grace=5)
+    cancelled = []
+
+    async def scenario():
+        async def source():
+            try:
+                yield {"type": "content", "content": "一"}
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        stream = registry.start(2, source)
+        follower = stream.follow()
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert cancelled and stream.finished
+
+    asyncio.run(scenario())
+
+
+def test_coalescing_merges_consecutive_text_events():
+    async def scenario():
+        stream = ChatStream(3, grace=0)
+        stream.publish({"type": "conversation_id", "conversation_id": 3})
+        for piece in ["一", "二"]:
+            stream.publish({"type": "thinking", "content": piece})
+        for piece in ["三", "四", "五"]:
+            stream.publish({"type": "content", "content": piece})
+        stream.publish({"type": "done"})
+        stream.finished = True
+
+        items = [item async for item in stream.follow(0, window=0.05, max_chars=2)]
+        assert items == [
+            (1, {"type": "conversation_id", "conversation_id": 3}),
+            (3, {"type": "thinking", "content": "一二"}),
+            (5, {"type": "content", "content": "三四"}),
+            (6, {"type": "content", "content": "五"}),
+            (7, {"type": "done"}),
+        ]
+
+        # 窗口到期时发出已合并的内容，不等待生成结束
+        live = ChatStream(4, grace=0)
+        follower = live.follow(0, window=0.02)
+        live.publish({"type": "content", "content": "甲"})
+        live.publish({"type": "content", "content": "乙"})
+        assert await asyncio.wait_for(follower.__anext__(), 1) == (2, {"type": "content", "content": "甲乙"})
+        await follower.aclose()
+
+    asyncio.run(scenario())
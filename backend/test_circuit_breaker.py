@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+
+import circuit_breaker
+from ai_clients import ai_clients
+from chat_service import ChatContext, ModelInfo, ProviderInfo, call_ai, resilient_stream
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN, backoff_delay, is_retryable
+
+
+def test_retryable_statuses():
+    assert is_retryable(None) and is_retryable(502)
+    assert not is_retryable(401) and not is_retryable(429)
+    assert all(0 <= backoff_delay(i) <= circuit_breaker.AI_RETRY_MAX_DELAY for i in range(10))
+
+
+def test_breaker_opens_and_recovers(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "AI_BREAKER_FAILURES", 2)
+    breaker = CircuitBreaker(1)
+    breaker.cooldown = 0
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    # 冷却结束且没有探测任务时进入半开，只放行一个试探请求
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_call_ai_retries_then_fails_fast(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "AI_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(circuit_breaker, "AI_RETRY_BASE_DELAY", 0)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502, text="bad gateway")
+
+    monkeypatch.setattr(
+        ai_clients, "_build_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    provider = ProviderInfo(77, "Down", "https://down.example.com", "sk-x", api_keys=(("sk-x", 1),))
+    ctx = ChatContext(
+        conversation_id=1, provider=provider, model=ModelInfo(1, "m", "m", 0.7, 100, None),
+        messages=[{"role": "user", "content": "你好"}],
+    )
+
+    async def scenario():
+        first = await call_ai(ctx)
+        second = await call_ai(ctx)
+        await ai_clients.aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    # 首次调用：1 次 + 2 次重试，第 3 次失败后熔断
+    assert first.startswith("AI服务调用失败。状态码: 502")
+    assert len(calls) == 3
+    # 熔断期间直接失败，不再请求上游
+    assert "熔断" in second
+    assert len(calls) == 3
+    circuit_breaker.circuit_breakers.reset(77)
+
+
+def test_cancelled_trial_releases_half_open_slot(monkeypatch):
+    async def slow_chunks():
+        await asyncio.sleep(10)
+        yield b"data: [DONE]\n\n"
+
+    monkeypatch.setattr(
+        ai_clients, "_build_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=slow_chunks()))),
+    )
+    provider = ProviderInfo(78, "Flaky", "https://flaky.example.com", "sk-x", api_keys=(("sk-x", 1),))
+    ctx = ChatContext(
+        conversation_id=1, provider=provider, model=ModelInfo(1, "m", "m", 0.7, 100, None),
+        messages=[{"role": "user", "content": "你好"}],
+    )
+    breaker = circuit_breaker.circuit_breakers.for_provider(78)
+    breaker.state = HALF_OPEN
+
+    async def scenario():
+        # 试探请求在首个Token之前被取消（客户端断开、对冲落败）
+        task = asyncio.ensure_future(resilient_stream(ctx).__anext__())
+        await asyncio.sleep(0.05)
+        assert not breaker.allow()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await ai_clients.aclose()
+
+    asyncio.run(scenario())
+    # 名额已释放，下一个请求可以继续试探
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    circuit_breaker.circuit_breakers.reset(78)
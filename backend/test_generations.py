@@ -0,0 +1,61 @@
+import asyncio
+
+from generations import GenerationRegistry
+
+
+def test_identical_requests_share_one_generation():
+    registry = GenerationRegistry(enabled=True)
+    started = []
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def source():
+            started.append(1)
+            yield {"type": "content", "content": "一"}
+            await gate.wait()
+            yield {"type": "content", "content": "二"}
+
+        first, joined = registry.join_or_start("k", source)
+        assert not joined
+        first_events = first.follow()
+        assert (await first_events.__anext__())["content"] == "一"
+
+        # 后到的请求先收到已产生的事件
+        second, joined = registry.join_or_start("k", source)
+        assert joined and second is first
+        late = second.follow()
+        assert (await late.__anext__())["content"] == "一"
+
+        gate.set()
+        rest_first = [e async for e in first_events]
+        rest_late = [e async for e in late]
+        assert rest_first == rest_late == [{"type": "content", "content": "二"}]
+        assert registry.stats()["active"] == 0
+
+    asyncio.run(scenario())
+    assert started == [1]
+    assert registry.stats()["joined"] == 1
+
+
+def test_upstream_cancelled_when_all_subscribers_leave():
+    registry = GenerationRegistry(enabled=True)
+    closed = []
+
+    async def scenario():
+        async def source():
+            try:
+                yield {"type": "content", "content": "一"}
+                await asyncio.sleep(10)
+            finally:
+                closed.append(True)
+
+        generation, _ = registry.join_or_start("k", source)
+        events = generation.follow()
+        await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.01)
+        assert generation.finished
+
+    asyncio.run(scenario())
+    assert closed == [True]
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from hedging import TTFTHistogram, hedged_stream
+
+
+def _candidate(name, first_delay, error=False):
+    return SimpleNamespace(name=name, first_delay=first_delay, error=error, provider=SimpleNamespace(id=name, name=name))
+
+
+def _run(candidates, delay=0.05):
+    started, closed = [], []
+
+    async def stream_fn(ctx):
+        started.append(ctx.name)
+        try:
+            await asyncio.sleep(ctx.first_delay)
+            if ctx.error:
+                yield {"type": "error", "message": f"{ctx.name} 失败"}
+                return
+            for i in range(2):
+                yield {"type": "content", "content": f"{ctx.name}{i}"}
+        finally:
+            closed.append(ctx.name)
+
+    async def scenario():
+        return [e async for e in hedged_stream(candidates, stream_fn, lambda ctx: delay)]
+
+    return asyncio.run(scenario()), started, closed
+
+
+def test_histogram_quantile():
+    histogram = TTFTHistogram()
+    for _ in range(90):
+        histogram.record(0.1)
+    for _ in range(10):
+        histogram.record(5)
+    assert histogram.quantile(0.5) < 0.2
+    assert histogram.quantile(0.99) >= 5
+
+
+def test_fast_primary_is_not_hedged():
+    events, started, _ = _run([_candidate("主", 0), _candidate("备", 0)])
+    assert [e["content"] for e in events] == ["主0", "主1"]
+    assert started == ["主"]
+
+
+def test_slow_primary_loses_to_hedge():
+    events, started, closed = _run([_candidate("主", 1), _candidate("备", 0)])
+    assert [e["content"] for e in events] == ["备0", "备1"]
+    assert started == ["主", "备"]
+    assert "主" in closed  # 落败的请求被取消
+
+
+def test_error_before_first_token_falls_back():
+    events, started, _ = _run([_candidate("主", 0, error=True), _candidate("备", 0)], delay=10)
+    assert [e["content"] for e in events] == ["备0", "备1"]
+
+
+def test_all_candidates_fail():
+    events, _, _ = _run([_candidate("主", 0, error=True), _candidate("备", 0, error=True)])
+    assert events == [{"type": "error", "message": "备 失败"}]
@@ -0,0 +1,58 @@
+from collections import Counter
+
+from key_pool import KeyPoolRegistry, ProviderKeyPool, mask_key, provider_keys
+
+
+def test_provider_keys_merges_and_dedupes():
+    assert provider_keys("sk-a", ["sk-b", {"key": "sk-c", "weight": 3}, "sk-a", ""]) == [
+        ("sk-a", 1), ("sk-b", 1), ("sk-c", 3),
+    ]
+
+
+def test_weighted_round_robin():
+    pool = ProviderKeyPool([("a", 1), ("b", 3)], strategy="weighted_round_robin")
+    picks = []
+    for _ in range(8):
+        state = pool.acquire()
+        picks.append(state.key)
+        pool.release(state, 200)
+    assert Counter(picks) == {"a": 2, "b": 6}
+    assert picks[:4] != ["b", "b", "b", "a"]  # 平滑：不会连续集中到同一密钥
+
+
+def test_least_in_flight():
+    pool = ProviderKeyPool([("a", 1), ("b", 1)])
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.key, second.key} == {"a", "b"}
+    pool.release(first, 200)
+    assert pool.acquire().key == first.key
+
+
+def test_failed_keys_cool_down():
+    pool = ProviderKeyPool([("sk-aaaaaaaaaaaa", 1), ("sk-bbbbbbbbbbbb", 1)])
+    bad = pool.acquire()
+    pool.release(bad, 401)
+    state = pool.acquire()
+    assert state is not bad
+    pool.release(state, 429, retry_after=30)
+    # 两个密钥都在冷却：选最早恢复的（429 的 30 秒早于 401 的冷却时间）
+    assert pool.acquire() is state
+    stats = pool.stats()
+    assert stats[0]["auth_errors"] + stats[1]["auth_errors"] == 1
+    assert all("aaaaaaaa" not in s["key"] for s in stats)
+    assert mask_key("sk-abcdefghijkl") == "****ijkl"
+
+
+def test_registry_keeps_counters_for_unchanged_keys():
+    registry = KeyPoolRegistry()
+
+    class Provider:
+        id = 1
+        api_keys = (("sk-first-key-1", 1),)
+
+    state = registry.for_provider(Provider).acquire()
+    registry.for_provider(Provider).release(state, 200)
+    Provider.api_keys = (("sk-first-key-1", 1), ("sk-second-key", 1))
+    stats = registry.for_provider(Provider).stats()
+    assert [s["successes"] for s in stats] == [1, 0]
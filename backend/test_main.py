@@ -1,12 +1,12 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from main import app, get_db
 from database import Base
-from models import Project, AIProvider, AIModel
+from models import Project, Volume, Chapter, AIProvider, AIModel, Conversation, Message
 
 # 创建测试数据库
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -67,6 +67,134 @@ def test_get_projects():
     projects = response.json()
     assert isinstance(projects, list)
 
+def test_get_projects_counts_chapters(db_session):
+    """项目列表的章节数和字数由聚合查询得出"""
+    project = Project(title="统计项目", genre="科幻")
+    empty = Project(title="空项目", genre="科幻")
+    db_session.add_all([project, empty])
+    db_session.commit()
+    db_session.add_all([
+        Chapter(project_id=project.id, title="一", content="x", word_count=100),
+        Chapter(project_id=project.id, title="二", content="y", word_count=None),
+        Chapter(project_id=project.id, title="三", content="z", word_count=23),
+    ])
+    db_session.commit()
+
+    projects = {p["id"]: p for p in client.get("/api/projects").json()}
+    assert projects[project.id]["chapter_count"] == 3
+    assert projects[project.id]["word_count"] == 123
+    assert projects[empty.id]["chapter_count"] == 0
+    assert projects[empty.id]["word_count"] == 0
+
+def test_project_stats_endpoint():
+    """章节字数按正文去掉HTML后统计，统计接口读取维护的计数"""
+    project = client.post("/api/projects", json={"title": "统计接口", "genre": "科幻"}).json()
+    volume = client.post(f"/api/projects/{project['id']}/volumes",
+                         json={"title": "第一卷", "project_id": project["id"]}).json()
+    chapter = client.post(f"/api/volumes/{volume['id']}/chapters",
+                          json={"title": "第一章", "content": "<p>十个字的章节正文内容</p>", "word_count": 999}).json()
+    assert chapter["word_count"] == 10
+
+    stats = client.get(f"/api/projects/{project['id']}/stats").json()
+    assert (stats["chapter_count"], stats["word_count"]) == (1, 10)
+    assert stats["last_edited_chapter"]["id"] == chapter["id"]
+    assert stats["volumes"][0]["chapter_count"] == 1
+
+    client.delete(f"/api/volumes/{volume['id']}")
+    stats = client.get(f"/api/projects/{project['id']}/stats").json()
+    assert (stats["chapter_count"], stats["word_count"], stats["last_edited_chapter"]) == (0, 0, None)
+
+def test_chapter_outline_skips_content():
+    """大纲模式不读取正文，正文通过单个或批量获取"""
+    project = client.post("/api/projects", json={"title": "大纲", "genre": "科幻"}).json()
+    volume = client.post(f"/api/projects/{project['id']}/volumes",
+                         json={"title": "第一卷", "project_id": project["id"]}).json()
+    ids = [
+        client.post(f"/api/volumes/{volume['id']}/chapters",
+                    json={"title": f"第{i}章", "content": "正文" * 10, "order": 2 - i}).json()["id"]
+        for i in range(2)
+    ]
+
+    outline = client.get(f"/api/volumes/{volume['id']}/chapters", params={"outline": True}).json()
+    assert [c["id"] for c in outline] == ids[::-1]
+    assert all("content" not in c for c in outline)
+    assert client.get(f"/api/volumes/{volume['id']}/chapters").json()[0]["content"] == "正文" * 10
+
+    chapters = client.get("/api/chapters", params={"ids": [ids[1], ids[0], 999999]}).json()
+    assert [c["id"] for c in chapters] == [ids[1], ids[0]]
+    assert chapters[0]["content"] == "正文" * 10
+
+    tree = client.get(f"/api/projects/{project['id']}/outline").json()
+    assert tree["volumes"][0]["chapter_count"] == 2
+    assert [c["title"] for c in tree["volumes"][0]["chapters"]] == ["第1章", "第0章"]
+    assert client.get("/api/projects/999999/outline").status_code == 404
+
+def test_keyset_pagination(db_session):
+    """带 limit 时按游标翻页，下一页游标在响应头中；不带时返回全部"""
+    import datetime
+    same_time = datetime.datetime(2024, 1, 1)
+    conversation = Conversation(title="分页")
+    db_session.add_all([conversation, Conversation(title="分页2")])
+    db_session.commit()
+    # 创建时间相同的消息按 id 排序，不会漏掉或重复
+    db_session.add_all([
+        Message(conversation_id=conversation.id, role="user", content=str(i), created_at=same_time)
+        for i in range(5)
+    ])
+    db_session.commit()
+
+    url = f"/api/conversations/{conversation.id}/messages"
+    assert [m["content"] for m in client.get(url).json()] == ["0", "1", "2", "3", "4"]
+
+    pages, cursor = [], None
+    while True:
+        response = client.get(url, params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        pages.append([m["content"] for m in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == [["0", "1"], ["2", "3"], ["4"]]
+
+    everything = [c["id"] for c in client.get("/api/conversations").json()]
+    first = client.get("/api/conversations", params={"limit": 1})
+    assert [c["id"] for c in first.json()] == everything[:1]
+    assert first.json()[0]["messages"] == []
+    second = client.get("/api/conversations", params={"limit": 100, "cursor": first.headers["X-Next-Cursor"]})
+    assert [c["id"] for c in second.json()] == everything[1:]
+
+    assert client.get(url, params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get(url, params={"limit": 0}).status_code == 422
+
+def test_keyset_pagination_with_null_order(db_session):
+    """排序列为空的行按 0 排序，翻页时不会丢失"""
+    project = Project(title="空排序", genre="科幻")
+    db_session.add(project)
+    db_session.commit()
+    volume = Volume(project_id=project.id, title="第一卷")
+    db_session.add(volume)
+    db_session.commit()
+    db_session.add_all([
+        Chapter(project_id=project.id, volume_id=volume.id, title=title, content="", order=order)
+        for title, order in [("甲", 0), ("乙", 1), ("丙", 0), ("丁", -1), ("戊", 0)]
+    ])
+    db_session.commit()
+    # ORM 插入时会补上默认值，旧数据中的 NULL 直接用 UPDATE 写入
+    db_session.execute(
+        update(Chapter).where(Chapter.volume_id == volume.id, Chapter.title.in_(["甲", "丙"])).values(order=None)
+    )
+    db_session.commit()
+
+    url = f"/api/volumes/{volume.id}/chapters"
+    pages, cursor = [], None
+    while True:
+        response = client.get(url, params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        pages.extend(c["title"] for c in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == ["丁", "甲", "丙", "戊", "乙"]
+    assert [c["title"] for c in client.get(url).json()] == pages
+
 def test_create_ai_provider():
     """测试创建AI提供商"""
     provider_data = {
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import novel_import
+from main import app
+from test_novel_parser import make_epub
+
+client = TestClient(app)
+
+
+def novel(title, volumes=2, chapters=3):
+    return {
+        "title": title,
+        "genre": "玄幻",
+        "volumes": [
+            {"title": f"第{v + 1}卷", "order": v, "chapters": [
+                {"title": f"第{c + 1}章", "content": "<p>正文内容</p>", "order": c} for c in range(chapters)
+            ]}
+            for v in range(volumes)
+        ],
+    }
+
+
+def test_import_in_batches_with_stats(monkeypatch):
+    monkeypatch.setattr(novel_import, "IMPORT_BATCH_SIZE", 2)
+    project = client.post("/api/projects/import", json=novel("批量导入")).json()
+    assert (project["chapter_count"], project["word_count"]) == (6, 24)
+
+    outline = client.get(f"/api/projects/{project['id']}/outline").json()
+    assert [v["chapter_count"] for v in outline["volumes"]] == [3, 3]
+    assert [c["title"] for c in outline["volumes"][1]["chapters"]] == ["第1章", "第2章", "第3章"]
+    stats = client.get(f"/api/projects/{project['id']}/stats").json()
+    assert stats["last_edited_chapter"]["id"] == outline["volumes"][1]["chapters"][-1]["id"]
+
+
+def test_import_progress_stream(monkeypatch):
+    monkeypatch.setattr(novel_import, "IMPORT_BATCH_SIZE", 4)
+    response = client.post("/api/projects/import", params={"progress": True}, json=novel("进度导入"))
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[:-1] == [{"imported": 4, "total": 6}, {"imported": 6, "total": 6}]
+    assert lines[-1]["project"]["chapter_count"] == 6
+
+
+def test_failed_import_leaves_nothing(monkeypatch):
+    def fail(self):
+        raise RuntimeError("磁盘已满")
+
+    monkeypatch.setattr(novel_import.NovelImporter, "finish", fail)
+    with pytest.raises(RuntimeError):
+        client.post("/api/projects/import", json=novel("失败导入"))
+    titles = [p["title"] for p in client.get("/api/projects").json()]
+    assert "失败导入" not in titles
+
+
+def test_upload_txt(monkeypatch):
+    monkeypatch.setattr(novel_import, "IMPORT_BATCH_SIZE", 2)
+    text = "简介\n第一章 开端\n正文一\n第二章\n正文二\n第二卷 新篇\n第三章\n正文三\n"
+    response = client.post(
+        "/api/projects/import/upload",
+        files={"file": ("上传测试.txt", text.encode("gbk"), "text/plain")},
+        data={"genre": "玄幻"},
+    )
+    project = response.json()
+    assert project["title"] == "上传测试"
+    assert project["chapter_count"] == 4
+
+    outline = client.get(f"/api/projects/{project['id']}/outline").json()
+    assert [(v["title"], [c["title"] for c in v["chapters"]]) for v in outline["volumes"]] == [
+        ("正文", ["前言", "第一章 开端", "第二章"]),
+        ("第二卷 新篇", ["第三章"]),
+    ]
+
+
+def test_upload_progress_and_bad_epub():
+    response = client.post(
+        "/api/projects/import/upload", params={"progress": True},
+        files={"file": ("进度.txt", "第一章\n内容\n".encode(), "text/plain")},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1]["project"]["chapter_count"] == 1
+
+    response = client.post("/api/projects/import/upload", files={"file": ("坏文件.epub", b"PK\x03\x04x")})
+    assert response.status_code == 400
+
+
+def test_upload_epub():
+    epub = make_epub([("第二章 重逢", "再见"), ("第一章 相遇", "你好")])
+    response = client.post(
+        "/api/projects/import/upload", files={"file": ("书.epub", epub.read(), "application/epub+zip")},
+    )
+    assert response.status_code == 200
+    project = response.json()
+    assert (project["title"], project["chapter_count"]) == ("书", 2)
+
+    outline = client.get(f"/api/projects/{project['id']}/outline").json()
+    assert [c["title"] for c in outline["volumes"][0]["chapters"]] == ["第一章 相遇", "第二章 重逢"]
@@ -0,0 +1,117 @@
+import io
+import zipfile
+
+import pytest
+
+from novel_parser import ChapterSplitter, NovelParseError, detect_encoding, iter_lines, iter_text, parse_novel
+
+NOVEL = """书名：测试之书
+第一卷 风起
+第一章 开端
+　　天色已晚，他推门而入。
+第二章初见
+内容二
+第二卷
+第三章
+内容三 <b>
+番外：后日谈
+"""
+
+
+@pytest.mark.parametrize("encoding, expected", [
+    ("utf-8", "utf-8"), ("gbk", "gb18030"), ("utf-8-sig", "utf-8-sig"), ("utf-16", "utf-16"),
+])
+def test_detect_encoding(encoding, expected):
+    assert detect_encoding(NOVEL.encode(encoding)) == expected
+
+
+def test_detect_big5():
+    text = "第一章 天下大勢\n話說天下大勢，分久必合，合久必分。周末七國分爭，并入於秦。"
+    assert detect_encoding(text.encode("big5")) == "big5"
+    assert detect_encoding(text.encode("gb18030")) == "gb18030"
+
+
+def test_lines_split_across_chunks():
+    # 每次只读 3 个字节：多字节字符和行都会被切开
+    data = io.BytesIO(NOVEL.encode("gbk"))
+    assert list(iter_lines(iter_text(data, chunk_size=3))) == NOVEL.splitlines()
+
+
+def test_split_volumes_and_chapters():
+    events = list(parse_novel(io.BytesIO(NOVEL.encode("gb18030"))))
+    assert [(kind, title) for kind, title, _ in events] == [
+        ("chapter", "前言"),
+        ("volume", "第一卷 风起"),
+        ("chapter", "第一章 开端"),
+        ("chapter", "第二章初见"),
+        ("volume", "第二卷"),
+        ("chapter", "第三章"),
+        ("chapter", "番外：后日谈"),
+    ]
+    assert events[2][2] == "<p>天色已晚，他推门而入。</p>"
+    assert events[5][2] == "<p>内容三 &lt;b&gt;</p>"
+
+
+def test_long_chapter_is_split():
+    splitter = ChapterSplitter(max_chars=10)
+    events = list(splitter.feed("第一章"))
+    for _ in range(5):
+        events += splitter.feed("一二三四五")
+    events += splitter.close()
+    assert [title for _, title, _ in events] == ["第一章", "第一章（续1）", "第一章（续2）"]
+
+
+def make_epub(chapters):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as book:
+        book.writestr("mimetype", "application/epub+zip")
+        book.writestr("META-INF/container.xml", """<?xml version="1.0"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>""")
+        items = "".join(f'<item id="c{i}" href="text/c{i}.xhtml" media-type="application/xhtml+xml"/>'
+                        for i in range(len(chapters)))
+        # 书脊顺序与文件顺序相反
+        spine = "".join(f'<itemref idref="c{i}"/>' for i in reversed(range(len(chapters))))
+        book.writestr("OEBPS/content.opf", f"""<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>{items}</manifest><spine>{spine}</spine>
+</package>""")
+        for i, (title, body) in enumerate(chapters):
+            book.writestr(f"OEBPS/text/c{i}.xhtml", f"""<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>忽略</title></head><body><h2>{title}</h2><p>{body}</p><p>第二段&amp;结尾</p></body></html>""")
+    buffer.seek(0)
+    return buffer
+
+
+def test_parse_epub():
+    events = list(parse_novel(make_epub([("尾声", "再见"), ("相遇", "你好")]), "book.epub"))
+    assert events == [
+        ("chapter", "相遇", "<p>你好</p>\n<p>第二段&amp;结尾</p>"),
+        ("chapter", "尾声", "<p>再见</p>\n<p>第二段&amp;结尾</p>"),
+    ]
+
+
+def test_parse_epub_without_seekable():
+    class Upload:
+        """模拟 Python 3.11 之前的 SpooledTemporaryFile：可以 seek，但没有 seekable()"""
+
+        def __init__(self, data):
+            self._file = data
+
+        def read(self, *args):
+            return self._file.read(*args)
+
+        def seek(self, *args):
+            return self._file.seek(*args)
+
+        def tell(self):
+            return self._file.tell()
+
+    events = list(parse_novel(Upload(make_epub([("相遇", "你好")])), "book.epub"))
+    assert [title for _, title, _ in events] == ["相遇"]
+
+
+def test_broken_epub():
+    with pytest.raises(NovelParseError):
+        list(parse_novel(io.BytesIO(b"PK\x03\x04broken"), "book.epub"))
@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Project, Volume, Chapter
+from project_stats import count_words, repair_stats, volume_chapters_deleted
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def project(db):
+    project = Project(title="统计测试", genre="玄幻")
+    db.add(project)
+    db.commit()
+    db.add_all([Volume(project_id=project.id, title="第一卷"), Volume(project_id=project.id, title="第二卷")])
+    db.commit()
+    return project
+
+
+def counts(obj):
+    return obj.chapter_count, obj.word_count, obj.last_edited_chapter_id
+
+
+def test_count_words_ignores_markup():
+    assert count_words("<p>第一章&nbsp;开端</p>\n<p><b>你好</b></p>") == len("第一章\xa0开端\n你好")
+    assert count_words(None) == 0
+
+
+def test_counts_follow_chapter_changes(db, project):
+    first, second = project.volumes
+    a = Chapter(project_id=project.id, volume_id=first.id, title="一", word_count=100)
+    b = Chapter(project_id=project.id, volume_id=first.id, title="二", word_count=50)
+    db.add_all([a, b])
+    db.commit()
+    assert counts(project)[:2] == (2, 150)
+    assert counts(first)[:2] == (2, 150)
+    assert project.last_edited_chapter_id in (a.id, b.id)
+
+    a.word_count = 120
+    db.commit()
+    assert counts(project) == (2, 170, a.id)
+
+    # 移动到第二卷：项目计数不变，分卷计数转移
+    b.volume_id = second.id
+    db.commit()
+    assert counts(project) == (2, 170, b.id)
+    assert counts(first) == (1, 120, a.id)
+    assert counts(second) == (1, 50, b.id)
+
+    db.delete(b)
+    db.commit()
+    assert counts(project) == (1, 120, a.id)
+    assert counts(second) == (0, 0, None)
+
+
+def test_rollback_discards_counts(db, project):
+    db.add(Chapter(project_id=project.id, volume_id=project.volumes[0].id, title="一", word_count=10))
+    db.flush()
+    db.rollback()
+    assert counts(project) == (0, 0, None)
+
+
+def test_bulk_volume_delete_and_repair(db, project):
+    first, second = project.volumes
+    a = Chapter(project_id=project.id, volume_id=first.id, title="一", word_count=10)
+    b = Chapter(project_id=project.id, volume_id=second.id, title="二", word_count=20)
+    db.add_all([a, b])
+    db.commit()
+
+    db.query(Chapter).filter(Chapter.volume_id == second.id).delete(synchronize_session=False)
+    volume_chapters_deleted(db, second)
+    db.delete(second)
+    db.commit()
+    assert counts(project) == (1, 10, a.id)
+
+    # 计数被破坏后按批重新统计
+    db.execute(update(Project).values(chapter_count=99, word_count=0, last_edited_chapter_id=None))
+    db.commit()
+    assert repair_stats(db, batch_size=1) >= 1
+    db.expire_all()
+    assert counts(project) == (1, 10, a.id)
+    assert counts(first) == (1, 10, a.id)
@@ -0,0 +1,59 @@
+import asyncio
+
+from rate_limiter import ProviderLimiter, PRIORITY_BATCH, PRIORITY_INTERACTIVE, parse_retry_after
+
+
+def test_concurrency_limit_and_priority():
+    async def scenario():
+        limiter = ProviderLimiter(concurrency=1)
+        first = limiter.enqueue()
+        batch = limiter.enqueue(priority=PRIORITY_BATCH)
+        interactive = limiter.enqueue(priority=PRIORITY_INTERACTIVE)
+        assert first.admitted.done()
+        # 交互式请求排在先到的批量任务前面
+        assert interactive.position == 1 and batch.position == 2
+
+        first.release()
+        assert await interactive.wait(0.1)
+        assert not batch.admitted.done()
+        interactive.release()
+        assert await batch.wait(0.1)
+        assert limiter.stats()["queued_total"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_rpm_bucket_and_retry_after():
+    async def scenario():
+        limiter = ProviderLimiter(rpm=600)  # 每 0.1 秒补充一个请求
+        tickets = [limiter.enqueue() for _ in range(600)]
+        assert all(t.admitted.done() for t in tickets)
+        late = limiter.enqueue()
+        assert not late.admitted.done()
+        assert await late.wait(0.5)
+
+        limiter.throttle(0.2)
+        blocked = limiter.enqueue()
+        assert not await blocked.wait(0.1)
+        assert await blocked.wait(0.5)
+
+    asyncio.run(scenario())
+
+
+def test_cancel_leaves_queue():
+    async def scenario():
+        limiter = ProviderLimiter(concurrency=1)
+        first = limiter.enqueue()
+        waiting = limiter.enqueue()
+        limiter.cancel(waiting)
+        assert limiter.stats()["queued"] == 0
+        first.release()
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) > 0
+    assert parse_retry_after("100000") <= 60
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Project, Volume, Chapter, Worldview, RPGCharacter
+from resource_index import resource_index
+from prompt_utils import resolve_keywords, _query_keywords_batched, _query_keywords_indexed
+
+
+def lookup_resource(db, project_id, keyword):
+    return resolve_keywords(db, project_id, [keyword]).get(keyword)
+
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    session = TestingSessionLocal()
+    resource_index.invalidate()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def project(db):
+    project = Project(title="索引测试", genre="玄幻")
+    db.add(project)
+    db.commit()
+    volume = Volume(project_id=project.id, title="第一卷", description="卷简介")
+    db.add(volume)
+    db.commit()
+    db.add_all([
+        RPGCharacter(project_id=project.id, name="张三", content="主角"),
+        Chapter(project_id=project.id, volume_id=volume.id, title="第1章 出山", content="正文一"),
+        Chapter(project_id=project.id, volume_id=volume.id, title="第2章 下山", content="正文二"),
+        Worldview(project_id=project.id, content="修仙世界"),
+    ])
+    db.commit()
+    return project
+
+
+def test_lookup_uses_index(db, project):
+    """索引按原有优先级解析关键词"""
+    assert lookup_resource(db, project.id, "张三") == "主角"
+    assert lookup_resource(db, project.id, "第2章") == "正文二"
+    assert lookup_resource(db, project.id, "第一卷") == "卷简介"
+    assert lookup_resource(db, project.id, "索引测试") == "索引测试"
+    assert lookup_resource(db, project.id, "不存在") is None
+    assert resource_index.get(db, project.id).worldview == "修仙世界"
+
+
+def test_index_follows_commits(db, project):
+    """提交后的创建、更新、删除会同步到已加载的索引"""
+    resource_index.get(db, project.id)
+    version = resource_index.version(project.id)
+
+    character = db.query(RPGCharacter).filter(RPGCharacter.project_id == project.id).first()
+    character.name = "李四"
+    db.add(RPGCharacter(project_id=project.id, name="王五", content="配角"))
+    db.commit()
+
+    assert resource_index.version(project.id) > version
+    assert lookup_resource(db, project.id, "张三") is None
+    assert lookup_resource(db, project.id, "李四") == "主角"
+    assert lookup_resource(db, project.id, "王五") == "配角"
+
+    db.delete(character)
+    db.commit()
+    assert lookup_resource(db, project.id, "李四") is None
+
+
+def test_rollback_discards_pending_changes(db, project):
+    resource_index.get(db, project.id)
+    db.add(RPGCharacter(project_id=project.id, name="赵六", content="路人"))
+    db.flush()
+    db.rollback()
+    assert lookup_resource(db, project.id, "赵六") is None
+
+
+def test_batched_query_matches_index(db, project):
+    """不使用常驻索引时，单条 UNION ALL 查询的解析结果与索引一致"""
+    keywords = ["张三", "第1章", "第", "第一卷", "索引测试", "世界观", "不存在", "100%"]
+    batched = _query_keywords_batched(db, project.id, keywords)
+    assert batched == _query_keywords_indexed(db, project.id, keywords)
+    assert batched["第"] == "正文一"
+    assert batched["世界观"] == "修仙世界"
+    assert "不存在" not in batched
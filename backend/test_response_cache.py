@@ -0,0 +1,44 @@
+from response_cache import ResponseCache, cache_key
+
+
+def test_policy():
+    assert not ResponseCache(policy="off").enabled_for(0, True)
+    assert ResponseCache(policy="request").enabled_for(0.7, True)
+    assert not ResponseCache(policy="request").enabled_for(0, None)
+    assert ResponseCache(policy="deterministic").enabled_for(0, None)
+    assert not ResponseCache(policy="deterministic").enabled_for(0.7, None)
+    assert not ResponseCache(policy="always").enabled_for(0, False)
+
+
+def test_key_depends_on_parameters():
+    messages = [{"role": "user", "content": "你好"}]
+    key = cache_key(1, "gpt", messages, 0, 100)
+    assert key == cache_key(1, "gpt", [dict(m) for m in messages], 0, 100)
+    assert key != cache_key(1, "gpt", messages, 0.5, 100)
+    assert key != cache_key(1, "gpt", messages, 0, 200)
+    assert key != cache_key(1, "other", messages, 0, 100)
+
+
+def test_lru_and_ttl(monkeypatch):
+    cache = ResponseCache(policy="always", max_size=2, ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("response_cache.time.time", lambda: now[0])
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a")["content"] == "A"
+    cache.put("c", "C")  # 淘汰最久未使用的 b
+    assert cache.get("b") is None
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_disk_tier(tmp_path):
+    ResponseCache(policy="always", disk_dir=str(tmp_path)).put("k" * 64, "磁盘", "思考")
+    # 新实例（例如重启后）从磁盘读取
+    cache = ResponseCache(policy="always", disk_dir=str(tmp_path))
+    entry = cache.get("k" * 64)
+    assert entry["content"] == "磁盘" and entry["thinking"] == "思考"
+    assert cache.stats()["disk_hits"] == 1
+    cache.clear()
+    assert ResponseCache(policy="always", disk_dir=str(tmp_path)).get("k" * 64) is None
@@ -0,0 +1,58 @@
+import asyncio
+
+from sse_decoder import SSEDecoder, SSEEvent, aiter_sse
+
+
+def decode(chunks):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    return events + decoder.close(), decoder
+
+
+def test_full_grammar():
+    stream = (
+        b"\xef\xbb\xbf: keep-alive\r\n"
+        b"retry: 3000\r\n"
+        b"event: delta\r\nid: 7\r\ndata: {\"a\":\r\ndata:  1}\r\n\r\n"
+        # 单个空的 data 行不分派事件，两个空 data 行的数据是一个换行
+        b"data\n\n"
+        b"data:\n\n"
+        b"data:\ndata:\n\n"
+        b"event: ignored-without-data\n\n"
+        b"data: x\rdata: y\r\r"
+        b"unknown: field\n"
+        b"data: tail"
+    )
+    events, decoder = decode([stream])
+    assert events == [
+        SSEEvent("delta", '{"a":\n 1}', "7", 3000),
+        SSEEvent("message", "\n", "7", 3000),
+        SSEEvent("message", "x\ny", "7", 3000),
+        SSEEvent("message", "tail", "7", 3000),
+    ]
+    assert decoder.comments == 1
+
+
+def test_invalid_retry_is_ignored():
+    events, decoder = decode([b"retry: 500\n", "retry: \u00b2\nretry: 1a\ndata: x\n\n".encode()])
+    assert events == [SSEEvent("message", "x", None, 500)]
+
+
+def test_split_at_every_byte():
+    stream = "data: 你好\r\n\r\nevent: done\ndata: [DONE]\n\n".encode()
+    # 逐字节输入：跨块的 CRLF 和多字节字符都不能被拆坏
+    events, _ = decode([stream[i:i + 1] for i in range(len(stream))])
+    assert [(e.event, e.data) for e in events] == [("message", "你好"), ("done", "[DONE]")]
+
+
+def test_aiter_sse():
+    async def chunks():
+        yield b"data: {\"choices\": []}\n"
+        yield b"\ndata: [DONE]\n\n"
+
+    async def collect():
+        return [e.data async for e in aiter_sse(chunks())]
+
+    assert asyncio.run(collect()) == ['{"choices": []}', "[DONE]"]
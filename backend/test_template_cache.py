@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import Project, PromptTemplate, RPGCharacter
+from prompt_utils import render_prompt_template, prompt_renderer
+from template_cache import compile_template, template_cache, Placeholder
+
+engine = create_engine(
+    "sqlite://",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    session = TestingSessionLocal()
+    template_cache.invalidate()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_compile_template_segments():
+    compiled = compile_template("你好{{ 张三 }}，{{世界观}}{{张三}}")
+    assert compiled.variables == ["张三", "世界观"]
+    assert compiled.segments == (
+        "你好", Placeholder("张三", "{{ 张三 }}"), "，",
+        Placeholder("世界观", "{{世界观}}"), Placeholder("张三", "{{张三}}"),
+    )
+    assert compiled.render({"张三": "A"}) == "你好A，{{世界观}}A"
+    assert not compile_template("纯文本").has_placeholders
+
+
+def test_repeated_render_skips_database(db):
+    project = Project(title="缓存测试", genre="都市")
+    db.add(project)
+    db.commit()
+    db.add(RPGCharacter(project_id=project.id, name="张三", content="主角"))
+    template = PromptTemplate(name="t", content="角色：{{张三}}")
+    db.add(template)
+    db.commit()
+
+    assert render_prompt_template(db, template.id, project.id) == "角色：主角"
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert render_prompt_template(db, template.id, project.id) == "角色：主角"
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == []
+
+    # 资源和模板的变更都会使缓存失效
+    character = db.query(RPGCharacter).filter(RPGCharacter.project_id == project.id).first()
+    character.content = "主人公"
+    db.commit()
+    assert render_prompt_template(db, template.id, project.id) == "角色：主人公"
+
+    template.content = "名字：{{张三}}"
+    db.commit()
+    assert render_prompt_template(db, template.id, project.id) == "名字：主人公"
+
+
+def test_renderer_stats(db):
+    project = Project(title="统计测试", genre="都市")
+    db.add(project)
+    db.commit()
+    db.add(RPGCharacter(project_id=project.id, name="李四", content="配角"))
+    db.commit()
+
+    rendered, stats = prompt_renderer.render_content(db, "没有占位符", project.id)
+    assert rendered == "没有占位符"
+    assert stats.fast_path and stats.queries == 0
+
+    rendered, stats = prompt_renderer.render_content(db, "{{李四}}/{{选择文字}}/{{无}}", project.id, "选中")
+    assert rendered == "配角/选中/{{无}}"
+    assert stats.placeholders == 3 and stats.resolved == 2
+    assert stats.queries >= 1
+    assert prompt_renderer.metrics()["renders"] >= 2
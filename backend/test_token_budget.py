@@ -0,0 +1,42 @@
+import pytest
+
+from models import AIModel
+from template_cache import compile_template
+from token_budget import assemble_messages, token_counter, estimate_tokens, PromptBudgetExceeded
+
+
+def test_token_counts_are_cached():
+    text = "第一章 少年出山。" * 20
+    token_counter.count(text)
+    hits = token_counter.hits
+    assert token_counter.count(text) == estimate_tokens(text)
+    assert token_counter.hits == hits + 1
+
+
+def test_no_budget_keeps_everything():
+    compiled = compile_template("设定：{{世界观}}")
+    history = [{"role": "user", "content": "旧问题"}, {"role": "assistant", "content": "旧回答"}]
+    messages, breakdown = assemble_messages(compiled, {"世界观": "修仙"}, history, "新问题", AIModel(max_tokens=100))
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[0]["content"] == "设定：修仙"
+    assert breakdown["budget"] is None
+    assert breakdown["total"] == breakdown["system"] + breakdown["history"] + breakdown["message"]
+
+
+def test_history_dropped_before_resources_truncated():
+    compiled = compile_template("{{世界观}}\n{{第1章}}")
+    values = {"世界观": "世" * 50, "第1章": "章" * 400}
+    history = [{"role": "user", "content": "问" * 100}, {"role": "assistant", "content": "答" * 20}]
+    model = AIModel(context_window=300, max_tokens=100)
+
+    messages, breakdown = assemble_messages(compiled, values, history, "继续写", model, 100)
+
+    assert breakdown["history_dropped"] == 2
+    assert breakdown["truncated_resources"] == ["第1章"]
+    assert breakdown["total"] <= breakdown["budget"] == 200
+    assert messages[0]["content"].startswith("世" * 50)
+
+
+def test_budget_exceeded_by_message_alone():
+    with pytest.raises(PromptBudgetExceeded):
+        assemble_messages(None, None, [], "长" * 500, AIModel(context_window=200, max_tokens=100), 100)
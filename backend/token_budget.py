@@ -0,0 +1,191 @@
+"""
+按 Token 预算组装提示词
+
+系统提示词、历史消息和展开后的资源正文按段计数（计数结果按内容哈希缓存），
+在发送给 AI 提供商之前保证总量不超过模型的上下文窗口减去预留的输出 Token。
+超出时先丢弃最早的历史消息，再从最长的资源正文开始截断；世界观和选择文字最后才截断。
+"""
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from template_cache import CompiledTemplate
+
+# 模型未配置上下文窗口时使用的默认值，0 表示不限制
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "0"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD = 4
+TRUNCATION_MARK = "\n……（内容过长，已截断）"
+
+# 截断顺序靠后的占位符
+_PROTECTED_KEYWORDS = ("世界观", "选择文字")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken 是可选依赖
+    _encoding = None
+
+
+class PromptBudgetExceeded(Exception):
+    """即使裁剪全部可裁剪内容后仍超出上下文窗口"""
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or
+        0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 Token 数：安装了 tiktoken 时精确计算，否则中文按字、其他字符按 4 个一组估算"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class TokenCounter:
+    """按内容哈希缓存 Token 计数，历史消息和资源正文在多轮对话中会反复出现"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+        tokens = estimate_tokens(text)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+token_counter = TokenCounter()
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按比例截断文本，使其不超过 max_tokens"""
+    if max_tokens <= 0:
+        return TRUNCATION_MARK.strip()
+    tokens = token_counter.count(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(0, int(len(text) * max_tokens / tokens) - len(TRUNCATION_MARK))
+    truncated = text[:keep] + TRUNCATION_MARK
+    while keep > 0 and estimate_tokens(truncated) > max_tokens:
+        keep = int(keep * 0.9)
+        truncated = text[:keep] + TRUNCATION_MARK
+    return truncated
+
+
+def context_budget(ai_model, max_tokens: Optional[int]) -> Dict[str, Optional[int]]:
+    """根据模型的上下文窗口和预留的输出 Token 计算输入预算"""
+    context_window = getattr(ai_model, "context_window", None) or DEFAULT_CONTEXT_WINDOW or None
+    reserved = max_tokens or 0
+    budget = max(context_window - reserved, 0) if context_window else None
+    return {"context_window": context_window, "reserved_output": reserved, "budget": budget}
+
+
+def assemble_messages(
+    compiled: Optional[CompiledTemplate],
+    values: Optional[Dict[str, str]],
+    history: List[dict],
+    message: str,
+    ai_model=None,
+    max_tokens: Optional[int] = None,
+):
+    """
+    组装发送给模型的消息列表，返回 (messages, breakdown)。
+    breakdown 记录各部分的 Token 数和裁剪情况，超出预算且无法裁剪时抛出 PromptBudgetExceeded。
+    """
+    values = dict(values or {})
+    history = [{"role": msg["role"], "content": msg["content"]} for msg in history]
+    limits = context_budget(ai_model, max_tokens)
+    budget = limits["budget"]
+
+    def system_text():
+        return compiled.render(values) if compiled is not None else None
+
+    def measure(system, history_msgs):
+        system_tokens = token_counter.count(system) + MESSAGE_OVERHEAD if system else 0
+        history_tokens = sum(token_counter.count(m["content"]) + MESSAGE_OVERHEAD for m in history_msgs)
+        return system_tokens, history_tokens
+
+    message_tokens = token_counter.count(message) + MESSAGE_OVERHEAD
+    system = system_text()
+    system_tokens, history_tokens = measure(system, history)
+    dropped_history = 0
+    truncated = []
+
+    if budget is not None:
+        # 1. 从最早的历史消息开始丢弃
+        while history and system_tokens + history_tokens + message_tokens > budget:
+            removed = history.pop(0)
+            history_tokens -= token_counter.count(removed["content"]) + MESSAGE_OVERHEAD
+            dropped_history += 1
+
+        # 2. 截断资源正文：先长后短，世界观和选择文字最后
+        overflow = system_tokens + history_tokens + message_tokens - budget
+        if overflow > 0 and compiled is not None:
+            order = sorted(
+                (k for k in compiled.variables if values.get(k)),
+                key=lambda k: (k in _PROTECTED_KEYWORDS, -token_counter.count(values[k])),
+            )
+            for keyword in order:
+                if overflow <= 0:
+                    break
+                # 同一占位符可能在模板中出现多次
+                occurrences = sum(1 for seg in compiled.segments if not isinstance(seg, str) and seg.keyword == keyword)
+                current = token_counter.count(values[keyword])
+                target = max(current - math.ceil(overflow / max(occurrences, 1)), 0)
+                values[keyword] = _truncate_to_tokens(values[keyword], target)
+                truncated.append(keyword)
+                system = system_text()
+                system_tokens, _ = measure(system, [])
+                overflow = system_tokens + history_tokens + message_tokens - budget
+
+        if system_tokens + history_tokens + message_tokens > budget:
+            raise PromptBudgetExceeded(
+                f"提示词超出模型上下文窗口：需要约 {system_tokens + history_tokens + message_tokens} 个Token，"
+                f"可用 {budget} 个（上下文窗口 {limits['context_window']}，预留输出 {limits['reserved_output']}）"
+            )
+
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.extend(history)
+    messages.append({"role": "user", "content": message})
+
+    breakdown = {
+        "system": system_tokens,
+        "history": history_tokens,
+        "message": message_tokens,
+        "total": system_tokens + history_tokens + message_tokens,
+        **limits,
+        "history_dropped": dropped_history,
+        "truncated_resources": truncated,
+    }
+    return messages, breakdown
@@ -0,0 +1,31 @@
+"""
+回填 prompt_templates 表的 variables 字段
+新建和更新模板时会自动写入，此脚本用于处理已有的模板
+"""
+from database import SessionLocal
+from models import PromptTemplate
+from template_cache import template_variables
+
+def update_template_variables():
+    """为所有模板写入占位符列表"""
+    db = SessionLocal()
+    try:
+        templates = db.query(PromptTemplate).all()
+        updated = 0
+        for template in templates:
+            variables = template_variables(template.content)
+            if template.variables != variables:
+                template.variables = variables
+                updated += 1
+
+        db.commit()
+        print(f"✓ 已更新 {updated} 个模板的 variables 字段（共 {len(templates)} 个）")
+
+    except Exception as e:
+        print(f"更新模板变量时出错: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    update_template_variables()